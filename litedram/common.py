@@ -15,12 +15,13 @@ from litex.soc.interconnect import stream
 # Helpers ------------------------------------------------------------------------------------------
 
 burst_lengths = {
-    "SDR":   1,
-    "DDR":   4,
-    "LPDDR": 4,
-    "DDR2":  4,
-    "DDR3":  8,
-    "DDR4":  8
+    "SDR":    1,
+    "DDR":    4,
+    "LPDDR":  4,
+    "DDR2":   4,
+    "DDR3":   8,
+    "DDR4":   8,
+    "LPDDR3": 8
 }
 
 def get_cl_cw(memtype, tck):
@@ -38,6 +39,11 @@ def get_cl_cw(memtype, tck):
         f_to_cl_cwl[1600e6] = (11, 8)
     elif memtype == "DDR4":
         f_to_cl_cwl[1600e6] = (11,  9)
+    elif memtype == "LPDDR3":
+        f_to_cl_cwl[800e6]  = ( 6, 3)
+        f_to_cl_cwl[1066e6] = ( 8, 4)
+        f_to_cl_cwl[1333e6] = (10, 6)
+        f_to_cl_cwl[1600e6] = (12, 6)
     else:
         raise ValueError
     for f, (cl, cwl) in f_to_cl_cwl.items():
@@ -53,6 +59,30 @@ def get_sys_phases(nphases, sys_latency, cas_latency):
     cmd_phase = (dat_phase - 1)%nphases
     return cmd_phase, dat_phase
 
+def get_turnarounds(memtype, cl, cwl, twtr=0, trtrs=None):
+    """Get the minimal read/write turnarounds (in memory clk cycles)
+
+    Return the (rtw, wtr, rtw_rank, wtr_rank, ccd_rank) minimal spacings between a read and a write
+    command and between a write and a read command, issued to the same rank or to different ranks,
+    and between two reads or two writes issued to different ranks. The spacings ensure the data
+    bursts do not overlap on the data bus and include the write recovery (twtr) on the same rank and
+    the rank to rank switch (trtrs) on different ranks.
+    """
+    if memtype == "SDR":
+        burst = burst_lengths[memtype]
+        cwl   = 0 # Write data is presented with the command.
+        gap   = 1
+    else:
+        burst = burst_lengths[memtype]//2
+        gap   = 2
+    trtrs = gap if trtrs is None else max(trtrs, gap)
+    rtw      = cl + burst + gap - cwl
+    wtr      = cwl + burst + twtr
+    rtw_rank = cl + burst + trtrs - cwl
+    wtr_rank = max(cwl + burst + trtrs - cl, 1)
+    ccd_rank = burst + trtrs
+    return rtw, wtr, rtw_rank, wtr_rank, ccd_rank
+
 # PHY Pads Transformers ----------------------------------------------------------------------------
 
 class PHYPadsCombiner:
@@ -127,18 +157,19 @@ class PhySettings(Settings):
 
 
 class GeomSettings(Settings):
-    def __init__(self, bankbits, rowbits, colbits):
+    def __init__(self, bankbits, rowbits, colbits, groupbits=0):
         self.set_attributes(locals())
         self.addressbits = max(rowbits, colbits)
 
 
 class TimingSettings(Settings):
-    def __init__(self, tRP, tRCD, tWR, tWTR, tREFI, tRFC, tFAW, tCCD, tRRD, tRC, tRAS, tZQCS):
+    def __init__(self, tRP, tRCD, tWR, tWTR, tREFI, tRFC, tFAW, tCCD, tRRD, tRC, tRAS, tZQCS, tRFCpb=None,
+                 tCCD_L=None, tRRD_L=None, tRTRS=None):
         self.set_attributes(locals())
 
 # Layouts/Interface --------------------------------------------------------------------------------
 
-def cmd_layout(address_width):
+def cmd_layout(address_width, len_width=0):
     return [
         ("valid",            1, DIR_M_TO_S),
         ("ready",            1, DIR_S_TO_M),
@@ -148,7 +179,7 @@ def cmd_layout(address_width):
 
         ("wdata_ready",      1, DIR_S_TO_M),
         ("rdata_valid",      1, DIR_S_TO_M)
-    ]
+    ] + ([("len", len_width, DIR_M_TO_S)] if len_width else [])
 
 def data_layout(data_width):
     return [
@@ -157,11 +188,11 @@ def data_layout(data_width):
         ("rdata",       data_width, DIR_S_TO_M)
     ]
 
-def cmd_description(address_width):
+def cmd_description(address_width, len_width=0):
     return [
         ("we",   1),
         ("addr", address_width)
-    ]
+    ] + ([("len", len_width)] if len_width else [])
 
 def wdata_description(data_width):
     return [
@@ -169,8 +200,8 @@ def wdata_description(data_width):
         ("we",   data_width//8)
     ]
 
-def rdata_description(data_width):
-    return [("data", data_width)]
+def rdata_description(data_width, id_width=0):
+    return [("data", data_width)] + ([("id", id_width)] if id_width else [])
 
 def cmd_request_layout(a, ba):
     return [
@@ -195,25 +226,34 @@ class LiteDRAMInterface(Record):
         self.address_align = address_align
         self.address_width = settings.geom.rowbits + settings.geom.colbits + rankbits - address_align
         self.data_width    = settings.phy.dfi_databits*settings.phy.nphases
+        # Bursts are expanded in a row: cmd_max_len must be a power of 2 not larger than a row (the
+        # commands must then not cross a cmd_max_len aligned boundary).
+        assert settings.cmd_max_len == 2**log2_int(settings.cmd_max_len, False)
+        assert settings.cmd_max_len <= 2**(settings.geom.colbits - address_align)
+        # With ROW_COL_BANK, consecutive addresses are in different banks: no bursts.
+        assert settings.cmd_max_len == 1 or settings.address_mapping != "ROW_COL_BANK"
+        self.len_width     = log2_int(settings.cmd_max_len)
         self.nbanks   = settings.phy.nranks*(2**settings.geom.bankbits)
         self.nranks   = settings.phy.nranks
         self.settings = settings
 
-        layout = [("bank"+str(i), cmd_layout(self.address_width)) for i in range(self.nbanks)]
+        layout = [("bank"+str(i), cmd_layout(self.address_width, self.len_width))
+            for i in range(self.nbanks)]
         layout += data_layout(self.data_width)
         Record.__init__(self, layout)
 
 # Ports --------------------------------------------------------------------------------------------
 
 class LiteDRAMNativePort(Settings):
-    def __init__(self, mode, address_width, data_width, clock_domain="sys", id=0):
+    def __init__(self, mode, address_width, data_width, clock_domain="sys", id=0, rdata_id_width=0,
+        len_width=0):
         self.set_attributes(locals())
 
         self.lock = Signal()
 
-        self.cmd   = stream.Endpoint(cmd_description(address_width))
+        self.cmd   = stream.Endpoint(cmd_description(address_width, len_width))
         self.wdata = stream.Endpoint(wdata_description(data_width))
-        self.rdata = stream.Endpoint(rdata_description(data_width))
+        self.rdata = stream.Endpoint(rdata_description(data_width, rdata_id_width))
 
         self.flush = Signal()
 
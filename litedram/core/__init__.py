@@ -1,22 +1,27 @@
+from copy import copy
+
 from migen import *
 
 from litex.soc.interconnect.csr import AutoCSR
 
 from litedram.dfii import DFIInjector
 from litedram.core.controller import ControllerSettings, LiteDRAMController
-from litedram.core.crossbar import LiteDRAMCrossbar
+from litedram.core.crossbar import LiteDRAMCrossbar, LiteDRAMMultiChannelCrossbar
 
 # Core ---------------------------------------------------------------------------------------------
 
 class LiteDRAMCore(Module, AutoCSR):
-    def __init__(self, phy, geom_settings, timing_settings, clk_freq, **kwargs):
-        self.submodules.dfii = DFIInjector(
-            addressbits = geom_settings.addressbits,
-            bankbits    = geom_settings.bankbits,
-            nranks      = phy.settings.nranks,
-            databits    = phy.settings.dfi_databits,
-            nphases     = phy.settings.nphases)
-        self.comb += self.dfii.master.connect(phy.dfi)
+    def __init__(self, phy, geom_settings, timing_settings, clk_freq, with_dfii=True, **kwargs):
+        # Without the DFIInjector, there is no software control of the DFI (initialization sequence),
+        # e.g. for the simulation models.
+        if with_dfii:
+            self.submodules.dfii = DFIInjector(
+                addressbits = geom_settings.addressbits,
+                bankbits    = geom_settings.bankbits,
+                nranks      = phy.settings.nranks,
+                databits    = phy.settings.dfi_databits,
+                nphases     = phy.settings.nphases)
+            self.comb += self.dfii.master.connect(phy.dfi)
 
         self.submodules.controller = controller = LiteDRAMController(
             phy_settings    = phy.settings,
@@ -24,6 +29,30 @@ class LiteDRAMCore(Module, AutoCSR):
             timing_settings = timing_settings,
             clk_freq        = clk_freq,
             **kwargs)
-        self.comb += controller.dfi.connect(self.dfii.slave)
+        self.comb += controller.dfi.connect(self.dfii.slave if with_dfii else phy.dfi)
 
         self.submodules.crossbar = LiteDRAMCrossbar(controller.interface)
+
+# Multi-Channel Core -------------------------------------------------------------------------------
+
+class LiteDRAMMultiChannelCore(Module, AutoCSR):
+    """LiteDRAM Multi-Channel Core
+
+    Run a LiteDRAMCore (independent controller) on each phy (channel) and expose them behind a
+    single crossbar interleaving the addresses over the channels with a granularity (in bytes)
+    stripe. The channels share the geometry/timings/controller settings.
+    """
+    def __init__(self, phys, geom_settings, timing_settings, clk_freq, granularity=256, **kwargs):
+        self.channels = []
+        for n, phy in enumerate(phys):
+            channel_kwargs = dict(kwargs)
+            if "controller_settings" in kwargs:
+                # The controller completes its settings with the phy/geom/timing settings.
+                channel_kwargs["controller_settings"] = copy(kwargs["controller_settings"])
+            channel = LiteDRAMCore(phy, geom_settings, timing_settings, clk_freq, **channel_kwargs)
+            setattr(self.submodules, "channel{}".format(n), channel)
+            self.channels.append(channel)
+
+        self.submodules.crossbar = LiteDRAMMultiChannelCrossbar(
+            crossbars   = [channel.crossbar for channel in self.channels],
+            granularity = granularity)
@@ -5,8 +5,13 @@
 """LiteDRAM BankMachine (Rows/Columns management)."""
 
 import math
+from functools import reduce
+from operator import or_
 
 from migen import *
+from migen.genlib import roundrobin
+from migen.genlib.misc import WaitTimer
+from migen.genlib.coding import PriorityEncoder
 
 from litex.soc.interconnect import stream
 
@@ -31,10 +36,39 @@ class _AddressSlicer:
 # BankMachine --------------------------------------------------------------------------------------
 
 class BankMachine(Module):
-    def __init__(self, n, address_width, address_align, nranks, settings):
-        self.req = req = Record(cmd_layout(address_width))
+    """BankMachine
+
+    Manage the rows/columns of a bank: open/close the rows and issue the read/write commands.
+
+    The rows are closed according to the page policy of the settings:
+    - "OPEN": keep the row opened until a command targets another row.
+    - "CLOSED": close the row (with auto-precharge) after each access unless the next command of
+    the buffer targets the same row.
+    - "ADAPTIVE": use a row hit history predictor to decide if the row should be closed when the
+    command buffer becomes empty and close the row after page_timeout idle cycles.
+
+    With with_spec_activate, the row is closed (with auto-precharge) after an access to its
+    last column when no other command is buffered and the next row is speculatively activated, which
+    hides tRP/tRCD for the sequential row-crossing streams.
+
+    With len_width, the commands carry a burst length (len + 1 accesses) and are expanded into
+    consecutive column accesses of the row (the column address wraps at the end of the row).
+
+    n is the bank address of the BankMachine, it can be a Signal when the BankMachine is allocated
+    dynamically to the banks by a BankMachinePool: release then closes the opened row of the idle
+    BankMachine and free indicates the BankMachine can be allocated to another bank.
+    """
+    def __init__(self, n, address_width, address_align, nranks, settings, len_width=0):
+        assert settings.page_policy in ["OPEN", "CLOSED", "ADAPTIVE"]
+        self.req = req = Record(cmd_layout(address_width, len_width))
         self.refresh_req = refresh_req = Signal()
         self.refresh_gnt = refresh_gnt = Signal()
+        self.write_count = write_count = Signal(max=settings.cmd_buffer_depth + 2)
+        self.row_hit_event      = Signal()
+        self.row_miss_event     = Signal()
+        self.row_conflict_event = Signal()
+        self.release = release = Signal()
+        self.free    = free    = Signal()
 
         a  = settings.geom.addressbits
         ba = settings.geom.bankbits + log2_int(nranks)
@@ -43,36 +77,85 @@ class BankMachine(Module):
         # # #
 
         auto_precharge = Signal()
+        burst_last     = Signal(reset=1)
 
         # Command buffer ---------------------------------------------------------------------------
         cmd_buffer_layout    = [("we", 1), ("addr", len(req.addr))]
+        cmd_buffer_keep      = {"valid", "ready", "we", "addr"}
+        if len_width:
+            cmd_buffer_layout += [("len", len_width)]
+            cmd_buffer_keep   |= {"len"}
         cmd_buffer_lookahead = stream.SyncFIFO(
             cmd_buffer_layout, settings.cmd_buffer_depth,
             buffered=settings.cmd_buffer_buffered)
         cmd_buffer = stream.Buffer(cmd_buffer_layout) # 1 depth buffer to detect row change
         self.submodules += cmd_buffer_lookahead, cmd_buffer
         self.comb += [
-            req.connect(cmd_buffer_lookahead.sink, keep={"valid", "ready", "we", "addr"}),
+            req.connect(cmd_buffer_lookahead.sink, keep=cmd_buffer_keep),
             cmd_buffer_lookahead.source.connect(cmd_buffer.sink),
-            cmd_buffer.source.ready.eq(req.wdata_ready | req.rdata_valid),
+            cmd_buffer.source.ready.eq((req.wdata_ready | req.rdata_valid) & burst_last),
             req.lock.eq(cmd_buffer_lookahead.source.valid | cmd_buffer.source.valid),
         ]
 
+        # Burst expansion: the command is kept in the buffer until its last access is issued (the
+        # commands do not cross a cmd_max_len aligned boundary, so the burst stays in the row).
+        burst_addr = Signal(len(req.addr))
+        if len_width:
+            beat = Signal(len_width)
+            self.comb += [
+                burst_last.eq(beat == cmd_buffer.source.len),
+                burst_addr.eq(cmd_buffer.source.addr + beat)
+            ]
+            self.sync += \
+                If(req.wdata_ready | req.rdata_valid,
+                    If(burst_last,
+                        beat.eq(0)
+                    ).Else(
+                        beat.eq(beat + 1)
+                    )
+                )
+        else:
+            self.comb += burst_addr.eq(cmd_buffer.source.addr)
+
+        # Number of writes in the command buffer (used by the Multiplexer for the write drain)
+        write_push = Signal()
+        write_pop  = Signal()
+        self.comb += [
+            write_push.eq(req.valid & req.ready & req.we),
+            write_pop.eq(cmd_buffer.source.valid & cmd_buffer.source.ready & cmd_buffer.source.we),
+        ]
+        self.sync += \
+            If(write_push & ~write_pop,
+                write_count.eq(write_count + 1)
+            ).Elif(write_pop & ~write_push,
+                write_count.eq(write_count - 1)
+            )
+
         slicer = _AddressSlicer(settings.geom.colbits, address_align)
 
         # Row tracking -----------------------------------------------------------------------------
-        row        = Signal(settings.geom.rowbits)
-        row_opened = Signal()
-        row_hit    = Signal()
-        row_open   = Signal()
-        row_close  = Signal()
-        self.comb += row_hit.eq(row == slicer.row(cmd_buffer.source.addr))
+        row         = Signal(settings.geom.rowbits)
+        row_opened  = Signal()
+        row_hit     = Signal()
+        row_open    = Signal()
+        row_close   = Signal()
+        act_row     = Signal(settings.geom.rowbits) # Row to activate
+        speculative = Signal()                      # Speculative activate of spec_row pending
+        spec_row    = Signal(settings.geom.rowbits)
+        self.comb += [
+            row_hit.eq(row == slicer.row(cmd_buffer.source.addr)),
+            If(cmd_buffer.source.valid,
+                act_row.eq(slicer.row(cmd_buffer.source.addr))
+            ).Else(
+                act_row.eq(spec_row)
+            )
+        ]
         self.sync += \
             If(row_close,
                 row_opened.eq(0)
             ).Elif(row_open,
                 row_opened.eq(1),
-                row.eq(slicer.row(cmd_buffer.source.addr))
+                row.eq(act_row)
             )
 
         # Address generation -----------------------------------------------------------------------
@@ -80,9 +163,9 @@ class BankMachine(Module):
         self.comb += [
             cmd.ba.eq(n),
             If(row_col_n_addr_sel,
-                cmd.a.eq(slicer.row(cmd_buffer.source.addr))
+                cmd.a.eq(act_row)
             ).Else(
-                cmd.a.eq((auto_precharge << 10) | slicer.col(cmd_buffer.source.addr))
+                cmd.a.eq((auto_precharge << 10) | slicer.col(burst_addr))
             )
         ]
 
@@ -110,12 +193,120 @@ class BankMachine(Module):
                     )
                 )
 
+        # Page policy ------------------------------------------------------------------------------
+        next_row_hit = Signal()
+        page_close   = Signal() # Close the idle opened row
+        self.comb += next_row_hit.eq(cmd_buffer_lookahead.source.valid &
+            (slicer.row(cmd_buffer_lookahead.source.addr) == slicer.row(cmd_buffer.source.addr)))
+
+        if settings.page_policy == "CLOSED":
+            self.comb += \
+                If(cmd_buffer.source.valid & ~next_row_hit,
+                    auto_precharge.eq(row_close == 0)
+                )
+
+        if settings.page_policy == "ADAPTIVE":
+            cmd_accept    = Signal()
+            cas_accept    = Signal()
+            act_accept    = Signal()
+            pre_accept    = Signal()
+            first_cas     = Signal()
+            closed_early  = Signal()
+            predict_hit   = Signal()
+            history       = Signal(2, reset=0b10)
+            history_inc   = Signal()
+            history_dec   = Signal()
+            self.comb += [
+                cmd_accept.eq(cmd.valid & cmd.ready),
+                cas_accept.eq(cmd_accept & cmd.cas),
+                act_accept.eq(cmd_accept & row_open),
+                pre_accept.eq(cmd_accept & cmd.ras & cmd.we & ~cmd.cas),
+            ]
+
+            # Row hit history: 2-bit saturating counter, predicts row hits when MSB is set.
+            # - Incremented on row hits and when an early closed row is re-opened.
+            # - Decremented when the row is closed for a conflict or after the idle timeout.
+            self.comb += [
+                predict_hit.eq(history[1]),
+                history_inc.eq(
+                    (cas_accept & ~first_cas) |
+                    (act_accept & closed_early & (row == slicer.row(cmd_buffer.source.addr)))),
+                history_dec.eq(
+                    pre_accept |
+                    (cas_accept & auto_precharge & cmd_buffer_lookahead.source.valid))
+            ]
+            self.sync += [
+                If(history_inc & ~history_dec,
+                    If(history != 0b11, history.eq(history + 1))
+                ).Elif(history_dec & ~history_inc,
+                    If(history != 0b00, history.eq(history - 1))
+                ),
+                If(act_accept,
+                    first_cas.eq(1),
+                    closed_early.eq(0)
+                ).Elif(cas_accept,
+                    first_cas.eq(0),
+                    If(auto_precharge & ~cmd_buffer_lookahead.source.valid,
+                        closed_early.eq(1)
+                    )
+                ).Elif(pre_accept & ~cmd_buffer.source.valid,
+                    closed_early.eq(1)
+                )
+            ]
+
+            # Close the row with the last command of the buffer when no row hit is predicted.
+            self.comb += \
+                If(cmd_buffer.source.valid & ~cmd_buffer_lookahead.source.valid & ~predict_hit,
+                    auto_precharge.eq(row_close == 0)
+                )
+
+            # Close the row after page_timeout idle cycles.
+            idle_timer = WaitTimer(settings.page_timeout)
+            self.submodules += idle_timer
+            self.comb += [
+                idle_timer.wait.eq(row_opened & ~cmd_buffer.source.valid & ~refresh_req),
+                page_close.eq(idle_timer.done)
+            ]
+
+        # Speculative activate ---------------------------------------------------------------------
+        if settings.with_spec_activate:
+            spec_close = Signal()
+            col_last   = 2**(settings.geom.colbits - address_align) - 1
+            self.comb += [
+                spec_close.eq(cmd_buffer.source.valid & ~cmd_buffer_lookahead.source.valid &
+                    (burst_addr[:settings.geom.colbits - address_align] == col_last)),
+                If(spec_close, auto_precharge.eq(row_close == 0))
+            ]
+            self.sync += \
+                If((cmd.ready & row_open) | refresh_req,
+                    speculative.eq(0)
+                ).Elif(cmd.valid & cmd.ready & cmd.cas & auto_precharge & spec_close,
+                    speculative.eq(1),
+                    spec_row.eq(row + 1)
+                )
+
+        # Close the opened row of the idle BankMachine on release.
+        self.comb += If(release & row_opened & ~cmd_buffer.source.valid, page_close.eq(1))
+
+        # Only close the row with the last access of a burst.
+        self.comb += If(~burst_last, auto_precharge.eq(0))
+
         # Control and command generation FSM -------------------------------------------------------
         # Note: tRRD, tFAW, tCCD, tWTR timings are enforced by the multiplexer
+        if settings.refresh_per_bank:
+            # Per-bank refresh: precharge the opened row (no Precharge All).
+            refresh = If(row_opened,
+                NextState("PRECHARGE")
+            ).Else(
+                NextState("REFRESH")
+            )
+        else:
+            refresh = NextState("REFRESH")
+
         self.submodules.fsm = fsm = FSM()
         fsm.act("REGULAR",
             If(refresh_req,
-                NextState("REFRESH")
+                refresh
             ).Elif(cmd_buffer.source.valid,
                 If(row_opened,
                     If(row_hit,
@@ -138,6 +329,8 @@ class BankMachine(Module):
                 ).Else(
                     NextState("ACTIVATE")
                 )
+            ).Elif(page_close,
+                NextState("PRECHARGE")
             )
         )
         fsm.act("PRECHARGE",
@@ -160,7 +353,10 @@ class BankMachine(Module):
             row_close.eq(1)
         )
         fsm.act("ACTIVATE",
-            If(trccon.ready,
+            If(~(cmd_buffer.source.valid | speculative) | refresh_req,
+                # Row closed by the page policy or for a refresh, no row to open.
+                NextState("REGULAR")
+            ).Elif(trccon.ready,
                 row_col_n_addr_sel.eq(1),
                 row_open.eq(1),
                 cmd.valid.eq(1),
@@ -178,8 +374,103 @@ class BankMachine(Module):
             row_close.eq(1),
             cmd.is_cmd.eq(1),
             If(~refresh_req,
-                NextState("REGULAR")
+                NextState("TRFC" if settings.refresh_per_bank else "REGULAR")
             )
         )
         fsm.delayed_enter("TRP", "ACTIVATE", settings.timing.tRP - 1)
         fsm.delayed_enter("TRCD", "REGULAR", settings.timing.tRCD - 1)
+        if settings.refresh_per_bank:
+            fsm.delayed_enter("TRFC", "REGULAR", settings.timing.tRFCpb - 1)
+        self.comb += free.eq(fsm.ongoing("REGULAR") & ~row_opened & ~req.lock)
+
+        # Row hits/misses/conflicts events (for the performance counters) --------------------------
+        # Commands are classified once, when first seen at the head of the buffer.
+        classify   = Signal()
+        classified = Signal()
+        self.comb += classify.eq(fsm.ongoing("REGULAR") & ~refresh_req &
+            cmd_buffer.source.valid & ~classified)
+        self.sync += \
+            If(cmd_buffer.source.valid & cmd_buffer.source.ready,
+                classified.eq(0)
+            ).Elif(classify,
+                classified.eq(1)
+            )
+        self.comb += [
+            self.row_hit_event.eq(classify & row_opened & row_hit),
+            self.row_miss_event.eq(classify & ~row_opened),
+            self.row_conflict_event.eq(classify & row_opened & ~row_hit)
+        ]
+
+# BankMachinePool ----------------------------------------------------------------------------------
+
+class BankMachinePool(Module):
+    """BankMachinePool
+
+    Allocate a pool of BankMachines dynamically to the banks (cmd_layout interfaces).
+
+    Each BankMachine of the pool is allocated to a bank (bas) and the commands of the banks are
+    routed to their BankMachines with a CAM-style lookup. A BankMachine is allocated (in round
+    robin) to a bank with commands when the bank has no BankMachine. When no BankMachine is
+    available, an idle BankMachine is released: its opened row is closed and it can then be
+    allocated to another bank. BankMachines are kept allocated while they have a row opened, so
+    row hits are not lost while the pool is large enough for the accessed banks.
+    """
+    def __init__(self, banks, bank_machines, bas):
+        nbanks    = len(banks)
+        nmachines = len(bank_machines)
+
+        # # #
+
+        used = Signal(nmachines) # BankMachines allocated to a bank
+
+        # Lookup -----------------------------------------------------------------------------------
+        hits     = [[used[m] & (bas[m] == k) for m in range(nmachines)] for k in range(nbanks)]
+        bank_hit = Signal(nbanks)
+        self.comb += bank_hit.eq(Cat(*[reduce(or_, bank_hits) for bank_hits in hits]))
+
+        # Route commands ---------------------------------------------------------------------------
+        m2s_fields = [name for name, width, direction in banks[0].layout if direction == DIR_M_TO_S]
+        s2m_fields = [name for name, width, direction in banks[0].layout if direction == DIR_S_TO_M]
+        for m, bm in enumerate(bank_machines):
+            self.comb += bm.req.valid.eq(used[m] &
+                Array(bank.valid for bank in banks)[bas[m]])
+            for name in m2s_fields:
+                if name != "valid":
+                    self.comb += getattr(bm.req, name).eq(
+                        Array(getattr(bank, name) for bank in banks)[bas[m]])
+        for k, bank in enumerate(banks):
+            for name in s2m_fields:
+                self.comb += getattr(bank, name).eq(reduce(or_,
+                    [hit & getattr(bm.req, name) for hit, bm in zip(hits[k], bank_machines)]))
+
+        # Allocate ---------------------------------------------------------------------------------
+        requests = Signal(nbanks)
+        self.comb += requests.eq(Cat(*[bank.valid for bank in banks]) & ~bank_hit)
+        arbiter = roundrobin.RoundRobin(nbanks, roundrobin.SP_WITHDRAW)
+        self.submodules += arbiter
+
+        available = PriorityEncoder(nmachines)
+        self.submodules += available
+        self.comb += available.i.eq(~used)
+
+        allocate = Signal()
+        self.comb += [
+            arbiter.request.eq(requests),
+            allocate.eq(Array(requests[k] for k in range(nbanks))[arbiter.grant] & ~available.n)
+        ]
+        for m, bm in enumerate(bank_machines):
+            self.sync += \
+                If(allocate & (available.o == m),
+                    used[m].eq(1),
+                    bas[m].eq(arbiter.grant)
+                ).Elif(bm.free & ~bm.req.valid,
+                    used[m].eq(0)
+                )
+
+        # Release ----------------------------------------------------------------------------------
+        idle = PriorityEncoder(nmachines)
+        self.submodules += idle
+        self.comb += idle.i.eq(Cat(*[used[m] & ~bm.req.valid & ~bm.req.lock
+            for m, bm in enumerate(bank_machines)]))
+        for m, bm in enumerate(bank_machines):
+            self.comb += bm.release.eq((requests != 0) & available.n & ~idle.n & (idle.o == m))
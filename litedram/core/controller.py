@@ -9,7 +9,7 @@ from migen import *
 from litedram.common import *
 from litedram.phy import dfi
 from litedram.core.refresher import Refresher
-from litedram.core.bankmachine import BankMachine
+from litedram.core.bankmachine import BankMachine, BankMachinePool
 from litedram.core.multiplexer import Multiplexer
 
 # Settings -----------------------------------------------------------------------------------------
@@ -19,23 +19,52 @@ class ControllerSettings(Settings):
         # Command buffers
         cmd_buffer_depth    = 8,
         cmd_buffer_buffered = False,
+        cmd_max_len         = 1,
+
+        # Bank machines (None: one BankMachine per bank, else size of the BankMachines pool)
+        nbank_machines      = None,
 
         # Read/Write times
         read_time           = 32,
         write_time          = 16,
 
+        # Write drain (writes queue watermarks)
+        write_drain_high    = None,
+        write_drain_low     = 0,
+
+        # Scheduling
+        scheduling_policy   = "ROUND_ROBIN",
+        scheduling_age_cap  = 16,
+        rank_batch          = 16,
+
+        # Crossbar (registered bank commands and masters locks)
+        crossbar_pipeline   = False,
+
         # Bandwidth
         with_bandwidth      = False,
+        with_grant_counters = False,
+        with_perf_counters  = False,
 
         # Refresh
         with_refresh        = True,
         refresh_cls         = Refresher,
         refresh_zqcs_freq   = 1e0,
         refresh_postponing  = 1,
+        refresh_elastic     = False,
+        refresh_max_pull_in = 8,
+        refresh_idle_cycles = 16,
+        refresh_per_bank    = False,
 
         # Auto-Precharge
         with_auto_precharge = True,
 
+        # Speculative activate (open the next row after an access to the last column of the row)
+        with_spec_activate  = False,
+
+        # Page policy
+        page_policy         = "OPEN",
+        page_timeout        = 32,
+
         # Address mapping
         address_mapping     = "ROW_BANK_COL"):
         self.set_attributes(locals())
@@ -71,21 +100,39 @@ class LiteDRAMController(Module):
 
         # Refresher --------------------------------------------------------------------------------
         self.submodules.refresher = self.settings.refresh_cls(self.settings,
-            clk_freq   = clk_freq,
-            zqcs_freq  = self.settings.refresh_zqcs_freq,
-            postponing = self.settings.refresh_postponing)
+            clk_freq    = clk_freq,
+            zqcs_freq   = self.settings.refresh_zqcs_freq,
+            postponing  = self.settings.refresh_postponing,
+            elastic     = self.settings.refresh_elastic,
+            max_pull_in = self.settings.refresh_max_pull_in,
+            idle_cycles = self.settings.refresh_idle_cycles,
+            per_bank    = self.settings.refresh_per_bank)
 
         # Bank Machines ----------------------------------------------------------------------------
+        banks          = [getattr(interface, "bank"+str(n)) for n in range(nranks*nbanks)]
+        nbank_machines = self.settings.nbank_machines
+        pool           = nbank_machines is not None and nbank_machines < len(banks)
+        if pool:
+            # Per-bank refreshes are issued to the BankMachines of the refreshed banks.
+            assert not self.settings.refresh_per_bank
+            bas = [Signal(max=len(banks)) for n in range(nbank_machines)]
+        else:
+            bas = list(range(len(banks)))
         bank_machines = []
-        for n in range(nranks*nbanks):
-            bank_machine = BankMachine(n,
+        for ba in bas:
+            bank_machine = BankMachine(ba,
                 address_width = interface.address_width,
                 address_align = address_align,
                 nranks        = nranks,
-                settings      = self.settings)
+                settings      = self.settings,
+                len_width     = interface.len_width)
             bank_machines.append(bank_machine)
             self.submodules += bank_machine
-            self.comb += getattr(interface, "bank"+str(n)).connect(bank_machine.req)
+        if pool:
+            self.submodules.bank_machine_pool = BankMachinePool(banks, bank_machines, bas)
+        else:
+            for bank, bank_machine in zip(banks, bank_machines):
+                self.comb += bank.connect(bank_machine.req)
 
         # Multiplexer ------------------------------------------------------------------------------
         self.submodules.multiplexer = Multiplexer(
@@ -12,20 +12,107 @@ from migen import *
 from migen.genlib import roundrobin
 
 from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus
 
 from litedram.common import *
 from litedram.core.controller import *
 from litedram.frontend.adaptation import *
 
+# _HierarchicalRoundRobin --------------------------------------------------------------------------
+
+class _HierarchicalRoundRobin(Module):
+    """Hierarchical Round Robin arbiter
+
+    RoundRobin (SP_CE) arbiter of n requests built as a tree of arity-input RoundRobins: the requests
+    are arbitrated in groups of arity requests and the groups by a round robin of the groups, which
+    shortens the priority chains of the large numbers of requests. On ce, the granted group and the
+    groups whose grant is not requesting move to their next request.
+    """
+    def __init__(self, n, arity=4):
+        self.request = Signal(n)
+        self.grant   = Signal(max=max(2, n))
+        self.ce      = Signal()
+
+        # # #
+
+        if n <= arity:
+            arbiter = roundrobin.RoundRobin(n, roundrobin.SP_CE)
+            self.submodules += arbiter
+            self.comb += [
+                arbiter.request.eq(self.request),
+                arbiter.ce.eq(self.ce),
+                self.grant.eq(arbiter.grant)
+            ]
+            return
+
+        # Groups arbiters
+        groups = []
+        for base in range(0, n, arity):
+            size  = min(arity, n - base)
+            group = roundrobin.RoundRobin(size, roundrobin.SP_CE)
+            self.submodules += group
+            self.comb += group.request.eq(self.request[base:base + size])
+            groups.append(group)
+
+        # Arbiter of the groups
+        top = _HierarchicalRoundRobin(len(groups), arity)
+        self.submodules += top
+        self.comb += [
+            top.request.eq(Cat(*[group.request != 0 for group in groups])),
+            top.ce.eq(self.ce),
+            self.grant.eq(Array(g*arity + group.grant for g, group in enumerate(groups))[top.grant])
+        ]
+        for g, group in enumerate(groups):
+            granted    = top.grant == g
+            requesting = Array(group.request[i] for i in range(len(group.request)))[group.grant]
+            self.comb += group.ce.eq(self.ce & (granted | ~requesting))
+
 # LiteDRAMCrossbar ---------------------------------------------------------------------------------
 
-class LiteDRAMCrossbar(Module):
+class LiteDRAMCrossbar(Module, AutoCSR):
+    """LiteDRAM Crossbar
+
+    Arbitrate the ports (masters) accesses to the banks of the controller.
+
+    The arbitration can be configured per port with get_port's QoS parameters:
+    - priority: priority class, the requests of the highest priority class are arbitrated first.
+    - weight: weighted round robin between the ports of the same priority class, a port can be
+    granted up to weight commands before the other requesting ports.
+    - bandwidth: guaranteed bandwidth (fraction of the controller's commands), the port gets the
+    highest priority when it has been granted less commands than reserved.
+    - max_latency: maximum latency budget (in sys clk cycles), the port gets the highest priority
+    when its command has been waiting for max_latency cycles.
+
+    With the grant counters (or the performance counters) of the settings, the number of commands
+    granted to each port can be read over CSR.
+
+    A port can also be requested with a reorder buffer of reorder_depth reads: its read commands
+    are tagged with a reorder buffer slot and the port can then keep commands in flight in several
+    banks (only its writes still wait for the writes pending in the other banks). The read data are
+    returned in the commands order with reorder="IN_ORDER", or as soon as available with
+    reorder="OUT_OF_ORDER": rdata.id then gives the slot of the command (allocated in the read
+    commands order, modulo reorder_depth).
+
+    When the controller is configured with cmd_max_len > 1, the ports (except the reordering ones)
+    have a cmd.len field: a command then accesses len + 1 consecutive columns of a row and the
+    BankMachine expands it internally, the data are transferred as len + 1 wdata/rdata beats.
+    cmd_max_len is a power of 2 not larger than a row and the commands must not cross a cmd_max_len
+    aligned boundary (the columns would otherwise wrap in the row). Bursts are not supported with the
+    ROW_COL_BANK address mapping (consecutive addresses are then in different banks).
+
+    With the crossbar_pipeline setting, the commands routed to the banks are registered (with a
+    pipe valid/ready buffer per bank) and the locks of the masters by the other banks are computed
+    from registered per-bank pending flags, cutting the arbitration -> controller and lock paths for
+    higher frequencies/master counts at the cost of one cycle of command latency; with more than 4
+    masters, the banks arbiters are then hierarchical (4-input round robins of round robins).
+    """
     def __init__(self, controller):
         self.controller = controller
 
         self.rca_bits         = controller.address_width
         self.nbanks           = controller.nbanks
         self.nranks           = controller.nranks
+        self.len_width        = controller.len_width
         self.cmd_buffer_depth = controller.settings.cmd_buffer_depth
         self.read_latency     = controller.settings.phy.read_latency + 1
         self.write_latency    = controller.settings.phy.write_latency + 1
@@ -35,7 +122,9 @@ class LiteDRAMCrossbar(Module):
 
         self.masters = []
 
-    def get_port(self, mode="both", data_width=None, clock_domain="sys", reverse=False, **kwargs):
+    def get_port(self, mode="both", data_width=None, clock_domain="sys", reverse=False,
+        priority=0, weight=1, bandwidth=None, max_latency=None, reorder=None, reorder_depth=8,
+        **kwargs):
         # retro-compatibility # FIXME: remove
         if "cd" in kwargs:
             print("[WARNING] Please update LiteDRAMCrossbar.get_port's \"cd\" parameter to \"clock_domain\"")
@@ -47,19 +136,45 @@ class LiteDRAMCrossbar(Module):
         if self.finalized:
             raise FinalizeError
 
+        assert weight >= 1
+        assert bandwidth is None or 0 < bandwidth <= 1
+        assert max_latency is None or max_latency >= 1
+        assert reorder in [None, "IN_ORDER", "OUT_OF_ORDER"]
+        assert reorder_depth >= 1
+
         if data_width is None:
             # use internal data_width when no width adaptation is requested
             data_width = self.controller.data_width
 
+        if reorder == "OUT_OF_ORDER":
+            # rdata.id can't go through the clock domain crossing / data width conversion.
+            assert clock_domain == "sys"
+            assert data_width == self.controller.data_width
+
         # Crossbar port ----------------------------------------------------------------------------
         port = LiteDRAMNativePort(
-            mode          = mode,
-            address_width = self.rca_bits + self.bank_bits - self.rank_bits,
-            data_width    = self.controller.data_width,
-            clock_domain  = "sys",
-            id            = len(self.masters))
+            mode           = mode,
+            address_width  = self.rca_bits + self.bank_bits - self.rank_bits,
+            data_width     = self.controller.data_width,
+            clock_domain   = "sys",
+            id             = len(self.masters),
+            rdata_id_width = bits_for(reorder_depth - 1) if reorder == "OUT_OF_ORDER" else 0,
+            len_width      = self.len_width if reorder is None else 0)
+        port.priority      = priority
+        port.weight        = weight
+        port.bandwidth     = bandwidth
+        port.max_latency   = max_latency
+        port.reorder       = reorder
+        port.reorder_depth = reorder_depth
         self.masters.append(port)
 
+        # Grant counter ----------------------------------------------------------------------------
+        settings = self.controller.settings
+        if settings.with_grant_counters or settings.with_perf_counters:
+            grants = CSRStatus(32, name="port{}_grants".format(port.id))
+            setattr(self, "port{}_grants".format(port.id), grants)
+            self.sync += If(port.cmd.valid & port.cmd.ready, grants.status.eq(grants.status + 1))
+
         # Clock domain crossing --------------------------------------------------------------------
         if clock_domain != "sys":
             new_port = LiteDRAMNativePort(
@@ -92,42 +207,235 @@ class LiteDRAMCrossbar(Module):
     def do_finalize(self):
         controller = self.controller
         nmasters   = len(self.masters)
+        pipeline   = controller.settings.crossbar_pipeline
+
+        # Banks ------------------------------------------------------------------------------------
+        banks = []
+        for nb in range(self.nbanks):
+            bank = getattr(controller, "bank"+str(nb))
+            if pipeline:
+                # Register the commands to the bank, the bank is locked while a command is buffered.
+                buf = stream.Buffer(cmd_description(len(bank.addr), self.len_width),
+                    pipe_valid=True, pipe_ready=True)
+                self.submodules += buf
+                pipe_bank = Record(bank.layout)
+                self.comb += [
+                    buf.sink.valid.eq(pipe_bank.valid),
+                    buf.sink.we.eq(pipe_bank.we),
+                    buf.sink.addr.eq(pipe_bank.addr),
+                    pipe_bank.ready.eq(buf.sink.ready),
+                    bank.valid.eq(buf.source.valid),
+                    bank.we.eq(buf.source.we),
+                    bank.addr.eq(buf.source.addr),
+                    buf.source.ready.eq(bank.ready),
+                    pipe_bank.lock.eq(bank.lock | buf.source.valid),
+                    pipe_bank.wdata_ready.eq(bank.wdata_ready),
+                    pipe_bank.rdata_valid.eq(bank.rdata_valid)
+                ]
+                if self.len_width:
+                    self.comb += [
+                        buf.sink.len.eq(pipe_bank.len),
+                        bank.len.eq(buf.source.len)
+                    ]
+                bank = pipe_bank
+            banks.append(bank)
 
         # Address mapping --------------------------------------------------------------------------
-        cba_shifts = {"ROW_BANK_COL": controller.settings.geom.colbits - controller.address_align}
-        cba_shift = cba_shifts[controller.settings.address_mapping]
+        address_mapping = controller.settings.address_mapping
+        cba_shifts = {
+            "ROW_BANK_COL":     controller.settings.geom.colbits - controller.address_align,
+            "ROW_BANK_COL_XOR": controller.settings.geom.colbits - controller.address_align,
+            "BANK_ROW_COL":     self.rca_bits - self.rank_bits,
+            "ROW_COL_BANK":     0,
+        }
+        cba_shift = cba_shifts[address_mapping]
         m_ba      = [m.get_bank_address(self.bank_bits, cba_shift)for m in self.masters]
         m_rca     = [m.get_row_column_address(self.bank_bits, self.rca_bits, cba_shift) for m in self.masters]
+        if address_mapping == "ROW_BANK_COL_XOR":
+            # Permutation-based bank hashing: XOR the bank address with the lowest bits of the row
+            # address to spread the row conflicts of strided accesses over the banks.
+            cba_upper = cba_shift + self.bank_bits
+            m_ba = [ba ^ m.cmd.addr[cba_upper:cba_upper + self.bank_bits]
+                for ba, m in zip(m_ba, self.masters)]
 
         master_readys       = [0]*nmasters
         master_wdata_readys = [0]*nmasters
         master_rdata_valids = [0]*nmasters
 
-        arbiters = [roundrobin.RoundRobin(nmasters, roundrobin.SP_CE) for n in range(self.nbanks)]
+        # QoS --------------------------------------------------------------------------------------
+        # Masters exceeding their max latency budget or owed some of their guaranteed bandwidth are
+        # urgent and get the highest priority.
+        master_urgents = []
+        for master in self.masters:
+            urgent = 0
+            accept = master.cmd.valid & master.cmd.ready
+            if master.max_latency is not None:
+                latency = Signal(max=master.max_latency + 1)
+                self.sync += \
+                    If(~master.cmd.valid | master.cmd.ready,
+                        latency.eq(0)
+                    ).Elif(latency != master.max_latency,
+                        latency.eq(latency + 1)
+                    )
+                urgent = urgent | (latency == master.max_latency)
+            if master.bandwidth is not None:
+                # Token bucket: credited with bandwidth command every cycle (in 1/256th of command),
+                # debited of a command on each accepted command, saturated to 4 commands.
+                one    = 256
+                rate   = max(int(master.bandwidth*one), 1)
+                cap    = 4*one
+                tokens = Signal(max=cap + 1)
+                tokens_next = Signal(max=cap + rate + 1)
+                self.comb += \
+                    If(accept,
+                        If(tokens + rate > one,
+                            tokens_next.eq(tokens + rate - one)
+                        ).Else(
+                            tokens_next.eq(0)
+                        )
+                    ).Else(
+                        tokens_next.eq(tokens + rate)
+                    )
+                self.sync += \
+                    If(tokens_next > cap,
+                        tokens.eq(cap)
+                    ).Else(
+                        tokens.eq(tokens_next)
+                    )
+                urgent = urgent | (tokens >= one)
+            master_urgents.append(urgent)
+        priorities = sorted(set(master.priority for master in self.masters), reverse=True)
+        budgets    = any(m.max_latency is not None or m.bandwidth is not None for m in self.masters)
+        weighted   = len(set(master.weight for master in self.masters)) > 1
+        qos        = budgets or weighted or len(priorities) > 1
+
+        def qos_filter(requested):
+            # Only keep the requests of the urgent masters or else of the highest priority class.
+            if not budgets and len(priorities) == 1:
+                return Cat(*requested)
+            filtered = Signal(nmasters)
+            urgents  = [r & u for r, u in zip(requested, master_urgents)]
+            classes  = [Cat(*[r if m.priority == p else 0 for r, m in zip(requested, self.masters)])
+                for p in priorities]
+            statement = filtered.eq(classes[-1])
+            for requests in reversed([Cat(*urgents)] + classes[:-1]):
+                statement = If(requests != 0, filtered.eq(requests)).Else(statement)
+            self.comb += statement
+            return filtered
+
+        # Reorder buffers tags ---------------------------------------------------------------------
+        # Read commands of the reordering masters are tagged with the next slot of their reorder
+        # buffer; the masters are stalled when this slot is still in use.
+        reorder      = any(master.reorder is not None for master in self.masters)
+        master_tags  = [0]*nmasters
+        master_busys = [0]*nmasters
+        master_stall = [Signal() for nm in range(nmasters)]
+        for nm, master in enumerate(self.masters):
+            if master.reorder is not None:
+                tag  = Signal(max=master.reorder_depth)
+                busy = Signal(master.reorder_depth)
+                self.sync += \
+                    If(master.cmd.valid & master.cmd.ready & ~master.cmd.we,
+                        If(tag == master.reorder_depth - 1,
+                            tag.eq(0)
+                        ).Else(
+                            tag.eq(tag + 1)
+                        )
+                    )
+                master_tags[nm]  = tag
+                master_busys[nm] = busy
+                self.comb += master_stall[nm].eq(
+                    ~master.cmd.we & Array(busy[i] for i in range(len(busy)))[tag])
+        tag_width = max([len(tag) for tag in master_tags if isinstance(tag, Signal)], default=1)
+
+        if pipeline and nmasters > 4:
+            arbiters = [_HierarchicalRoundRobin(nmasters, arity=4) for n in range(self.nbanks)]
+        else:
+            arbiters = [roundrobin.RoundRobin(nmasters, roundrobin.SP_CE) for n in range(self.nbanks)]
         self.submodules += arbiters
 
+        # Pending writes of each bank, the writes of a reordering master have to wait for them.
+        bank_writes = []
+        if reorder:
+            for nb in range(self.nbanks):
+                bank   = banks[nb]
+                writes = Signal(max=(self.cmd_buffer_depth + 2)*controller.settings.cmd_max_len)
+                beats  = 1 if not self.len_width else bank.len + 1
+                self.sync += \
+                    If(bank.valid & bank.ready & bank.we,
+                        writes.eq(writes + beats - bank.wdata_ready)
+                    ).Elif(bank.wdata_ready,
+                        writes.eq(writes - 1)
+                    )
+                bank_writes.append(writes)
+
+        # Pending commands of the masters in each bank (registered), a command accepted by a bank
+        # is pending from the next cycle (until the bank's lock is seen in the registers).
+        master_pendings = []
+        if pipeline:
+            for nm, master in enumerate(self.masters):
+                pending = Signal(self.nbanks)
+                for nb, (bank, arbiter) in enumerate(zip(banks, arbiters)):
+                    granted = arbiter.grant == nm
+                    if master.reorder is not None:
+                        self.sync += pending[nb].eq(granted &
+                            ((bank_writes[nb] != 0) | (bank.valid & bank.ready & bank.we)))
+                    else:
+                        self.sync += pending[nb].eq(granted &
+                            (bank.lock | (bank.valid & bank.ready)))
+                master_pendings.append(pending)
+
+        master_rdata_tags = [0]*nmasters
         rbank = Signal(max=self.nbanks)
         wbank = Signal(max=self.nbanks)
         for nb, arbiter in enumerate(arbiters):
-            bank = getattr(controller, "bank"+str(nb))
+            bank = banks[nb]
 
             # For each master, determine if another bank locks it ----------------------------------
             master_locked = []
             for nm, master in enumerate(self.masters):
                 locked = Signal()
-                for other_nb, other_arbiter in enumerate(arbiters):
-                    if other_nb != nb:
-                        other_bank = getattr(controller, "bank"+str(other_nb))
-                        locked = locked | (other_bank.lock & (other_arbiter.grant == nm))
+                if pipeline:
+                    others = master_pendings[nm] & ((2**self.nbanks - 1) ^ (1 << nb))
+                    locked = (others != 0) & (master.cmd.we if master.reorder is not None else 1)
+                else:
+                    for other_nb, other_arbiter in enumerate(arbiters):
+                        if other_nb != nb:
+                            other_bank = banks[other_nb]
+                            if master.reorder is not None:
+                                locked = locked | (master.cmd.we & (bank_writes[other_nb] != 0) &
+                                    (other_arbiter.grant == nm))
+                            else:
+                                locked = locked | (other_bank.lock & (other_arbiter.grant == nm))
                 master_locked.append(locked)
 
             # Arbitrate ----------------------------------------------------------------------------
-            bank_selected  = [(ba == nb) & ~locked for ba, locked in zip(m_ba, master_locked)]
+            bank_selected  = [(ba == nb) & ~locked & ~stall
+                for ba, locked, stall in zip(m_ba, master_locked, master_stall)]
             bank_requested = [bs & master.cmd.valid for bs, master in zip(bank_selected, self.masters)]
-            self.comb += [
-                arbiter.request.eq(Cat(*bank_requested)),
-                arbiter.ce.eq(~bank.valid & ~bank.lock)
-            ]
+            bank_filtered  = qos_filter(bank_requested)
+            if weighted:
+                # Weighted round robin: masters that have used their credits (weight commands) are
+                # only arbitrated when no other master has credits left, credits are then reloaded.
+                credits = [Signal(max=m.weight + 1, reset=m.weight) for m in self.masters]
+                eligible = Signal(nmasters)
+                self.comb += eligible.eq(bank_filtered & Cat(*[c != 0 for c in credits]))
+                for nm, (master, credit) in enumerate(zip(self.masters, credits)):
+                    granted = bank.valid & bank.ready & (arbiter.grant == nm)
+                    self.sync += \
+                        If((bank_filtered != 0) & (eligible == 0),
+                            credit.eq(master.weight - granted)
+                        ).Elif(granted & (credit != 0),
+                            credit.eq(credit - 1)
+                        )
+                self.comb += If(eligible != 0,
+                    arbiter.request.eq(eligible)
+                ).Else(
+                    arbiter.request.eq(bank_filtered)
+                )
+            else:
+                self.comb += arbiter.request.eq(bank_filtered)
+            self.comb += arbiter.ce.eq(~bank.valid & ~bank.lock)
 
             # Get rdata source bank ----------------------------------------------------------------
             self.sync += If((arbiter.grant == nm) & bank.rdata_valid, rbank.eq(nb))
@@ -138,12 +446,25 @@ class LiteDRAMCrossbar(Module):
                     wbank.eq(nb)
                 )
 
+            # Preempt ------------------------------------------------------------------------------
+            # The grant can only switch once the bank has been drained: stop accepting the commands
+            # of the granted master when the QoS arbitration selects other masters.
+            if qos:
+                preempt = Signal()
+                self.comb += preempt.eq((arbiter.request != 0) &
+                    ~Array(arbiter.request[nm] for nm in range(nmasters))[arbiter.grant])
+                bank_requested = [br & ~preempt for br in bank_requested]
+                bank_selected  = [bs & ~preempt for bs in bank_selected]
+
             # Route requests -----------------------------------------------------------------------
             self.comb += [
                 bank.addr.eq(Array(m_rca)[arbiter.grant]),
                 bank.we.eq(Array(self.masters)[arbiter.grant].cmd.we),
                 bank.valid.eq(Array(bank_requested)[arbiter.grant])
             ]
+            if self.len_width:
+                m_len = [getattr(m.cmd, "len", 0) for m in self.masters]
+                self.comb += bank.len.eq(Array(m_len)[arbiter.grant])
             master_readys = [master_ready | ((arbiter.grant == nm) & bank_selected[nm] & bank.ready)
                 for nm, master_ready in enumerate(master_readys)]
             master_wdata_readys = [master_wdata_ready | ((arbiter.grant == nm) & bank.wdata_ready)
@@ -151,6 +472,22 @@ class LiteDRAMCrossbar(Module):
             master_rdata_valids = [master_rdata_valid | ((arbiter.grant == nm) & bank.rdata_valid)
                 for nm, master_rdata_valid in enumerate(master_rdata_valids)]
 
+            # Tag reads ----------------------------------------------------------------------------
+            # The bank serves its commands in order: the tags of the reads it accepted are queued
+            # and popped when the reads are issued.
+            if reorder:
+                tags = stream.SyncFIFO([("tag", tag_width)], self.cmd_buffer_depth + 2)
+                self.submodules += tags
+                self.comb += [
+                    tags.sink.valid.eq(bank.valid & bank.ready & ~bank.we &
+                        Array(m.reorder is not None for m in self.masters)[arbiter.grant]),
+                    tags.sink.tag.eq(Array(master_tags)[arbiter.grant]),
+                    tags.source.ready.eq(bank.rdata_valid)
+                ]
+                master_rdata_tags = [master_rdata_tag |
+                    Mux((arbiter.grant == nm) & bank.rdata_valid, tags.source.tag, 0)
+                    for nm, master_rdata_tag in enumerate(master_rdata_tags)]
+
         for nm, master_wdata_ready in enumerate(master_wdata_readys):
                 for i in range(self.write_latency):
                     new_master_wdata_ready = Signal()
@@ -159,18 +496,26 @@ class LiteDRAMCrossbar(Module):
                 master_wdata_readys[nm] = master_wdata_ready
 
         for nm, master_rdata_valid in enumerate(master_rdata_valids):
+                master_rdata_tag = master_rdata_tags[nm]
                 for i in range(self.read_latency):
                     new_master_rdata_valid = Signal()
-                    self.sync += new_master_rdata_valid.eq(master_rdata_valid)
+                    new_master_rdata_tag   = Signal(tag_width)
+                    self.sync += [
+                        new_master_rdata_valid.eq(master_rdata_valid),
+                        new_master_rdata_tag.eq(master_rdata_tag)
+                    ]
                     master_rdata_valid = new_master_rdata_valid
+                    master_rdata_tag   = new_master_rdata_tag
                 master_rdata_valids[nm] = master_rdata_valid
+                master_rdata_tags[nm]   = master_rdata_tag
 
         for master, master_ready in zip(self.masters, master_readys):
             self.comb += master.cmd.ready.eq(master_ready)
         for master, master_wdata_ready in zip(self.masters, master_wdata_readys):
             self.comb += master.wdata.ready.eq(master_wdata_ready)
         for master, master_rdata_valid in zip(self.masters, master_rdata_valids):
-            self.comb += master.rdata.valid.eq(master_rdata_valid)
+            if master.reorder is None:
+                self.comb += master.rdata.valid.eq(master_rdata_valid)
 
         # Route data writes ------------------------------------------------------------------------
         wdata_cases = {}
@@ -186,5 +531,195 @@ class LiteDRAMCrossbar(Module):
         self.comb += Case(Cat(*master_wdata_readys), wdata_cases)
 
         # Route data reads -------------------------------------------------------------------------
-        for master in self.masters:
-            self.comb += master.rdata.data.eq(controller.rdata)
+        for nm, master in enumerate(self.masters):
+            if master.reorder is None:
+                self.comb += master.rdata.data.eq(controller.rdata)
+            else:
+                self.add_reorder_buffer(master, master_tags[nm], master_busys[nm],
+                    master_rdata_valids[nm], master_rdata_tags[nm])
+
+    def add_reorder_buffer(self, master, tag, busy, rdata_valid, rdata_tag):
+        depth = master.reorder_depth
+        mem   = Memory(len(master.rdata.data), depth)
+        wrport = mem.get_port(write_capable=True)
+        rdport = mem.get_port(async_read=True)
+        self.specials += mem, wrport, rdport
+
+        # Store the read data in the slot of their command.
+        self.comb += [
+            wrport.adr.eq(rdata_tag),
+            wrport.dat_w.eq(self.controller.rdata),
+            wrport.we.eq(rdata_valid)
+        ]
+
+        # Select the slot to return: the oldest one when in order, any available one otherwise.
+        slot    = Signal(max=depth)
+        valid   = Signal(depth)
+        deliver = Signal()
+        if master.reorder == "IN_ORDER":
+            self.sync += \
+                If(deliver,
+                    If(slot == depth - 1,
+                        slot.eq(0)
+                    ).Else(
+                        slot.eq(slot + 1)
+                    )
+                )
+        else:
+            self.comb += [If(valid[i], slot.eq(i)) for i in reversed(range(depth))]
+            self.comb += master.rdata.id.eq(slot)
+        self.comb += [
+            rdport.adr.eq(slot),
+            master.rdata.valid.eq(Array(valid[i] for i in range(depth))[slot]),
+            master.rdata.data.eq(rdport.dat_r),
+            deliver.eq(master.rdata.valid & master.rdata.ready)
+        ]
+
+        # Slots are busy from the command to the return of its data.
+        for i in range(depth):
+            self.sync += [
+                If(rdata_valid & (rdata_tag == i),
+                    valid[i].eq(1)
+                ).Elif(deliver & (slot == i),
+                    valid[i].eq(0)
+                ),
+                If(master.cmd.valid & master.cmd.ready & ~master.cmd.we & (tag == i),
+                    busy[i].eq(1)
+                ).Elif(deliver & (slot == i),
+                    busy[i].eq(0)
+                )
+            ]
+
+# LiteDRAMNativePortInterleaver --------------------------------------------------------------------
+
+class LiteDRAMNativePortInterleaver(Module):
+    """LiteDRAM port Interleaver
+
+    Interleave the accesses of a port over several ports (channels): the channel is selected by the
+    address bits just above the granularity_bits lowest bits and removed from the address.
+
+    The channels of the commands are queued (up to depth commands of each direction) to route the
+    write data to the channels and return the read data in the commands order, the data of each
+    channel are buffered.
+    """
+    def __init__(self, port_from, ports_to, granularity_bits, depth=16):
+        nchannels    = len(ports_to)
+        channel_bits = log2_int(nchannels)
+        assert nchannels >= 2
+        assert port_from.address_width == ports_to[0].address_width + channel_bits
+        assert all(port.data_width == port_from.data_width for port in ports_to)
+
+        # # #
+
+        mode = port_from.mode
+        lo   = granularity_bits
+        hi   = granularity_bits + channel_bits
+
+        # Commands ---------------------------------------------------------------------------------
+        channel = Signal(channel_bits)
+        addr    = Signal(ports_to[0].address_width)
+        self.comb += [
+            channel.eq(port_from.cmd.addr[lo:hi]),
+            addr.eq(Cat(port_from.cmd.addr[:lo], port_from.cmd.addr[hi:]))
+        ]
+
+        write_order = stream.SyncFIFO([("channel", channel_bits)], depth)
+        read_order  = stream.SyncFIFO([("channel", channel_bits)], depth)
+        self.submodules += write_order, read_order
+
+        order_ready = Signal()
+        self.comb += order_ready.eq(Mux(port_from.cmd.we,
+            write_order.sink.ready,
+            read_order.sink.ready))
+        for n, port in enumerate(ports_to):
+            self.comb += [
+                port.cmd.valid.eq(port_from.cmd.valid & (channel == n) & order_ready),
+                port.cmd.we.eq(port_from.cmd.we),
+                port.cmd.addr.eq(addr)
+            ]
+        self.comb += [
+            port_from.cmd.ready.eq(Array(port.cmd.ready for port in ports_to)[channel] & order_ready),
+            write_order.sink.valid.eq(port_from.cmd.valid & port_from.cmd.ready & port_from.cmd.we),
+            write_order.sink.channel.eq(channel),
+            read_order.sink.valid.eq(port_from.cmd.valid & port_from.cmd.ready & ~port_from.cmd.we),
+            read_order.sink.channel.eq(channel)
+        ]
+
+        # Write data -------------------------------------------------------------------------------
+        if mode == "write" or mode == "both":
+            wdata_readys = []
+            for n, port in enumerate(ports_to):
+                wdata_fifo = stream.SyncFIFO(wdata_description(port.data_width), depth)
+                self.submodules += wdata_fifo
+                self.comb += [
+                    wdata_fifo.sink.valid.eq(port_from.wdata.valid & write_order.source.valid &
+                        (write_order.source.channel == n)),
+                    wdata_fifo.sink.data.eq(port_from.wdata.data),
+                    wdata_fifo.sink.we.eq(port_from.wdata.we),
+                    wdata_fifo.source.connect(port.wdata)
+                ]
+                wdata_readys.append(wdata_fifo.sink.ready)
+            self.comb += [
+                port_from.wdata.ready.eq(write_order.source.valid &
+                    Array(wdata_readys)[write_order.source.channel]),
+                write_order.source.ready.eq(port_from.wdata.valid & port_from.wdata.ready)
+            ]
+
+        # Read data --------------------------------------------------------------------------------
+        # The outstanding reads are limited by read_order: the read data FIFOs can't overflow.
+        if mode == "read" or mode == "both":
+            rdata_valids = []
+            rdata_datas  = []
+            for n, port in enumerate(ports_to):
+                rdata_fifo = stream.SyncFIFO(rdata_description(port.data_width), depth)
+                self.submodules += rdata_fifo
+                self.comb += [
+                    port.rdata.connect(rdata_fifo.sink),
+                    rdata_fifo.source.ready.eq(port_from.rdata.ready & read_order.source.valid &
+                        (read_order.source.channel == n))
+                ]
+                rdata_valids.append(rdata_fifo.source.valid)
+                rdata_datas.append(rdata_fifo.source.data)
+            self.comb += [
+                port_from.rdata.valid.eq(read_order.source.valid &
+                    Array(rdata_valids)[read_order.source.channel]),
+                port_from.rdata.data.eq(Array(rdata_datas)[read_order.source.channel]),
+                read_order.source.ready.eq(port_from.rdata.valid & port_from.rdata.ready)
+            ]
+
+# LiteDRAMMultiChannelCrossbar ---------------------------------------------------------------------
+
+class LiteDRAMMultiChannelCrossbar(Module):
+    """LiteDRAM Multi-Channel Crossbar
+
+    Expose the crossbars of several independent controllers (channels) as a single crossbar: the
+    ports are interleaved over the channels with a granularity (in bytes) stripe, consecutive
+    stripes being mapped to consecutive channels.
+
+    get_port requests a port on each channel's crossbar (with the same parameters) and interleaves
+    them; the OUT_OF_ORDER reorder buffers are not supported (rdata.id would be channel relative).
+    """
+    def __init__(self, crossbars, granularity=256):
+        assert len(crossbars) == 2**log2_int(len(crossbars), False)
+        self.crossbars   = crossbars
+        self.nchannels   = len(crossbars)
+        self.granularity = granularity
+
+    def get_port(self, mode="both", data_width=None, clock_domain="sys", depth=16, **kwargs):
+        assert kwargs.get("reorder", None) != "OUT_OF_ORDER"
+        ports = [crossbar.get_port(mode=mode, data_width=data_width, clock_domain=clock_domain,
+            **kwargs) for crossbar in self.crossbars]
+        if self.nchannels == 1:
+            return ports[0]
+
+        words_per_stripe = self.granularity*8//ports[0].data_width
+        assert words_per_stripe >= 1
+        port = LiteDRAMNativePort(
+            mode          = mode,
+            address_width = ports[0].address_width + log2_int(self.nchannels),
+            data_width    = ports[0].data_width,
+            clock_domain  = clock_domain,
+            id            = ports[0].id)
+        self.submodules += ClockDomainsRenamer(clock_domain)(
+            LiteDRAMNativePortInterleaver(port, ports, log2_int(words_per_stripe), depth))
+        return port
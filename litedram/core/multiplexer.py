@@ -7,7 +7,8 @@
 
 import math
 from functools import reduce
-from operator import or_, and_
+from operator import or_, and_, add
+from collections import OrderedDict
 
 from migen import *
 from migen.genlib.roundrobin import *
@@ -18,15 +19,33 @@ from litex.soc.interconnect.csr import AutoCSR
 
 from litedram.common import *
 from litedram.core.bandwidth import Bandwidth
+from litedram.core.perfcounters import LiteDRAMPerfCounters
 
 # _CommandChooser ----------------------------------------------------------------------------------
 
 class _CommandChooser(Module):
-    def __init__(self, requests):
+    """Command chooser
+
+    Arbitrate the commands of the BankMachines.
+
+    Two scheduling policies are supported:
+    - "ROUND_ROBIN": all valid commands are arbitrated with the same priority.
+    - "FR_FCFS": First-Ready FCFS, CAS commands (that are only issued by the BankMachines on row
+    hits) are preferred over ACTIVATE/PRECHARGE commands. To avoid starvation, a command that has
+    been waiting for more than age_cap cycles gets the highest priority.
+
+    Requests can also be excluded individually from the arbitration with allowed (used to skip the
+    commands of the bank groups that are not ready) and preferred over the other requests of the same
+    priority with preferred (used to alternate the bank groups).
+    """
+    def __init__(self, requests, policy="ROUND_ROBIN", age_cap=16):
+        assert policy in ["ROUND_ROBIN", "FR_FCFS"]
         self.want_reads     = Signal()
         self.want_writes    = Signal()
         self.want_cmds      = Signal()
         self.want_activates = Signal()
+        self.allowed        = Signal(len(requests), reset=2**len(requests) - 1)
+        self.preferred      = Signal(len(requests))
 
         a  = len(requests[0].a)
         ba = len(requests[0].ba)
@@ -44,16 +63,50 @@ class _CommandChooser(Module):
             command = request.is_cmd & self.want_cmds & (~is_act_cmd | self.want_activates)
             read = request.is_read == self.want_reads
             write = request.is_write == self.want_writes
-            self.comb += valids[i].eq(request.valid & (command | (read & write)))
+            self.comb += valids[i].eq(request.valid & self.allowed[i] & (command | (read & write)))
 
 
         arbiter = RoundRobin(n, SP_CE)
         self.submodules += arbiter
         choices = Array(valids[i] for i in range(n))
-        self.comb += [
-            arbiter.request.eq(valids),
-            cmd.valid.eq(choices[arbiter.grant])
-        ]
+        self.comb += cmd.valid.eq(choices[arbiter.grant])
+
+        # Requests of the highest priority, the preferred ones are arbitrated first
+        candidates = Signal(n)
+        self.comb += \
+            If((candidates & self.preferred) != 0,
+                arbiter.request.eq(candidates & self.preferred)
+            ).Else(
+                arbiter.request.eq(candidates)
+            )
+        if policy == "ROUND_ROBIN":
+            self.comb += candidates.eq(valids)
+        elif policy == "FR_FCFS":
+            # Age of the commands waiting to be accepted
+            starved = Signal(n)
+            for i, request in enumerate(requests):
+                age = Signal(max=age_cap + 1)
+                self.sync += \
+                    If(~request.valid | request.ready,
+                        age.eq(0)
+                    ).Elif(age != age_cap,
+                        age.eq(age + 1)
+                    )
+                self.comb += starved[i].eq((age == age_cap) & ~request.ready)
+
+            # Row hits (CAS commands)
+            hits = Signal(n)
+            self.comb += hits.eq(Cat(*[req.is_read | req.is_write for req in requests]))
+
+            # Arbitrate starved commands first, then row hits and then remaining commands
+            self.comb += \
+                If((valids & starved) != 0,
+                    candidates.eq(valids & starved)
+                ).Elif((valids & hits) != 0,
+                    candidates.eq(valids & hits)
+                ).Else(
+                    candidates.eq(valids)
+                )
 
         for name in ["a", "ba", "is_read", "is_write", "is_cmd"]:
             choices = Array(getattr(req, name) for req in requests)
@@ -94,7 +147,15 @@ class _CommandChooser(Module):
 (STEER_NOP, STEER_CMD, STEER_REQ, STEER_REFRESH) = range(4)
 
 class _Steerer(Module):
-    def __init__(self, commands, dfi):
+    """Command steerer
+
+    Steer the commands to the DFI phases.
+
+    With odt_timings (read delay, length in sys clk cycles), ODT is dynamically driven per command:
+    asserted on the target rank of the writes and on the other ranks for the reads, the ODT of the
+    reads being delayed by the read delay. Otherwise, ODT is statically asserted on all ranks.
+    """
+    def __init__(self, commands, dfi, odt_timings=None):
         ncmd = len(commands)
         nph  = len(dfi.phases)
         self.sel = [Signal(max=ncmd) for i in range(nph)]
@@ -107,14 +168,15 @@ class _Steerer(Module):
             else:
                 return cmd.valid & cmd.ready & getattr(cmd, attr)
 
+        rank_writes = [] # Ranks targeted by the writes of each phase (one-hot)
+        rank_reads  = [] # Ranks targeted by the reads of each phase (one-hot)
         for i, (phase, sel) in enumerate(zip(dfi.phases, self.sel)):
             nranks   = len(phase.cs_n)
             rankbits = log2_int(nranks)
             if hasattr(phase, "reset_n"):
                 self.comb += phase.reset_n.eq(1)
             self.comb += phase.cke.eq(Replicate(Signal(reset=1), nranks))
-            if hasattr(phase, "odt"):
-                # FIXME: add dynamic drive for multi-rank (will be needed for high frequencies)
+            if hasattr(phase, "odt") and odt_timings is None:
                 self.comb += phase.odt.eq(Replicate(Signal(reset=1), nranks))
             if rankbits:
                 rank_decoder = Decoder(nranks)
@@ -143,6 +205,42 @@ class _Steerer(Module):
                 phase.wrdata_en.eq(wrdata_ens[sel])
             ]
 
+            if odt_timings is not None:
+                rank_write = Signal(nranks)
+                rank_read  = Signal(nranks)
+                self.comb += [
+                    rank_write.eq(Replicate(wrdata_ens[sel], nranks) & rank_decoder.o),
+                    rank_read.eq(Replicate(rddata_ens[sel], nranks) & rank_decoder.o),
+                ]
+                rank_writes.append(rank_write)
+                rank_reads.append(rank_read)
+
+        # Dynamic ODT ------------------------------------------------------------------------------
+        if odt_timings is not None:
+            read_delay, length = odt_timings
+            for r in range(nranks):
+                write_odt = Signal()
+                read_odt  = Signal()
+                self.comb += [
+                    write_odt.eq(reduce(or_, [rank_write[r] for rank_write in rank_writes])),
+                    read_odt.eq(reduce(or_, [rank_read != 0 for rank_read in rank_reads]) &
+                        ~reduce(or_, [rank_read[r] for rank_read in rank_reads])),
+                ]
+                for _ in range(read_delay):
+                    new_read_odt = Signal()
+                    self.sync += new_read_odt.eq(read_odt)
+                    read_odt = new_read_odt
+                odt   = Signal()
+                count = Signal(max=max(length, 2))
+                self.sync += \
+                    If(write_odt | read_odt,
+                        count.eq(length - 1)
+                    ).Elif(count != 0,
+                        count.eq(count - 1)
+                    )
+                self.comb += odt.eq(write_odt | read_odt | (count != 0))
+                self.sync += [phase.odt[r].eq(odt) for phase in dfi.phases]
+
 # Multiplexe ---------------------------------------------------------------------------------------
 
 class Multiplexer(Module, AutoCSR):
@@ -159,8 +257,9 @@ class Multiplexer(Module, AutoCSR):
 
         # Command choosing -------------------------------------------------------------------------
         requests = [bm.cmd for bm in bank_machines]
-        self.submodules.choose_cmd = choose_cmd = _CommandChooser(requests)
-        self.submodules.choose_req = choose_req = _CommandChooser(requests)
+        chooser_kwargs = dict(policy=settings.scheduling_policy, age_cap=settings.scheduling_age_cap)
+        self.submodules.choose_cmd = choose_cmd = _CommandChooser(requests, **chooser_kwargs)
+        self.submodules.choose_req = choose_req = _CommandChooser(requests, **chooser_kwargs)
         if settings.phy.nphases == 1:
             # When only 1 phase, use choose_req for all requests
             choose_cmd = choose_req
@@ -169,16 +268,83 @@ class Multiplexer(Module, AutoCSR):
 
         # Command steering -------------------------------------------------------------------------
         nop = Record(cmd_request_layout(settings.geom.addressbits,
-                                        log2_int(len(bank_machines))))
+                                        settings.geom.bankbits + log2_int(settings.phy.nranks)))
         # nop must be 1st
         commands = [nop, choose_cmd.cmd, choose_req.cmd, refresher.cmd]
-        steerer = _Steerer(commands, dfi)
+        odt_timings = None
+        if settings.phy.nranks > 1 and settings.phy.memtype != "SDR":
+            # Keep ODT asserted for the burst + 2 memory clk cycles, from the command for the writes
+            # and from cl - cwl memory clk cycles after the command for the reads.
+            nphases    = settings.phy.nphases
+            read_shift = max(settings.phy.cl - settings.phy.cwl, 0)
+            odt_burst  = burst_lengths[settings.phy.memtype]//2 + 2
+            odt_timings = (read_shift//nphases,
+                math.ceil((read_shift%nphases + nphases - 1 + odt_burst)/nphases))
+        steerer = _Steerer(commands, dfi, odt_timings)
         self.submodules += steerer
 
         # tRRD timing (Row to Row delay) -----------------------------------------------------------
         self.submodules.trrdcon = trrdcon = tXXDController(settings.timing.tRRD)
         self.comb += trrdcon.valid.eq(choose_cmd.accept() & choose_cmd.activate())
 
+        # Bank groups timings (tRRD_L/tCCD_L) ------------------------------------------------------
+        # Commands to the same bank group must respect the long timings, commands to different bank
+        # groups only the short ones (tRRD/tCCD): commands of the bank groups that are not ready are
+        # not arbitrated, so the choosers select commands of the other bank groups meanwhile. To
+        # alternate the bank groups, the CAS/ACTIVATE commands to a different bank group than the
+        # last CAS/ACTIVATE are also preferred by the choosers.
+        allowed_masks = [] # Requests allowed to be arbitrated by the choosers
+        groupbits = settings.geom.groupbits
+        tccd_l    = settings.timing.tCCD_L
+        trrd_l    = settings.timing.tRRD_L
+        if groupbits and (tccd_l is not None or trrd_l is not None):
+            bankbits = settings.geom.bankbits
+            def group(cmd):
+                return cmd.ba[bankbits - groupbits:bankbits]
+            allowed = Signal(len(requests))
+            tccd_l_readys = []
+            trrd_l_readys = []
+            for g in range(2**groupbits):
+                tccdlcon = tXXDController(tccd_l)
+                trrdlcon = tXXDController(trrd_l)
+                self.submodules += tccdlcon, trrdlcon
+                self.comb += [
+                    tccdlcon.valid.eq(choose_req.accept() & (choose_req.write() | choose_req.read()) &
+                        (group(choose_req.cmd) == g)),
+                    trrdlcon.valid.eq(choose_cmd.accept() & choose_cmd.activate() &
+                        (group(choose_cmd.cmd) == g)),
+                ]
+                tccd_l_readys.append(tccdlcon.ready)
+                trrd_l_readys.append(trrdlcon.ready)
+            for i, req in enumerate(requests):
+                is_act = req.ras & ~req.cas & ~req.we
+                is_cas = req.is_read | req.is_write
+                self.comb += allowed[i].eq(
+                    (~is_cas | Array(tccd_l_readys)[group(req)]) &
+                    (~is_act | Array(trrd_l_readys)[group(req)]))
+            allowed_masks.append(allowed)
+
+            last_cas_group = Signal(groupbits)
+            last_act_group = Signal(groupbits)
+            preferred      = Signal(len(requests))
+            self.sync += [
+                If(choose_req.accept() & (choose_req.write() | choose_req.read()),
+                    last_cas_group.eq(group(choose_req.cmd))
+                ),
+                If(choose_cmd.accept() & choose_cmd.activate(),
+                    last_act_group.eq(group(choose_cmd.cmd))
+                )
+            ]
+            for i, req in enumerate(requests):
+                is_act = req.ras & ~req.cas & ~req.we
+                is_cas = req.is_read | req.is_write
+                self.comb += preferred[i].eq(
+                    (is_cas & (group(req) != last_cas_group)) |
+                    (is_act & (group(req) != last_act_group)))
+            self.comb += choose_req.preferred.eq(preferred)
+            if choose_cmd is not choose_req:
+                self.comb += choose_cmd.preferred.eq(preferred)
+
         # tFAW timing (Four Activate Window) -------------------------------------------------------
         self.submodules.tfawcon = tfawcon = tFAWController(settings.timing.tFAW)
         self.comb += tfawcon.valid.eq(choose_cmd.accept() & choose_cmd.activate())
@@ -193,14 +359,97 @@ class Multiplexer(Module, AutoCSR):
         # CAS control ------------------------------------------------------------------------------
         self.comb += cas_allowed.eq(tccdcon.ready)
 
-        # tWTR timing (Write to Read delay) --------------------------------------------------------
-        write_latency = math.ceil(settings.phy.cwl / settings.phy.nphases)
+        # Read/Write turnarounds (Read to Write and Write to Read delays) --------------------------
+        nphases = settings.phy.nphases
+        twtr    = 0 if settings.timing.tWTR is None else settings.timing.tWTR*nphases
+        trtrs   = None if settings.timing.tRTRS is None else settings.timing.tRTRS*nphases
+        rtw, wtr, rtw_rank, wtr_rank, ccd_rank = get_turnarounds(
+            memtype = settings.phy.memtype,
+            cl      = settings.phy.cl,
+            cwl     = settings.phy.cwl,
+            twtr    = twtr,
+            trtrs   = trtrs)
+        if settings.phy.nranks > 1:
+            rtw, wtr = max(rtw, rtw_rank), max(wtr, wtr_rank)
+
+        def cmd_delay(ck, first_cmdphase, second_cmdphase):
+            # The second command is issued at least one sys clk cycle after the RTW/WTR state
+            # (entered one cycle after the first command): delay of the tXXDController.
+            return max(math.ceil((ck + first_cmdphase - second_cmdphase)/nphases) - 1, 1)
+
+        self.submodules.trtwcon = trtwcon = tXXDController(
+            cmd_delay(rtw, settings.phy.rdcmdphase, settings.phy.wrcmdphase))
+        self.comb += trtwcon.valid.eq(choose_req.accept() & choose_req.read())
+
         self.submodules.twtrcon = twtrcon = tXXDController(
-            settings.timing.tWTR + write_latency +
-            # tCCD must be added since tWTR begins after the transfer is complete
-            settings.timing.tCCD if settings.timing.tCCD is not None else 0)
+            cmd_delay(wtr, settings.phy.wrcmdphase, settings.phy.rdcmdphase))
         self.comb += twtrcon.valid.eq(choose_req.accept() & choose_req.write())
 
+        # Ranks (rank to rank switch and rank batching) --------------------------------------------
+        # Reads/writes to a different rank than the previous read/write must respect the rank to
+        # rank switch time (tRTRS). To limit the rank switches, the reads/writes are batched per
+        # rank: reads/writes to other ranks are only arbitrated when there are no reads/writes to
+        # the current rank or when rank_batch reads/writes have been issued to the current rank
+        # (the current rank then stops issuing while other ranks are pending, so a rank streaming
+        # reads/writes does not starve the other ranks).
+        if settings.phy.nranks > 1:
+            bankbits = settings.geom.bankbits
+            def rank(cmd):
+                return cmd.ba[bankbits:]
+            cas_accept   = Signal()
+            current_rank = Signal(max=settings.phy.nranks)
+            cas_current  = Signal()
+            cas_other    = Signal()
+            rank_switch  = Signal()
+            rank_hold    = Signal() # Current rank batch done, other ranks pending
+            allowed      = Signal(len(requests))
+            self.comb += cas_accept.eq(choose_req.accept() & (choose_req.write() | choose_req.read()))
+            self.sync += If(cas_accept, current_rank.eq(rank(choose_req.cmd)))
+
+            self.submodules.trtrscon = trtrscon = tXXDController(math.ceil(ccd_rank/nphases))
+            self.comb += trtrscon.valid.eq(cas_accept)
+
+            def cas_wanted(req):
+                return req.valid & ((req.is_read  & choose_req.want_reads) |
+                                    (req.is_write & choose_req.want_writes))
+            self.comb += [
+                cas_current.eq(reduce(or_, [cas_wanted(req) & (rank(req) == current_rank)
+                    for req in requests])),
+                cas_other.eq(reduce(or_, [cas_wanted(req) & (rank(req) != current_rank)
+                    for req in requests])),
+            ]
+            if settings.rank_batch is None:
+                self.comb += rank_switch.eq(trtrscon.ready)
+            else:
+                batch_count = Signal(max=settings.rank_batch + 1)
+                self.sync += \
+                    If(cas_accept,
+                        If(rank(choose_req.cmd) != current_rank,
+                            batch_count.eq(1)
+                        ).Elif(batch_count != settings.rank_batch,
+                            batch_count.eq(batch_count + 1)
+                        )
+                    )
+                self.comb += [
+                    rank_switch.eq(trtrscon.ready &
+                        (~cas_current | (batch_count == settings.rank_batch))),
+                    rank_hold.eq((batch_count == settings.rank_batch) & cas_other),
+                ]
+
+            for i, req in enumerate(requests):
+                is_cas = req.is_read | req.is_write
+                self.comb += allowed[i].eq(~is_cas |
+                    ((rank(req) == current_rank) & ~rank_hold) |
+                    ((rank(req) != current_rank) & rank_switch))
+            allowed_masks.append(allowed)
+
+        # Requests masks ---------------------------------------------------------------------------
+        if allowed_masks:
+            allowed = reduce(and_, allowed_masks)
+            self.comb += choose_req.allowed.eq(allowed)
+            if choose_cmd is not choose_req:
+                self.comb += choose_cmd.allowed.eq(allowed)
+
         # Read/write turnaround --------------------------------------------------------------------
         read_available = Signal()
         write_available = Signal()
@@ -232,10 +481,44 @@ class Multiplexer(Module, AutoCSR):
         read_time_en,   max_read_time = anti_starvation(settings.read_time)
         write_time_en, max_write_time = anti_starvation(settings.write_time)
 
+        # Write drain ------------------------------------------------------------------------------
+        # Without watermarks, switch to writes as soon as there are no more reads. With watermarks,
+        # reads keep the priority until the number of buffered writes reaches the high watermark,
+        # then writes are drained in batch until the low watermark is reached (or, without reads
+        # pending, until there are no more writes).
+        read_to_write = Signal()
+        write_to_read = Signal()
+        if settings.write_drain_high is None:
+            self.comb += [
+                read_to_write.eq(~read_available | max_read_time),
+                write_to_read.eq(~write_available | max_write_time),
+            ]
+        else:
+            assert settings.write_drain_low < settings.write_drain_high
+            write_level = Signal(max=len(bank_machines)*(settings.cmd_buffer_depth + 1) + 1)
+            written     = Signal()
+            self.comb += [
+                write_level.eq(reduce(add, [bm.write_count for bm in bank_machines])),
+                read_to_write.eq(~read_available | max_read_time |
+                    (write_level >= settings.write_drain_high)),
+                write_to_read.eq(~write_available | max_write_time |
+                    (read_available & written & (write_level <= settings.write_drain_low))),
+            ]
+            # Issue at least a write per turnaround (the reads can be available again when entering
+            # WRITE below the low watermark).
+            self.sync += \
+                If(choose_req.accept() & choose_req.write(),
+                    written.eq(1)
+                ).Elif(choose_req.accept() & choose_req.read(),
+                    written.eq(0)
+                )
+
         # Refresh ----------------------------------------------------------------------------------
-        self.comb += [bm.refresh_req.eq(refresher.cmd.valid) for bm in bank_machines]
+        self.comb += [bm.refresh_req.eq(refresher.cmd.valid & refresher.banks[n])
+            for n, bm in enumerate(bank_machines)]
+        self.comb += refresher.idle.eq(~reduce(or_, [bm.req.valid | bm.req.lock for bm in bank_machines]))
         go_to_refresh = Signal()
-        bm_refresh_gnts = [bm.refresh_gnt for bm in bank_machines]
+        bm_refresh_gnts = [bm.refresh_gnt | ~refresher.banks[n] for n, bm in enumerate(bank_machines)]
         self.comb += go_to_refresh.eq(reduce(and_, bm_refresh_gnts))
 
         # Datapath ---------------------------------------------------------------------------------
@@ -282,7 +565,7 @@ class Multiplexer(Module, AutoCSR):
             steerer_sel(steerer, "read"),
             If(write_available,
                 # TODO: switch only after several cycles of ~read_available?
-                If(~read_available | max_read_time,
+                If(read_to_write,
                     NextState("RTW")
                 )
             ),
@@ -302,7 +585,7 @@ class Multiplexer(Module, AutoCSR):
             ),
             steerer_sel(steerer, "write"),
             If(read_available,
-                If(~write_available | max_write_time,
+                If(write_to_read,
                     NextState("WTR")
                 )
             ),
@@ -322,9 +605,23 @@ class Multiplexer(Module, AutoCSR):
                 NextState("READ")
             )
         )
-        # TODO: reduce this, actual limit is around (cl+1)/nphases
-        fsm.delayed_enter("RTW", "WRITE", settings.phy.read_latency-1)
+        fsm.act("RTW",
+            If(trtwcon.ready,
+                NextState("WRITE")
+            )
+        )
 
         if settings.with_bandwidth:
             data_width = settings.phy.dfi_databits*settings.phy.nphases
             self.submodules.bandwidth = Bandwidth(self.choose_req.cmd, data_width)
+
+        if settings.with_perf_counters:
+            act_pending = reduce(or_, [req.valid & req.ras & ~req.cas & ~req.we for req in requests])
+            events = OrderedDict([
+                ("rtw",            fsm.after_entering("RTW")),
+                ("wtr",            fsm.after_entering("WTR")),
+                ("refresh_stalls", refresher.cmd.valid),
+                ("trrd_stalls",    act_pending & ~trrdcon.ready),
+                ("tfaw_stalls",    act_pending & ~tfawcon.ready),
+            ])
+            self.submodules.perf_counters = LiteDRAMPerfCounters(dfi, bank_machines, events)
@@ -0,0 +1,188 @@
+# This file is Copyright (c) 2026 agent <agent@local>
+# License: BSD
+
+"""LiteDRAM Performance Counters."""
+
+from functools import reduce
+from operator import add
+from collections import OrderedDict
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
+
+# EventCounters ------------------------------------------------------------------------------------
+
+class EventCounters(Module, AutoCSR):
+    """Event Counters
+
+    Count the events (name: increment) in free-running counters (wrapping at 2**counter_bits), the
+    values of the counters are all latched in the CSRs when update is written. Events of other
+    modules (in the same clock domain) can be added with add_events.
+    """
+    def __init__(self, events, counter_bits=32):
+        self.counter_bits = counter_bits
+        self.update       = CSR(name="update")
+        self.add_events(events)
+
+    def add_events(self, events):
+        for name, increment in events.items():
+            assert not hasattr(self, name)
+            counter = Signal(self.counter_bits)
+            csr     = CSRStatus(self.counter_bits, name=name)
+            setattr(self, name, csr)
+            self.sync += [
+                counter.eq(counter + increment),
+                If(self.update.re, csr.status.eq(counter))
+            ]
+
+# LiteDRAMPerfCounters -----------------------------------------------------------------------------
+
+class LiteDRAMPerfCounters(EventCounters):
+    """LiteDRAM Performance Counters
+
+    Count the controller events to diagnose its efficiency losses:
+    - bank{n}_row_hits/row_misses/row_conflicts: commands of the bank finding their row opened, no
+    row opened or another row opened.
+    - activates/precharges/refreshes/reads/writes: commands issued on the DFI interface.
+    - the events of the Multiplexer (turnarounds, refresh/timings stall cycles).
+    - the events of the frontends added with add_events (ex: port{n}_read_hits of the reads
+    forwarded by a LiteDRAMNativeWriteCombiner).
+    """
+    def __init__(self, dfi, bank_machines, events, counter_bits=32):
+        increments = OrderedDict()
+
+        # Row hits/misses/conflicts ----------------------------------------------------------------
+        for n, bm in enumerate(bank_machines):
+            increments["bank{}_row_hits".format(n)]      = bm.row_hit_event
+            increments["bank{}_row_misses".format(n)]    = bm.row_miss_event
+            increments["bank{}_row_conflicts".format(n)] = bm.row_conflict_event
+
+        # DFI commands -----------------------------------------------------------------------------
+        dfi_commands = OrderedDict([
+            # name         ras_n cas_n we_n
+            ("activates",  (0,    1,    1)),
+            ("precharges", (0,    1,    0)),
+            ("refreshes",  (0,    0,    1)),
+            ("reads",      (1,    0,    1)),
+            ("writes",     (1,    0,    0)),
+        ])
+        for name, (ras_n, cas_n, we_n) in dfi_commands.items():
+            issued = []
+            for phase in dfi.phases:
+                issued.append((phase.cs_n != (2**len(phase.cs_n) - 1)) &
+                    (phase.ras_n == ras_n) & (phase.cas_n == cas_n) & (phase.we_n == we_n))
+            increments[name] = reduce(add, issued)
+
+        # Multiplexer events -----------------------------------------------------------------------
+        increments.update(events)
+
+        # Counters ---------------------------------------------------------------------------------
+        EventCounters.__init__(self, increments, counter_bits)
+
+# LatencyHistogram ---------------------------------------------------------------------------------
+
+class LatencyHistogram(Module, AutoCSR):
+    """Read Latency Histogram
+
+    Measure the latency (in clk cycles) from the read commands of a port to their first read data
+    and bin it in nbuckets log2 buckets: bucket{n} counts the latencies in [2**(n-1), 2**n[, bucket0
+    the null latencies and the last bucket all the larger latencies. The min, max, sum and count of
+    the latencies are also measured (the mean latency is sum/count).
+
+    The port can be a LiteDRAMNativePort or an AXIInterface, its read data must be returned in the
+    commands order and depth must cover its outstanding reads. The statistics are latched in the
+    CSRs when update is written and cleared when reset is written.
+    """
+    def __init__(self, port, nbuckets=16, depth=16, timestamp_bits=16, counter_bits=32):
+        self.update = CSR(name="update")
+        self.reset  = CSR(name="reset")
+        self.min    = CSRStatus(timestamp_bits, name="min")
+        self.max    = CSRStatus(timestamp_bits, name="max")
+        self.sum    = CSRStatus(counter_bits, name="sum")
+        self.count  = CSRStatus(counter_bits, name="count")
+        for n in range(nbuckets):
+            setattr(self, "bucket{}".format(n), CSRStatus(counter_bits, name="bucket{}".format(n)))
+
+        self.latency_min   = latency_min   = Signal(timestamp_bits, reset=2**timestamp_bits - 1)
+        self.latency_max   = latency_max   = Signal(timestamp_bits)
+        self.latency_sum   = latency_sum   = Signal(counter_bits)
+        self.latency_count = latency_count = Signal(counter_bits)
+
+        # # #
+
+        # Read commands / data ---------------------------------------------------------------------
+        axi = hasattr(port, "ar")
+        if axi:
+            cmd, rdata = port.ar, port.r
+            read      = cmd.valid & cmd.ready
+            len_width = 0 # Bursts delimited by r.last.
+        else:
+            assert not hasattr(port.rdata, "id")
+            cmd, rdata = port.cmd, port.rdata
+            read      = cmd.valid & cmd.ready & ~cmd.we
+            len_width = len(cmd.len) if hasattr(cmd, "len") else 0
+        beat  = Signal()
+        first = Signal(reset=1)
+        last  = Signal()
+        self.comb += beat.eq(rdata.valid & rdata.ready)
+        self.sync += If(beat, first.eq(last))
+
+        # Timestamps -------------------------------------------------------------------------------
+        timestamp = Signal(timestamp_bits)
+        self.sync += timestamp.eq(timestamp + 1)
+
+        fifo = stream.SyncFIFO([("timestamp", timestamp_bits)] +
+            ([("len", len_width)] if len_width else []), depth)
+        self.submodules += fifo
+        self.comb += [
+            fifo.sink.valid.eq(read),
+            fifo.sink.timestamp.eq(timestamp),
+            fifo.source.ready.eq(beat & last)
+        ]
+        if axi:
+            self.comb += last.eq(rdata.last)
+        elif len_width:
+            beats = Signal(len_width)
+            self.comb += [
+                fifo.sink.len.eq(cmd.len),
+                last.eq(beats == fifo.source.len)
+            ]
+            self.sync += If(beat, If(last, beats.eq(0)).Else(beats.eq(beats + 1)))
+        else:
+            self.comb += last.eq(1)
+
+        # Statistics -------------------------------------------------------------------------------
+        latency = Signal(timestamp_bits)
+        bucket  = Signal(max=max(nbuckets, 2))
+        sample  = Signal()
+        self.comb += [
+            latency.eq(timestamp - fifo.source.timestamp),
+            bucket.eq(0),
+            [If(latency >= 2**(n - 1), bucket.eq(n)) for n in range(1, nbuckets)],
+            sample.eq(beat & first)
+        ]
+        buckets = [Signal(counter_bits) for n in range(nbuckets)]
+        self.sync += [
+            If(self.reset.re,
+                latency_min.eq(latency_min.reset),
+                latency_max.eq(0),
+                latency_sum.eq(0),
+                latency_count.eq(0),
+                [b.eq(0) for b in buckets]
+            ).Elif(sample,
+                If(latency < latency_min, latency_min.eq(latency)),
+                If(latency > latency_max, latency_max.eq(latency)),
+                latency_sum.eq(latency_sum + latency),
+                latency_count.eq(latency_count + 1),
+                Array(buckets)[bucket].eq(Array(buckets)[bucket] + 1)
+            ),
+            If(self.update.re,
+                self.min.status.eq(latency_min),
+                self.max.status.eq(latency_max),
+                self.sum.status.eq(latency_sum),
+                self.count.status.eq(latency_count),
+                [getattr(self, "bucket{}".format(n)).status.eq(b) for n, b in enumerate(buckets)]
+            )
+        ]
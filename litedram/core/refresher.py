@@ -5,7 +5,7 @@
 """LiteDRAM Refresher."""
 
 from migen import *
-from migen.genlib.misc import timeline
+from migen.genlib.misc import timeline, WaitTimer
 
 from litex.soc.interconnect import stream
 
@@ -21,8 +21,12 @@ class RefreshExecuter(Module):
     - Wait tRP
     - Send an "Auto Refresh" command
     - Wait tRFC
+
+    With per-bank refresh (bank is not None), the bank has already been precharged by its BankMachine
+    that also waits tRFC after the refresh:
+    - Send a "Per-Bank Auto Refresh" command to the bank
     """
-    def __init__(self, cmd, trp, trfc):
+    def __init__(self, cmd, trp, trfc, bank=None):
         self.start = Signal()
         self.done  = Signal()
 
@@ -35,6 +39,33 @@ class RefreshExecuter(Module):
             cmd.ras.eq(0),
             cmd.we.eq( 0),
             self.done.eq(0),
+        ]
+        if bank is not None:
+            self.sync += [
+                # Wait start
+                timeline(self.start, [
+                    # Per-Bank Auto Refresh
+                    (0, [
+                        cmd.a.eq(  0),
+                        cmd.ba.eq( bank),
+                        cmd.cas.eq(1),
+                        cmd.ras.eq(1),
+                        cmd.we.eq( 0),
+                    ]),
+                    # Done
+                    (1, [
+                        cmd.a.eq(  0),
+                        cmd.ba.eq( 0),
+                        cmd.cas.eq(0),
+                        cmd.ras.eq(0),
+                        cmd.we.eq( 0),
+                        self.done.eq(1),
+                    ]),
+                ])
+            ]
+            return
+
+        self.sync += [
             # Wait start
             timeline(self.start, [
                 # Precharge All
@@ -72,13 +103,13 @@ class RefreshSequencer(Module):
 
     Sequence N refreshs to the DRAM.
     """
-    def __init__(self, cmd, trp, trfc, postponing=1):
+    def __init__(self, cmd, trp, trfc, postponing=1, bank=None):
         self.start = Signal()
         self.done  = Signal()
 
         # # #
 
-        executer = RefreshExecuter(cmd, trp, trfc)
+        executer = RefreshExecuter(cmd, trp, trfc, bank)
         self.submodules += executer
 
         count = Signal(bits_for(postponing), reset=postponing-1)
@@ -149,6 +180,47 @@ class RefreshPostponer(Module):
             )
         ]
 
+# RefreshScheduler ---------------------------------------------------------------------------------
+
+class RefreshScheduler(Module):
+    """Refresh Scheduler
+
+    Elastic scheduling of the Refresh requests: track the refresh debt (number of tREFI periods
+    elapsed minus number of refreshs issued) and:
+    - Postpone the refreshs while the controller is busy, up to N refreshs.
+    - Force a refresh when N refreshs have been postponed.
+    - Issue the postponed refreshs and pull in up to max_pull_in refreshs in advance when the
+    controller has been idle for idle_cycles.
+    """
+    def __init__(self, postponing=1, max_pull_in=8, idle_cycles=16):
+        self.tick   = Signal() # tREFI period elapsed
+        self.idle   = Signal() # Controller idle
+        self.issued = Signal() # Refresh issued
+        self.req    = Signal() # Refresh request
+
+        # # #
+
+        debt = Signal(min=-max_pull_in, max=postponing + 2)
+        self.sync += [
+            If(self.tick & ~self.issued,
+                debt.eq(debt + 1)
+            ).Elif(~self.tick & self.issued,
+                debt.eq(debt - 1)
+            )
+        ]
+
+        idle_timer = WaitTimer(idle_cycles)
+        self.submodules += idle_timer
+        self.comb += idle_timer.wait.eq(self.idle)
+
+        self.comb += [
+            If(debt >= postponing,
+                self.req.eq(1)
+            ).Elif(idle_timer.done & (debt > -max_pull_in),
+                self.req.eq(1)
+            )
+        ]
+
 # ZQCSExecuter ----------------------------------------------------------------------------------
 
 class ZQCSExecuter(Module):
@@ -214,12 +286,23 @@ class Refresher(Module):
     this allows the Controller to finish the current transaction and block next transactions. Once all
     transactions are done, the Refresher can execute the refresh Sequence and release the Controller.
 
+    With elastic refresh, the refreshs are issued one by one by a RefreshScheduler: they are pulled
+    in while the Controller is idle, postponed while it is busy and forced when N refreshs have been
+    postponed.
+
+    With per-bank refresh, the banks are refreshed in turn every tREFI/nbanks: only the BankMachines
+    of the refreshed bank (selected with banks) are blocked, the others continue to serve traffic.
     """
-    def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1):
+    def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1, elastic=False,
+        max_pull_in=8, idle_cycles=16, per_bank=False):
         assert postponing <= 8
+        assert not (per_bank and postponing > 1 and not elastic)
         abits  = settings.geom.addressbits
         babits = settings.geom.bankbits + log2_int(settings.phy.nranks)
-        self.cmd = cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+        nbanks = 2**settings.geom.bankbits
+        self.cmd   = cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+        self.idle  = Signal() # Controller idle (used with elastic refresh)
+        self.banks = Signal(nbanks*settings.phy.nranks) # BankMachines concerned by the refresh
 
         # # #
 
@@ -227,19 +310,53 @@ class Refresher(Module):
         wants_zqcs    = Signal()
 
         # Refresh Timer ----------------------------------------------------------------------------
-        timer = RefreshTimer(settings.timing.tREFI)
+        trefi = settings.timing.tREFI
+        if per_bank:
+            trefi = trefi//nbanks
+        timer = RefreshTimer(trefi)
         self.submodules.timer = timer
         self.comb += timer.wait.eq(~timer.done)
 
-        # Refresh Postponer ------------------------------------------------------------------------
-        postponer = RefreshPostponer(postponing)
-        self.submodules.postponer = postponer
-        self.comb += postponer.req_i.eq(self.timer.done)
-        self.comb += wants_refresh.eq(postponer.req_o)
+        if elastic:
+            # Refresh Scheduler --------------------------------------------------------------------
+            scheduler = RefreshScheduler(postponing, max_pull_in, idle_cycles)
+            self.submodules.scheduler = scheduler
+            self.comb += scheduler.tick.eq(self.timer.done)
+            self.comb += scheduler.idle.eq(self.idle)
+            self.comb += wants_refresh.eq(scheduler.req)
+        else:
+            # Refresh Postponer --------------------------------------------------------------------
+            postponer = RefreshPostponer(postponing)
+            self.submodules.postponer = postponer
+            self.comb += postponer.req_i.eq(self.timer.done)
+            self.comb += wants_refresh.eq(postponer.req_o)
+
+        # Refresh Bank -----------------------------------------------------------------------------
+        bank         = None
+        zqcs_pending = Signal()
+        if per_bank:
+            # SDR/DDR/LPDDR/DDR2/DDR3/DDR4 Auto Refresh commands always refresh all the banks.
+            assert settings.phy.memtype in ["LPDDR3"], "Memory does not support per-bank refresh"
+            assert settings.timing.tRFCpb is not None, "Module does not support per-bank refresh"
+            bank = Signal(settings.geom.bankbits)
+            self.comb += [
+                # Only the BankMachines of the refreshed bank (on all ranks), all of them for ZQCS.
+                If(zqcs_pending,
+                    self.banks.eq(2**len(self.banks) - 1)
+                ).Else(
+                    self.banks.eq(Cat(*[bank == (n % nbanks) for n in range(len(self.banks))]))
+                )
+            ]
+        else:
+            self.comb += self.banks.eq(2**len(self.banks) - 1)
 
         # Refresh Sequencer ------------------------------------------------------------------------
-        sequencer = RefreshSequencer(cmd, settings.timing.tRP, settings.timing.tRFC, postponing)
+        sequencer = RefreshSequencer(cmd, settings.timing.tRP, settings.timing.tRFC,
+            postponing = 1 if elastic else postponing,
+            bank       = bank)
         self.submodules.sequencer = sequencer
+        if elastic:
+            self.comb += scheduler.issued.eq(sequencer.start)
 
         if settings.timing.tZQCS is not None:
             # ZQCS Timer ---------------------------------------------------------------------------
@@ -268,7 +385,47 @@ class Refresher(Module):
                 NextState("DO-REFRESH")
             )
         )
-        if settings.timing.tZQCS is None:
+        if per_bank:
+            # Release the Controller after the refresh and wait tRFCpb before the next refresh (the
+            # ZQCS, that needs all the banks, is then executed separately).
+            fsm.act("DO-REFRESH",
+                cmd.valid.eq(1),
+                If(sequencer.done,
+                    cmd.valid.eq(0),
+                    cmd.last.eq(1),
+                    NextValue(bank, bank + 1),
+                    NextState("TRFC")
+                )
+            )
+            if settings.timing.tZQCS is None:
+                fsm.delayed_enter("TRFC", "IDLE", settings.timing.tRFCpb - 1)
+            else:
+                fsm.delayed_enter("TRFC", "ZQCS", settings.timing.tRFCpb - 1)
+                fsm.act("ZQCS",
+                    If(wants_zqcs,
+                        NextState("WAIT-BANK-MACHINES-ZQCS")
+                    ).Else(
+                        NextState("IDLE")
+                    )
+                )
+                fsm.act("WAIT-BANK-MACHINES-ZQCS",
+                    zqcs_pending.eq(1),
+                    cmd.valid.eq(1),
+                    If(cmd.ready,
+                        zqcs_executer.start.eq(1),
+                        NextState("DO-ZQCS")
+                    )
+                )
+                fsm.act("DO-ZQCS",
+                    zqcs_pending.eq(1),
+                    cmd.valid.eq(1),
+                    If(zqcs_executer.done,
+                        cmd.valid.eq(0),
+                        cmd.last.eq(1),
+                        NextState("IDLE")
+                    )
+                )
+        elif settings.timing.tZQCS is None:
             fsm.act("DO-REFRESH",
                 cmd.valid.eq(1),
                 If(sequencer.done,
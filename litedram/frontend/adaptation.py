@@ -1,11 +1,16 @@
 # This file is Copyright (c) 2016-2019 Florent Kermarrec <florent@enjoy-digital.fr>
 # License: BSD
 
+from collections import OrderedDict
+
 from migen import *
+from migen.genlib.misc import WaitTimer
 
 from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import AutoCSR
 
 from litedram.common import *
+from litedram.core.perfcounters import EventCounters
 
 # LiteDRAMNativePortCDC ----------------------------------------------------------------------------
 
@@ -322,3 +327,162 @@ class LiteDRAMNativePortConverter(Module):
                 port_from.wdata.connect(port_to.wdata),
                 port_to.rdata.connect(port_from.rdata)
             ]
+
+# LiteDRAMNativeWriteCombiner ----------------------------------------------------------------------
+
+class LiteDRAMNativeWriteCombiner(Module, AutoCSR):
+    """LiteDRAM port Write Combiner
+
+    This module merges the partial (masked) writes of a user port to the same address in a write
+    combining buffer to reduce the number of writes issued to the controller.
+    - A write to the address of the buffer is merged in the buffer (the written bytes are updated).
+    - The buffer is flushed (written to the controller) when a write to another address is received,
+    when all its bytes are written, when port_from.flush is set or after timeout cycles without
+    writes merged. A pending flush is issued before the reads to other addresses.
+    - Reads to the address of the buffer are forwarded from the buffer: returned directly when all
+    the bytes are written, else read from the controller and merged with the written bytes.
+    - Reads to other addresses are passed through.
+
+    The read-after-write forwarding is done here and not in the controller: the BankMachines and the
+    crossbar only hold the addresses of the pending writes, their data stays in the masters until the
+    write is issued. Only the reads of the ports using a LiteDRAMNativeWriteCombiner are forwarded.
+
+    With with_perf_counters, the read hits, merged writes and flushes are counted in CSRs. With
+    perf_counters (the LiteDRAMPerfCounters of the controller), they are also counted there as
+    port{n}_read_hits, port{n}_merges and port{n}_flushes (n: id of port_to).
+    """
+    def __init__(self, port_from, port_to, timeout=16, rdata_depth=16, with_perf_counters=False,
+        perf_counters=None):
+        assert port_from.clock_domain == port_to.clock_domain
+        assert port_from.data_width   == port_to.data_width
+        assert port_from.mode         == port_to.mode
+        assert port_from.mode in ["write", "both"]
+        assert not hasattr(port_to.rdata, "id") # Read data must be returned in order.
+
+        # # #
+
+        data_width = port_from.data_width
+
+        valid = Signal()
+        addr  = Signal(port_to.address_width)
+        data  = Signal(data_width)
+        we    = Signal(data_width//8)
+
+        hit   = Signal()
+        full  = Signal()
+        flush = Signal()
+        read  = Signal()
+        self.comb += [
+            hit.eq(valid & (port_from.cmd.addr == addr)),
+            full.eq(we == (2**len(we) - 1)),
+        ]
+
+        # Flush after timeout cycles without writes merged.
+        timer = WaitTimer(timeout)
+        self.submodules += timer
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+
+        # Flush requests are kept until the buffer is flushed (or found empty).
+        flush_req = Signal()
+        self.sync += \
+            If((fsm.ongoing("FLUSH-WDATA") & port_to.wdata.ready) | (fsm.ongoing("IDLE") & ~valid),
+                flush_req.eq(0)
+            ).Elif(port_from.flush,
+                flush_req.eq(1)
+            )
+
+        self.comb += [
+            timer.wait.eq(valid & fsm.ongoing("IDLE")),
+            flush.eq(full | flush_req | port_from.flush | timer.done)
+        ]
+        # A pending flush has the priority over the reads passed through (the reads hitting the
+        # buffer are still forwarded first).
+        fsm.act("IDLE",
+            If(port_from.cmd.valid & port_from.cmd.we,
+                If(~valid | hit,
+                    port_from.cmd.ready.eq(1),
+                    NextValue(addr, port_from.cmd.addr),
+                    NextState("MERGE")
+                ).Else(
+                    NextState("FLUSH")
+                )
+            ).Elif(valid & flush & ~(port_from.cmd.valid & hit),
+                NextState("FLUSH")
+            ).Elif(port_from.cmd.valid,
+                read.eq(1)
+            )
+        )
+        fsm.act("MERGE",
+            port_from.wdata.ready.eq(1),
+            If(port_from.wdata.valid,
+                NextValue(valid, 1),
+                NextValue(we, we | port_from.wdata.we),
+                [If(port_from.wdata.we[i],
+                    NextValue(data[8*i:8*(i + 1)], port_from.wdata.data[8*i:8*(i + 1)])
+                ) for i in range(data_width//8)],
+                NextState("IDLE")
+            )
+        )
+        fsm.act("FLUSH",
+            port_to.cmd.valid.eq(1),
+            port_to.cmd.we.eq(1),
+            port_to.cmd.addr.eq(addr),
+            If(port_to.cmd.ready,
+                NextState("FLUSH-WDATA")
+            )
+        )
+        fsm.act("FLUSH-WDATA",
+            port_to.wdata.valid.eq(1),
+            port_to.wdata.data.eq(data),
+            port_to.wdata.we.eq(we),
+            If(port_to.wdata.ready,
+                NextValue(valid, 0),
+                NextValue(we, 0),
+                NextState("IDLE")
+            )
+        )
+
+        # Reads ------------------------------------------------------------------------------------
+        if port_from.mode == "both":
+            # The bytes to forward of the reads are queued until their read data are returned,
+            # reads hitting a full buffer do not issue a read to the controller (bypass).
+            rdata_fifo = stream.SyncFIFO([("bypass", 1), ("data", data_width), ("we", len(we))],
+                rdata_depth)
+            self.submodules += rdata_fifo
+            bypass = Signal()
+            self.comb += [
+                bypass.eq(hit & full),
+                If(read & rdata_fifo.sink.ready,
+                    port_to.cmd.valid.eq(~bypass),
+                    port_to.cmd.addr.eq(port_from.cmd.addr),
+                    port_from.cmd.ready.eq(bypass | port_to.cmd.ready)
+                ),
+                rdata_fifo.sink.valid.eq(read & port_from.cmd.ready),
+                rdata_fifo.sink.bypass.eq(bypass),
+                rdata_fifo.sink.data.eq(data),
+                rdata_fifo.sink.we.eq(Replicate(hit, len(we)) & we)
+            ]
+
+            source = rdata_fifo.source
+            mask   = Signal(data_width)
+            self.comb += [
+                mask.eq(Cat(*[Replicate(source.we[i], 8) for i in range(len(we))])),
+                port_from.rdata.valid.eq(source.valid & (source.bypass | port_to.rdata.valid)),
+                port_from.rdata.data.eq((port_to.rdata.data & ~mask) | (source.data & mask)),
+                port_to.rdata.ready.eq(source.valid & ~source.bypass & port_from.rdata.ready),
+                source.ready.eq(port_from.rdata.valid & port_from.rdata.ready)
+            ]
+
+        # Performance counters ---------------------------------------------------------------------
+        events = OrderedDict([
+            ("read_hits", port_from.cmd.valid & port_from.cmd.ready & ~port_from.cmd.we & hit),
+            ("merges",    port_from.cmd.valid & port_from.cmd.ready & port_from.cmd.we & hit),
+            ("flushes",   port_to.wdata.valid & port_to.wdata.ready),
+        ])
+        if with_perf_counters:
+            self.submodules.perf_counters = EventCounters(events)
+        if perf_counters is not None:
+            assert port_to.clock_domain == "sys"
+            perf_counters.add_events(OrderedDict([("port{}_{}".format(port_to.id, name), increment)
+                for name, increment in events.items()]))
@@ -7,14 +7,17 @@ AXI frontend for LiteDRAM
 Converts AXI ports to Native ports.
 
 Features:
-- Write/Read arbitration.
+- Write/Read arbitration (or separate Write/Read native ports).
 - Write/Read data buffers (configurable depth).
 - Burst support (FIXED/INCR/WRAP).
+- Bursts issued as native burst commands (cmd.len) when the port supports them.
 - ID support (configurable width).
 
+- Out of order Reads across IDs (with an OUT_OF_ORDER crossbar read port).
+
 Limitations:
 - Response always okay.
-- No reordering.
+- No reordering of the Writes.
 """
 
 from migen import *
@@ -29,12 +32,100 @@ from litex.soc.interconnect.axi import *
 class LiteDRAMAXIPort(AXIInterface):
     pass
 
+# LiteDRAMAXIBurst2Cmd -----------------------------------------------------------------------------
+
+class LiteDRAMAXIBurst2Cmd(Module):
+    """LiteDRAM AXI Burst to Commands
+
+    Split the AXI bursts in commands of up to max_len consecutive data words (source.len + 1 words
+    starting at source.addr), one command per cycle:
+    - INCR/WRAP bursts of full width beats are split on the max_len words aligned boundaries (the
+    commands then never cross a row of the controller) and on the WRAP boundary.
+    - FIXED bursts and narrow (size < data width) bursts generate one command per beat.
+    source.first/last mark the first/last commands of the bursts.
+    """
+    def __init__(self, ax_burst, data_width, max_len=1):
+        assert max_len == 2**log2_int(max_len, False)
+        self.source = source = stream.Endpoint([
+            ("addr", len(ax_burst.addr)),
+            ("len",  bits_for(max_len - 1)),
+            ("id",   len(ax_burst.id))])
+
+        # # #
+
+        ashift = log2_int(data_width//8)
+
+        first     = Signal(reset=1)
+        addr      = Signal(len(ax_burst.addr)) # Address of the next command of the burst
+        count     = Signal(9)                  # Beats already issued
+        cur_addr  = Signal(len(ax_burst.addr))
+        remaining = Signal(9)
+        self.comb += [
+            cur_addr.eq(Mux(first, ax_burst.addr, addr)),
+            remaining.eq(ax_burst.len + 1 - count)
+        ]
+
+        # Command length ---------------------------------------------------------------------------
+        to_align    = Signal(9) # Words to the next max_len words boundary
+        to_wrap     = Signal(9) # Words to the WRAP boundary
+        wrap_mask   = Signal(len(ax_burst.addr))
+        chunk_align = Signal(9)
+        chunk_wrap  = Signal(9)
+        chunk       = Signal(9)
+        if max_len > 1:
+            self.comb += to_align.eq(max_len - cur_addr[ashift:ashift + log2_int(max_len)])
+        else:
+            self.comb += to_align.eq(1)
+        self.comb += [
+            wrap_mask.eq(((ax_burst.len + 1) << ax_burst.size) - 1),
+            to_wrap.eq(((wrap_mask - (cur_addr & wrap_mask)) >> ashift) + 1),
+            chunk_align.eq(Mux(to_align < remaining, to_align, remaining)),
+            chunk_wrap.eq(Mux((ax_burst.burst == BURST_WRAP) & (to_wrap < chunk_align),
+                to_wrap, chunk_align)),
+            If((ax_burst.size == ashift) &
+               ((ax_burst.burst == BURST_INCR) | (ax_burst.burst == BURST_WRAP)),
+                chunk.eq(chunk_wrap)
+            ).Else(
+                chunk.eq(1)
+            )
+        ]
+
+        # Commands ---------------------------------------------------------------------------------
+        self.comb += [
+            source.valid.eq(ax_burst.valid),
+            source.first.eq(first),
+            source.last.eq(chunk == remaining),
+            source.addr.eq(cur_addr),
+            source.len.eq(chunk - 1),
+            source.id.eq(ax_burst.id),
+            ax_burst.ready.eq(source.ready & source.last)
+        ]
+        self.sync += \
+            If(source.valid & source.ready,
+                If(source.last,
+                    first.eq(1),
+                    count.eq(0)
+                ).Else(
+                    first.eq(0),
+                    count.eq(count + chunk),
+                    If(ax_burst.burst == BURST_INCR,
+                        addr.eq(cur_addr + (chunk << ax_burst.size))
+                    ).Elif(ax_burst.burst == BURST_WRAP,
+                        addr.eq((cur_addr & ~wrap_mask) |
+                            ((cur_addr + (chunk << ax_burst.size)) & wrap_mask))
+                    ).Else(
+                        addr.eq(cur_addr)
+                    )
+                )
+            )
+
 # LiteDRAMAXI2NativeW ------------------------------------------------------------------------------
 
 class LiteDRAMAXI2NativeW(Module):
-    def __init__(self, axi, port, buffer_depth, base_address):
+    def __init__(self, axi, port, buffer_depth, base_address, max_len=1):
         assert axi.address_width >= log2_int(base_address)
         assert axi.data_width    == port.data_width
+        assert buffer_depth      >= max_len
         self.cmd_request = Signal()
         self.cmd_grant   = Signal()
 
@@ -42,18 +133,31 @@ class LiteDRAMAXI2NativeW(Module):
 
         ashift = log2_int(port.data_width//8)
 
-        # Burst to Beat ----------------------------------------------------------------------------
+        # Burst to Commands ------------------------------------------------------------------------
         aw_buffer = stream.Buffer(ax_description(axi.address_width, axi.id_width))
         self.submodules += aw_buffer
         self.comb += axi.aw.connect(aw_buffer.sink)
-        aw = stream.Endpoint(ax_description(axi.address_width, axi.id_width))
-        aw_burst2beat = AXIBurst2Beat(aw_buffer.source, aw)
-        self.submodules.aw_burst2beat = aw_burst2beat
+        aw_burst2cmd = LiteDRAMAXIBurst2Cmd(aw_buffer.source, axi.data_width, max_len)
+        self.submodules.aw_burst2cmd = aw_burst2cmd
+        aw = aw_burst2cmd.source
 
         # Write Buffer -----------------------------------------------------------------------------
         w_buffer = stream.SyncFIFO(w_description(axi.data_width, axi.id_width),
             buffer_depth, buffered=True)
         self.submodules.w_buffer = w_buffer
+        self.comb += axi.w.connect(w_buffer.sink)
+
+        # Write Buffer credits ---------------------------------------------------------------------
+        # Data of the buffer not yet attributed to a command: a command is only sent when all its
+        # data are buffered (the controller does not wait for the write data).
+        w_credits = Signal(max=buffer_depth + 1)
+        w_queue   = Signal()
+        w_claim   = Signal()
+        self.comb += [
+            w_queue.eq(w_buffer.sink.valid & w_buffer.sink.ready),
+            w_claim.eq(aw.valid & aw.ready)
+        ]
+        self.sync += w_credits.eq(w_credits + w_queue - Mux(w_claim, aw.len + 1, 0))
 
         # Write ID Buffer & Response ---------------------------------------------------------------
         id_buffer   = stream.SyncFIFO([("id", axi.id_width)], buffer_depth)
@@ -74,23 +178,18 @@ class LiteDRAMAXI2NativeW(Module):
         ]
 
         # Command ----------------------------------------------------------------------------------
-        # Accept and send command to the controller only if:
-        # - Address & Data request are *both* valid.
-        # - Data buffer is not full.
+        # Accept and send command to the controller only if its data are buffered.
         self.comb += [
-            self.cmd_request.eq(aw.valid & axi.w.valid & w_buffer.sink.ready),
+            self.cmd_request.eq(aw.valid & (w_credits >= (aw.len + 1))),
             If(self.cmd_request & self.cmd_grant,
                 port.cmd.valid.eq(1),
                 port.cmd.we.eq(1),
                 port.cmd.addr.eq((aw.addr - base_address) >> ashift),
-                aw.ready.eq(port.cmd.ready),
-                axi.w.connect(w_buffer.sink, omit={"valid", "ready"}),
-                If(port.cmd.ready,
-                    w_buffer.sink.valid.eq(1),
-                    axi.w.ready.eq(1)
-                )
+                aw.ready.eq(port.cmd.ready)
             )
         ]
+        if hasattr(port.cmd, "len"):
+            self.comb += If(self.cmd_grant, port.cmd.len.eq(aw.len))
 
         # Write Data -------------------------------------------------------------------------------
         self.comb += [
@@ -101,9 +200,10 @@ class LiteDRAMAXI2NativeW(Module):
 # LiteDRAMAXI2NativeR ------------------------------------------------------------------------------
 
 class LiteDRAMAXI2NativeR(Module):
-    def __init__(self, axi, port, buffer_depth, base_address):
+    def __init__(self, axi, port, buffer_depth, base_address, max_len=1):
         assert axi.address_width >= log2_int(base_address)
         assert axi.data_width    == port.data_width
+        assert buffer_depth      >= max_len
         self.cmd_request = Signal()
         self.cmd_grant   = Signal()
 
@@ -113,13 +213,13 @@ class LiteDRAMAXI2NativeR(Module):
 
         ashift = log2_int(port.data_width//8)
 
-        # Burst to Beat ----------------------------------------------------------------------------
+        # Burst to Commands ------------------------------------------------------------------------
         ar_buffer = stream.Buffer(ax_description(axi.address_width, axi.id_width))
         self.submodules += ar_buffer
         self.comb += axi.ar.connect(ar_buffer.sink)
-        ar = stream.Endpoint(ax_description(axi.address_width, axi.id_width))
-        ar_burst2beat = AXIBurst2Beat(ar_buffer.source, ar)
-        self.submodules.ar_burst2beat = ar_burst2beat
+        ar_burst2cmd = LiteDRAMAXIBurst2Cmd(ar_buffer.source, axi.data_width, max_len)
+        self.submodules.ar_burst2cmd = ar_burst2cmd
+        ar = ar_burst2cmd.source
 
         # Read buffer ------------------------------------------------------------------------------
         r_buffer = stream.SyncFIFO(r_description(axi.data_width, axi.id_width), buffer_depth, buffered=True)
@@ -135,26 +235,34 @@ class LiteDRAMAXI2NativeR(Module):
             r_buffer_queue.eq(port.cmd.valid & port.cmd.ready & ~port.cmd.we),
             r_buffer_dequeue.eq(r_buffer.source.valid & r_buffer.source.ready)
         ]
-        self.sync += [
-            If(r_buffer_queue,
-                If(~r_buffer_dequeue, r_buffer_level.eq(r_buffer_level + 1))
-            ).Elif(r_buffer_dequeue,
-                r_buffer_level.eq(r_buffer_level - 1)
-            )
-        ]
-        self.comb += can_read.eq(r_buffer_level != buffer_depth)
+        self.sync += r_buffer_level.eq(r_buffer_level +
+            Mux(r_buffer_queue, ar.len + 1, 0) - r_buffer_dequeue)
+        self.comb += can_read.eq((r_buffer_level + ar.len + 1) <= buffer_depth)
 
         # Read ID Buffer ---------------------------------------------------------------------------
-        id_buffer = stream.SyncFIFO([("id", axi.id_width)], buffer_depth)
+        # One entry per command, axi.r.last is set on the last data of the last command of a burst.
+        id_buffer = stream.SyncFIFO([("id", axi.id_width), ("len", len(ar.len))], buffer_depth)
         self.submodules += id_buffer
+        r_beat      = Signal(len(ar.len))
+        r_beat_last = Signal()
         self.comb += [
             id_buffer.sink.valid.eq(ar.valid & ar.ready),
             id_buffer.sink.last.eq(ar.last),
             id_buffer.sink.id.eq(ar.id),
-            axi.r.last.eq(id_buffer.source.last),
+            id_buffer.sink.len.eq(ar.len),
+            r_beat_last.eq(r_beat == id_buffer.source.len),
+            axi.r.last.eq(id_buffer.source.last & r_beat_last),
             axi.r.id.eq(id_buffer.source.id),
-            id_buffer.source.ready.eq(axi.r.valid & axi.r.ready)
+            id_buffer.source.ready.eq(axi.r.valid & axi.r.ready & r_beat_last)
         ]
+        self.sync += \
+            If(axi.r.valid & axi.r.ready,
+                If(r_beat_last,
+                    r_beat.eq(0)
+                ).Else(
+                    r_beat.eq(r_beat + 1)
+                )
+            )
 
         # Command ----------------------------------------------------------------------------------
         self.comb += [
@@ -166,6 +274,8 @@ class LiteDRAMAXI2NativeR(Module):
                 port.cmd.addr.eq((ar.addr - base_address) >> ashift)
             )
         ]
+        if hasattr(port.cmd, "len"):
+            self.comb += If(self.cmd_grant, port.cmd.len.eq(ar.len))
 
         # Read data --------------------------------------------------------------------------------
         self.comb += [
@@ -174,23 +284,200 @@ class LiteDRAMAXI2NativeR(Module):
             axi.r.resp.eq(RESP_OKAY)
         ]
 
+# LiteDRAMAXI2NativeROutOfOrder --------------------------------------------------------------------
+
+class LiteDRAMAXI2NativeROutOfOrder(Module):
+    """LiteDRAM AXI to Native Reads (Out Of Order)
+
+    Read path for a port returning its read data out of order (crossbar port with
+    reorder="OUT_OF_ORDER"): the read commands are tagged with the slots of the port (allocated in
+    the commands order, modulo the reorder depth) and the read data stored in their slot. The
+    commands are queued per AXI ID (up to nids IDs tracked simultaneously, the commands of an
+    untracked ID wait for a free tracker) and the data of the IDs are returned as soon as available,
+    in order for each ID; the granted ID is only switched at the end of a burst or when its next
+    data is not available.
+    """
+    def __init__(self, axi, port, base_address, nids=4):
+        assert axi.address_width >= log2_int(base_address)
+        assert axi.data_width    == port.data_width
+        assert hasattr(port.rdata, "id")
+        self.cmd_request = Signal()
+        self.cmd_grant   = Signal()
+
+        # # #
+
+        ashift = log2_int(port.data_width//8)
+        depth  = getattr(port, "reorder_depth", 2**len(port.rdata.id))
+
+        # Burst to Commands ------------------------------------------------------------------------
+        ar_buffer = stream.Buffer(ax_description(axi.address_width, axi.id_width))
+        self.submodules += ar_buffer
+        self.comb += axi.ar.connect(ar_buffer.sink)
+        ar_burst2cmd = LiteDRAMAXIBurst2Cmd(ar_buffer.source, axi.data_width)
+        self.submodules.ar_burst2cmd = ar_burst2cmd
+        ar = ar_burst2cmd.source
+
+        # Slots ------------------------------------------------------------------------------------
+        # Slots are busy from the command to the return of its data on axi.r.
+        tag   = Signal(max=depth)
+        busy  = Signal(depth)
+        valid = Signal(depth)
+        lasts = Signal(depth)
+        mem    = Memory(axi.data_width, depth)
+        wrport = mem.get_port(write_capable=True)
+        rdport = mem.get_port(async_read=True)
+        self.specials += mem, wrport, rdport
+
+        read = Signal()
+        self.comb += read.eq(port.cmd.valid & port.cmd.ready & ~port.cmd.we)
+        self.sync += \
+            If(read,
+                If(tag == depth - 1,
+                    tag.eq(0)
+                ).Else(
+                    tag.eq(tag + 1)
+                )
+            )
+        self.comb += [
+            port.rdata.ready.eq(1),
+            wrport.adr.eq(port.rdata.id),
+            wrport.dat_w.eq(port.rdata.data),
+            wrport.we.eq(port.rdata.valid)
+        ]
+
+        # ID trackers ------------------------------------------------------------------------------
+        # Slots of the commands of each tracked ID, in the commands order.
+        trackers_ids   = [Signal(axi.id_width) for n in range(nids)]
+        trackers_fifos = [stream.SyncFIFO([("slot", len(tag))], depth) for n in range(nids)]
+        self.submodules += trackers_fifos
+        match  = Signal(nids)
+        free   = Signal(nids)
+        select = Signal(nids)
+        for n in range(nids):
+            self.comb += [
+                match[n].eq(trackers_fifos[n].source.valid & (trackers_ids[n] == ar.id)),
+                free[n].eq(~trackers_fifos[n].source.valid)
+            ]
+        # Select the tracker of the ID, or the first free one.
+        self.comb += [
+            If(match != 0,
+                select.eq(match)
+            ).Else(
+                [If(free[n], select.eq(1 << n)) for n in reversed(range(nids))]
+            )
+        ]
+        for n in range(nids):
+            self.comb += [
+                trackers_fifos[n].sink.valid.eq(read & select[n]),
+                trackers_fifos[n].sink.slot.eq(tag)
+            ]
+            self.sync += If(read & select[n], trackers_ids[n].eq(ar.id))
+
+        # Command ----------------------------------------------------------------------------------
+        can_read = Signal()
+        self.comb += [
+            can_read.eq(~Array(busy[i] for i in range(depth))[tag] & (select != 0)),
+            self.cmd_request.eq(ar.valid & can_read),
+            If(self.cmd_grant,
+                port.cmd.valid.eq(ar.valid & can_read),
+                ar.ready.eq(port.cmd.ready & can_read),
+                port.cmd.we.eq(0),
+                port.cmd.addr.eq((ar.addr - base_address) >> ashift)
+            )
+        ]
+
+        # Read data --------------------------------------------------------------------------------
+        arbiter = RoundRobin(nids, SP_CE)
+        self.submodules += arbiter
+        slots   = Array(fifo.source.slot for fifo in trackers_fifos)
+        slot    = Signal(max=depth)
+        deliver = Signal()
+        for n, fifo in enumerate(trackers_fifos):
+            self.comb += [
+                arbiter.request[n].eq(fifo.source.valid &
+                    Array(valid[i] for i in range(depth))[fifo.source.slot]),
+                fifo.source.ready.eq(deliver & (arbiter.grant == n))
+            ]
+        self.comb += [
+            arbiter.ce.eq(~axi.r.valid | (axi.r.ready & axi.r.last)),
+            slot.eq(slots[arbiter.grant]),
+            rdport.adr.eq(slot),
+            axi.r.valid.eq(Array(arbiter.request[n] for n in range(nids))[arbiter.grant]),
+            axi.r.data.eq(rdport.dat_r),
+            axi.r.id.eq(Array(trackers_ids)[arbiter.grant]),
+            axi.r.last.eq(Array(lasts[i] for i in range(depth))[slot]),
+            axi.r.resp.eq(RESP_OKAY),
+            deliver.eq(axi.r.valid & axi.r.ready)
+        ]
+        for i in range(depth):
+            self.sync += [
+                If(read & (tag == i),
+                    busy[i].eq(1),
+                    lasts[i].eq(ar.last)
+                ).Elif(deliver & (slot == i),
+                    busy[i].eq(0)
+                ),
+                If(port.rdata.valid & (port.rdata.id == i),
+                    valid[i].eq(1)
+                ).Elif(deliver & (slot == i),
+                    valid[i].eq(0)
+                )
+            ]
+
 # LiteDRAMAXI2Native -------------------------------------------------------------------------------
 
 class LiteDRAMAXI2Native(Module):
-    def __init__(self, axi, port, w_buffer_depth=16, r_buffer_depth=16, base_address=0x00000000):
+    """LiteDRAM AXI to Native
+
+    The AXI bursts are issued as native commands of up to max_len data words (default: the maximum
+    length of the port's cmd.len, or 1 when the port has no cmd.len). max_len must be a power of 2
+    not larger than the cmd_max_len of the controller or its rows.
+
+    The Write and Read paths share port (and are arbitrated on its cmd), or when read_port is
+    provided, the Writes are issued on port (a "write" port) and the Reads on read_port (a "read"
+    port) without arbitration, letting the crossbar overlap them. Each path stays in order, so the
+    AXI ordering rules per ID are kept; a Write response is only returned once the Write has been
+    issued to the controller, so a Read issued after it still returns the written data.
+
+    When the read port returns its data out of order (rdata.id, crossbar port with
+    reorder="OUT_OF_ORDER"), the Reads of the different IDs are returned out of order (up to nids
+    IDs tracked simultaneously), see LiteDRAMAXI2NativeROutOfOrder.
+    """
+    def __init__(self, axi, port, w_buffer_depth=16, r_buffer_depth=16, base_address=0x00000000,
+        max_len=None, read_port=None, nids=4):
+        write_port = port
+        read_port  = port if read_port is None else read_port
+        def get_max_len(port):
+            if max_len is not None:
+                return max_len
+            # cmd_max_len is a power of 2: the len field gives it exactly.
+            return 2**len(port.cmd.len) if hasattr(port.cmd, "len") else 1
 
         # # #
 
         # Write path -------------------------------------------------------------------------------
-        self.submodules.write = LiteDRAMAXI2NativeW(axi, port, w_buffer_depth, base_address)
+        self.submodules.write = LiteDRAMAXI2NativeW(axi, write_port, w_buffer_depth, base_address,
+            get_max_len(write_port))
 
         # Read path --------------------------------------------------------------------------------
-        self.submodules.read = LiteDRAMAXI2NativeR(axi, port, r_buffer_depth, base_address)
+        if hasattr(read_port.rdata, "id"):
+            self.submodules.read = LiteDRAMAXI2NativeROutOfOrder(axi, read_port, base_address, nids)
+        else:
+            self.submodules.read = LiteDRAMAXI2NativeR(axi, read_port, r_buffer_depth, base_address,
+                get_max_len(read_port))
 
         # Write / Read arbitration -----------------------------------------------------------------
-        arbiter = RoundRobin(2, SP_CE)
-        self.submodules += arbiter
-        self.comb += arbiter.ce.eq(~port.cmd.valid | port.cmd.ready)
-        for i, master in enumerate([self.write, self.read]):
-            self.comb += arbiter.request[i].eq(master.cmd_request)
-            self.comb += master.cmd_grant.eq(arbiter.grant == i)
+        if read_port is write_port:
+            arbiter = RoundRobin(2, SP_CE)
+            self.submodules += arbiter
+            self.comb += arbiter.ce.eq(~port.cmd.valid | port.cmd.ready)
+            for i, master in enumerate([self.write, self.read]):
+                self.comb += arbiter.request[i].eq(master.cmd_request)
+                self.comb += master.cmd_grant.eq(arbiter.grant == i)
+        else:
+            assert write_port.mode in ["write", "both"]
+            assert read_port.mode  in ["read",  "both"]
+            self.comb += [
+                self.write.cmd_grant.eq(1),
+                self.read.cmd_grant.eq(1)
+            ]
@@ -0,0 +1,406 @@
+# This file is Copyright (c) 2026 agent <agent@local>
+# License: BSD
+
+"""Write-back cache frontend for LiteDRAM"""
+
+from functools import reduce
+from operator import or_, and_
+from collections import OrderedDict
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
+
+from litedram.common import *
+from litedram.core.perfcounters import EventCounters
+
+# LiteDRAMNativeCache ------------------------------------------------------------------------------
+
+class LiteDRAMNativeCache(Module, AutoCSR):
+    """LiteDRAM port Write-back Cache
+
+    Set-associative write-back cache between a user port (port_from) and a controller port
+    (port_to), for the small random accesses of CPUs:
+    - size bytes organized in nways ways of lines of line_words data words (default: the maximum
+    burst of port_to, cmd.len, or 1 data word, the DRAM burst, when port_to has no cmd.len).
+    - Lines are refilled/written back with a single burst command when port_to has cmd.len.
+    - Write allocate: a write miss refills the line and is then written in the cache.
+    - Replacement of the least recently used way (replacement="LRU") or of the tree pseudo least
+    recently used way (replacement="PLRU"), the invalid ways are always replaced first.
+
+    Writing the flush CSR (or setting port_from.flush) writes back all the dirty lines and writing
+    the invalidate CSR invalidates all the lines (dirty lines are discarded); busy is set until the
+    operation is done (for a flush, until all the data written back are transferred to port_to).
+    With with_perf_counters, the hits, misses, evictions (valid lines replaced) and writebacks
+    (dirty lines written back) are counted in CSRs.
+    """
+    def __init__(self, port_from, port_to, size=4096, nways=2, line_words=None,
+        replacement="LRU", with_perf_counters=False):
+        assert port_from.clock_domain  == port_to.clock_domain
+        assert port_from.data_width    == port_to.data_width
+        assert port_from.address_width == port_to.address_width
+        assert port_from.mode == "both" and port_to.mode == "both"
+        assert not hasattr(port_from.cmd, "len")
+        assert not hasattr(port_to.rdata, "id") # Read data must be returned in order.
+        assert replacement in ["LRU", "PLRU"]
+        burst = hasattr(port_to.cmd, "len")
+        if line_words is None:
+            # cmd_max_len is a power of 2: the len field gives it exactly.
+            line_words = 2**len(port_to.cmd.len) if burst else 1
+        burst = burst and line_words > 1
+        if burst:
+            assert line_words <= 2**len(port_to.cmd.len)
+        nsets = size//(nways*line_words*port_from.data_width//8)
+        assert nways      == 2**log2_int(nways, False)
+        assert line_words == 2**log2_int(line_words, False)
+        assert nsets      == 2**log2_int(nsets, False) and nsets >= 2
+
+        self.flush      = CSR(name="flush")
+        self.invalidate = CSR(name="invalidate")
+        self.busy       = CSRStatus(name="busy")
+
+        # # #
+
+        data_width = port_from.data_width
+        obits      = log2_int(line_words)
+        ibits      = log2_int(nsets)
+        tbits      = port_from.address_width - obits - ibits
+        assert tbits > 0
+
+        def address(offset, index, tag):
+            return Cat(*[s for s, n in [(offset, obits), (index, ibits), (tag, tbits)] if n])
+
+        def data_address(offset, index, way):
+            wbits = log2_int(nways)
+            return Cat(*[s for s, n in [(offset, obits), (index, ibits), (way, wbits)] if n])
+
+        cmd_offset = port_from.cmd.addr[:obits]
+        cmd_index  = port_from.cmd.addr[obits:obits + ibits]
+        cmd_tag    = port_from.cmd.addr[obits + ibits:]
+
+        addr   = Signal(port_from.address_width) # Address of the current access
+        index  = Signal(ibits)                   # Set of the current access/writeback/refill
+        way    = Signal(max=max(nways, 2))       # Way of the current access/writeback/refill
+        wb_tag = Signal(tbits)                   # Tag of the line to write back
+        count  = Signal(max=line_words + 1)      # Words read/commands issued
+        rcount = Signal(max=line_words + 1)      # Words refilled
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+
+        # Tags -------------------------------------------------------------------------------------
+        # One memory per way: Cat(tag, valid, dirty) of the lines.
+        tag_index = Signal(ibits)
+        tag_we    = Signal()     # Write the tag of the way
+        tag_clear = Signal()     # Write the tags of all the ways
+        tag_dat_w = Signal(tbits + 2)
+        tags      = [Signal(tbits) for w in range(nways)]
+        valids    = Signal(nways)
+        dirtys    = Signal(nways)
+        self.comb += tag_index.eq(Mux(fsm.ongoing("IDLE"), cmd_index, index))
+        for w in range(nways):
+            tag_mem = Memory(tbits + 2, nsets)
+            tag_rdport = tag_mem.get_port(async_read=True)
+            tag_wrport = tag_mem.get_port(write_capable=True)
+            self.specials += tag_mem, tag_rdport, tag_wrport
+            self.comb += [
+                tag_rdport.adr.eq(tag_index),
+                tags[w].eq(tag_rdport.dat_r[:tbits]),
+                valids[w].eq(tag_rdport.dat_r[tbits]),
+                dirtys[w].eq(tag_rdport.dat_r[tbits + 1]),
+                tag_wrport.adr.eq(index),
+                tag_wrport.dat_w.eq(tag_dat_w),
+                tag_wrport.we.eq((tag_we & (way == w)) | tag_clear)
+            ]
+
+        # Lookup -----------------------------------------------------------------------------------
+        hits    = Signal(nways)
+        hit     = Signal()
+        hit_way = Signal(max=max(nways, 2))
+        self.comb += [
+            [hits[w].eq(valids[w] & (tags[w] == cmd_tag)) for w in range(nways)],
+            hit.eq(hits != 0),
+            [If(hits[w], hit_way.eq(w)) for w in range(nways)]
+        ]
+
+        # Replacement ------------------------------------------------------------------------------
+        repl_victim = Signal(max=max(nways, 2))
+        repl_update = Signal()
+        if nways > 1:
+            if replacement == "LRU":
+                # Age of each way (0: most recently used, nways - 1: least recently used).
+                abits = log2_int(nways)
+                rbits = nways*abits
+                init  = sum(w << (w*abits) for w in range(nways))
+            else:
+                # Tree of nways - 1 bits (0: left/1: right subtree to replace).
+                rbits = nways - 1
+                init  = 0
+            repl_mem    = Memory(rbits, nsets, init=[init]*nsets)
+            repl_rdport = repl_mem.get_port(async_read=True)
+            repl_wrport = repl_mem.get_port(write_capable=True)
+            self.specials += repl_mem, repl_rdport, repl_wrport
+            state = repl_rdport.dat_r
+            self.comb += [
+                repl_rdport.adr.eq(tag_index),
+                repl_wrport.adr.eq(cmd_index),
+                repl_wrport.we.eq(repl_update)
+            ]
+            if replacement == "LRU":
+                ages    = [state[w*abits:(w + 1)*abits] for w in range(nways)]
+                hit_age = Signal(abits)
+                self.comb += hit_age.eq(Array(ages)[hit_way])
+                for w in range(nways):
+                    age = Signal(abits)
+                    self.comb += [
+                        If(hit_way == w,
+                            age.eq(0)
+                        ).Elif(ages[w] < hit_age,
+                            age.eq(ages[w] + 1)
+                        ).Else(
+                            age.eq(ages[w])
+                        ),
+                        repl_wrport.dat_w[w*abits:(w + 1)*abits].eq(age),
+                        If(ages[w] == (nways - 1), repl_victim.eq(w))
+                    ]
+            else:
+                def leaves(node):
+                    if node >= nways - 1:
+                        return [node - (nways - 1)]
+                    return leaves(2*node + 1) + leaves(2*node + 2)
+                for node in range(nways - 1):
+                    left  = reduce(or_, [hit_way == w for w in leaves(2*node + 1)])
+                    right = reduce(or_, [hit_way == w for w in leaves(2*node + 2)])
+                    self.comb += [
+                        repl_wrport.dat_w[node].eq(state[node]),
+                        If(left,
+                            repl_wrport.dat_w[node].eq(1)
+                        ).Elif(right,
+                            repl_wrport.dat_w[node].eq(0)
+                        )
+                    ]
+                for w in range(nways):
+                    path = []
+                    node = w + nways - 1
+                    while node:
+                        parent = (node - 1)//2
+                        path.append(state[parent] == int(node == 2*parent + 2))
+                        node = parent
+                    self.comb += If(reduce(and_, path), repl_victim.eq(w))
+
+        # Invalid ways are replaced first.
+        victim = Signal(max=max(nways, 2))
+        self.comb += [
+            victim.eq(repl_victim),
+            [If(~valids[w], victim.eq(w)) for w in reversed(range(nways))]
+        ]
+
+        # Data -------------------------------------------------------------------------------------
+        data_mem    = Memory(data_width, nsets*nways*line_words)
+        data_rdport = data_mem.get_port(has_re=True)
+        data_wrport = data_mem.get_port(write_capable=True, we_granularity=8)
+        self.specials += data_mem, data_rdport, data_wrport
+
+        # Writeback data (read from the data memory before the write commands, the controller does
+        # not wait for the write data).
+        wb_fifo = stream.SyncFIFO(wdata_description(data_width), line_words)
+        self.submodules += wb_fifo
+        wb_read = Signal()
+        wb_push = Signal()
+        self.sync += wb_push.eq(wb_read)
+        self.comb += [
+            wb_fifo.sink.valid.eq(wb_push),
+            wb_fifo.sink.data.eq(data_rdport.dat_r),
+            wb_fifo.sink.we.eq(2**(data_width//8) - 1),
+            wb_fifo.source.connect(port_to.wdata)
+        ]
+
+        # Refill data.
+        refill = Signal()
+        self.comb += [
+            port_to.rdata.ready.eq(refill),
+            If(refill & port_to.rdata.valid,
+                data_wrport.adr.eq(data_address(rcount[:obits], index, way)),
+                data_wrport.dat_w.eq(port_to.rdata.data),
+                data_wrport.we.eq(2**(data_width//8) - 1)
+            )
+        ]
+        self.sync += If(refill & port_to.rdata.valid, rcount.eq(rcount + 1))
+
+        # Control ----------------------------------------------------------------------------------
+        flush_req      = Signal()
+        flush_start    = Signal()
+        invalidate_req = Signal()
+        flushing       = Signal()
+        refilled       = Signal()
+        miss           = Signal()
+        writeback      = Signal()
+        self.sync += [
+            If(flush_start,
+                flush_req.eq(0)
+            ).Elif(self.flush.re | port_from.flush,
+                flush_req.eq(1)
+            ),
+            If(self.invalidate.re,
+                invalidate_req.eq(1)
+            ).Elif(fsm.ongoing("INVALIDATE"),
+                invalidate_req.eq(0)
+            ),
+            If(port_from.cmd.valid & port_from.cmd.ready,
+                refilled.eq(0)
+            ).Elif(fsm.ongoing("REFILL-DATA") & (rcount == line_words),
+                refilled.eq(1)
+            )
+        ]
+        self.comb += self.busy.status.eq(flush_req | invalidate_req | flushing |
+            fsm.ongoing("INVALIDATE") | wb_fifo.source.valid)
+
+        fsm.act("IDLE",
+            If(invalidate_req,
+                NextValue(index, 0),
+                NextState("INVALIDATE")
+            ).Elif(flush_req,
+                flush_start.eq(1),
+                NextValue(flushing, 1),
+                NextValue(index, 0),
+                NextValue(way, 0),
+                NextState("FLUSH")
+            ).Elif(port_from.cmd.valid,
+                NextValue(addr, port_from.cmd.addr),
+                NextValue(index, cmd_index),
+                If(hit,
+                    port_from.cmd.ready.eq(1),
+                    repl_update.eq(1),
+                    NextValue(way, hit_way),
+                    If(port_from.cmd.we,
+                        NextState("WRITE")
+                    ).Else(
+                        data_rdport.re.eq(1),
+                        data_rdport.adr.eq(data_address(cmd_offset, cmd_index, hit_way)),
+                        NextState("READ")
+                    )
+                ).Else(
+                    miss.eq(1),
+                    NextValue(way, victim),
+                    NextValue(wb_tag, Array(tags)[victim]),
+                    If(Array(valids)[victim] & Array(dirtys)[victim],
+                        NextValue(count, 0),
+                        NextState("WRITEBACK-READ")
+                    ).Else(
+                        NextValue(count, 0),
+                        NextState("REFILL-CMD")
+                    )
+                )
+            )
+        )
+        fsm.act("READ",
+            port_from.rdata.valid.eq(1),
+            port_from.rdata.data.eq(data_rdport.dat_r),
+            If(port_from.rdata.ready,
+                NextState("IDLE")
+            )
+        )
+        fsm.act("WRITE",
+            port_from.wdata.ready.eq(1),
+            If(port_from.wdata.valid,
+                data_wrport.adr.eq(data_address(addr[:obits], index, way)),
+                data_wrport.dat_w.eq(port_from.wdata.data),
+                data_wrport.we.eq(port_from.wdata.we),
+                tag_we.eq(1),
+                tag_dat_w.eq(Cat(Array(tags)[way], 1, 1)),
+                NextState("IDLE")
+            )
+        )
+        fsm.act("WRITEBACK-READ",
+            # Wait for the data of the previous writeback to be written.
+            wb_read.eq((count != 0) | ~wb_fifo.source.valid),
+            data_rdport.re.eq(wb_read),
+            data_rdport.adr.eq(data_address(count[:obits], index, way)),
+            If(wb_read,
+                NextValue(count, count + 1),
+                If(count == (line_words - 1),
+                    NextValue(count, 0),
+                    NextState("WRITEBACK-CMD")
+                )
+            )
+        )
+        fsm.act("WRITEBACK-CMD",
+            port_to.cmd.valid.eq(1),
+            port_to.cmd.we.eq(1),
+            port_to.cmd.addr.eq(address(count[:obits], index, wb_tag)),
+            If(port_to.cmd.ready,
+                NextValue(count, count + 1),
+                If(burst | (count == (line_words - 1)),
+                    writeback.eq(1),
+                    NextValue(count, 0),
+                    If(flushing,
+                        tag_we.eq(1),
+                        tag_dat_w.eq(Cat(wb_tag, 1, 0)),
+                        NextState("FLUSH-NEXT")
+                    ).Else(
+                        NextState("REFILL-CMD")
+                    )
+                )
+            )
+        )
+        fsm.act("REFILL-CMD",
+            refill.eq(1),
+            port_to.cmd.valid.eq(1),
+            port_to.cmd.we.eq(0),
+            port_to.cmd.addr.eq(address(count[:obits], index, addr[obits + ibits:])),
+            If(port_to.cmd.ready,
+                NextValue(count, count + 1),
+                If(burst | (count == (line_words - 1)),
+                    NextValue(count, 0),
+                    NextState("REFILL-DATA")
+                )
+            )
+        )
+        fsm.act("REFILL-DATA",
+            refill.eq(1),
+            If(rcount == line_words,
+                tag_we.eq(1),
+                tag_dat_w.eq(Cat(addr[obits + ibits:], 1, 0)),
+                NextValue(rcount, 0),
+                NextState("IDLE")
+            )
+        )
+        fsm.act("FLUSH",
+            If(Array(valids)[way] & Array(dirtys)[way],
+                NextValue(wb_tag, Array(tags)[way]),
+                NextState("WRITEBACK-READ")
+            ).Else(
+                NextState("FLUSH-NEXT")
+            )
+        )
+        fsm.act("FLUSH-NEXT",
+            NextValue(way, way + 1),
+            NextState("FLUSH"),
+            If(way == (nways - 1),
+                NextValue(way, 0),
+                NextValue(index, index + 1),
+                If(index == (nsets - 1),
+                    NextValue(flushing, 0),
+                    NextState("IDLE")
+                )
+            )
+        )
+        fsm.act("INVALIDATE",
+            tag_clear.eq(1),
+            tag_dat_w.eq(0),
+            NextValue(index, index + 1),
+            If(index == (nsets - 1),
+                NextState("IDLE")
+            )
+        )
+        if burst:
+            self.comb += port_to.cmd.len.eq(line_words - 1)
+
+        # Performance counters ---------------------------------------------------------------------
+        if with_perf_counters:
+            self.submodules.perf_counters = EventCounters(OrderedDict([
+                ("hits",       port_from.cmd.valid & port_from.cmd.ready & ~refilled),
+                ("misses",     miss),
+                ("evictions",  miss & Array(valids)[victim]),
+                ("writebacks", writeback),
+            ]))
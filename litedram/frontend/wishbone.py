@@ -79,3 +79,189 @@ class LiteDRAMWishbone2Native(Module):
                NextState("CMD")
             )
         )
+
+# LiteDRAMWishbone2NativeBurst ---------------------------------------------------------------------
+
+class LiteDRAMWishbone2NativeBurst(Module):
+    """LiteDRAM Wishbone to Native (Bursts)
+
+    Wishbone to Native with registered feedback bursts (CTI/BTE): the reads of an incrementing burst
+    (cti=0b010, linear or wrapped bte) are prefetched and up to depth reads are kept in flight on
+    the native port, the data are acked as soon as returned (one per cycle once the burst is
+    streaming). The prefetched data not consumed by the burst (ended with cti=0b111 or aborted) are
+    discarded. Writes are handled as in LiteDRAMWishbone2Native.
+
+    On ports with bursts (cmd.len), the linear bursts are prefetched with burst commands of
+    cmd_max_len port words at cmd_max_len aligned addresses (the other reads are issued as single
+    commands).
+    """
+    def __init__(self, wishbone, port, base_address=0x00000000, depth=8):
+        wishbone_data_width = len(wishbone.dat_w)
+        port_data_width     = 2**int(log2(len(port.wdata.data))) # Round to lowest power 2
+        assert wishbone_data_width >= port_data_width
+
+        # # #
+
+        adr_offset = base_address >> log2_int(port.data_width//8)
+
+        # Write Datapath ---------------------------------------------------------------------------
+        wdata_converter = stream.StrideConverter(
+            [("data", wishbone_data_width), ("we", wishbone_data_width//8)],
+            [("data", port_data_width),     ("we", port_data_width//8)],
+        )
+        self.submodules += wdata_converter
+        self.comb += [
+            wdata_converter.sink.valid.eq(wishbone.cyc & wishbone.stb & wishbone.we),
+            wdata_converter.sink.data.eq(wishbone.dat_w),
+            wdata_converter.sink.we.eq(wishbone.sel),
+            wdata_converter.source.connect(port.wdata)
+        ]
+
+        # Read Datapath ----------------------------------------------------------------------------
+        # Data of the reads in flight, in the reads order (the port does not apply back pressure on
+        # rdata, the reads in flight are limited to the depth of the buffer).
+        rdata_converter = stream.StrideConverter(
+            [("data", port_data_width)],
+            [("data", wishbone_data_width)],
+        )
+        rdata_buffer = stream.SyncFIFO([("data", wishbone_data_width)], depth)
+        self.submodules += rdata_converter, rdata_buffer
+        self.comb += [
+            port.rdata.connect(rdata_converter.sink),
+            rdata_converter.source.connect(rdata_buffer.sink),
+            wishbone.dat_r.eq(rdata_buffer.source.data),
+        ]
+
+        # Burst addresses --------------------------------------------------------------------------
+        def next_address(adr, bte):
+            # Next address of a linear (bte=0b00) or 4/8/16 beats wrapped (bte=0b01/10/11) burst.
+            nxt = Signal(len(adr))
+            self.comb += Case(bte, {
+                0b00: nxt.eq(adr + 1),
+                0b01: nxt.eq(Cat((adr + 1)[:2], adr[2:])),
+                0b10: nxt.eq(Cat((adr + 1)[:3], adr[3:])),
+                0b11: nxt.eq(Cat((adr + 1)[:4], adr[4:])),
+            })
+            return nxt
+
+        cmd_adr  = Signal(len(wishbone.adr)) # Address of the next read to issue
+        ack_adr  = Signal(len(wishbone.adr)) # Address of the next read to ack
+        bte      = Signal(2)
+        cmd_next = next_address(cmd_adr, bte)
+        ack_next = next_address(ack_adr, bte)
+
+        # Reads in flight --------------------------------------------------------------------------
+        ratio    = wishbone_data_width//port_data_width
+        count    = Signal(max=max(ratio, 2))
+        first    = Signal()
+        pending  = Signal(max=depth + 1) # Reads issued and not yet acked/discarded
+        issue    = Signal()
+        issued   = Signal()
+        consumed = Signal()
+        self.comb += [
+            issued.eq(issue & port.cmd.ready & (count == (ratio - 1))),
+            consumed.eq(rdata_buffer.source.valid & rdata_buffer.source.ready)
+        ]
+
+        # Control ----------------------------------------------------------------------------------
+        burst = Signal()
+        abort = Signal()
+        self.comb += [
+            burst.eq(wishbone.cti == 0b010),
+            abort.eq(~wishbone.cyc | (wishbone.stb & (wishbone.we | (wishbone.adr != ack_adr))))
+        ]
+
+        # Native bursts: a burst command reads chunk wishbone words (cmd_max_len port words).
+        max_len = 2**len(port.cmd.len) if hasattr(port.cmd, "len") else 1
+        chunk   = max_len//ratio
+        chunked = Signal() # Read issued as a burst command
+        if (max_len > 1) and (chunk >= 1) and (chunk <= depth):
+            cmd_port_adr = Signal(len(port.cmd.addr))
+            self.comb += [
+                cmd_port_adr.eq(cmd_adr*ratio - adr_offset),
+                chunked.eq(burst & (bte == 0b00) & (count == 0) &
+                    (cmd_port_adr[:log2_int(max_len)] == 0))
+            ]
+        self.sync += If(issue & port.cmd.ready & chunked,
+            pending.eq(pending + chunk - consumed)
+        ).Else(
+            pending.eq(pending + issued - consumed)
+        )
+
+        self.submodules.fsm = fsm = FSM(reset_state="CMD")
+        fsm.act("CMD",
+            If(wishbone.cyc & wishbone.stb,
+                If(wishbone.we,
+                    port.cmd.valid.eq(1),
+                    port.cmd.we.eq(1),
+                    port.cmd.addr.eq(wishbone.adr*ratio + count - adr_offset),
+                    If(port.cmd.ready,
+                        NextValue(count, count + 1),
+                        If(count == (ratio - 1),
+                            NextValue(count, 0),
+                            NextState("WAIT-WRITE")
+                        )
+                    )
+                ).Else(
+                    NextValue(cmd_adr, wishbone.adr),
+                    NextValue(ack_adr, wishbone.adr),
+                    NextValue(bte, wishbone.bte),
+                    NextValue(first, 1),
+                    NextState("READ")
+                )
+            )
+        )
+        fsm.act("WAIT-WRITE",
+            If(wdata_converter.sink.ready,
+                wishbone.ack.eq(1),
+                NextState("CMD")
+            )
+        )
+        fsm.act("READ",
+            # Issue the read of the current address, then prefetch the next ones during the burst.
+            issue.eq((first | (burst & ~abort)) &
+                Mux(chunked, pending <= (depth - chunk), pending < depth)),
+            If(issue & port.cmd.ready & chunked,
+                NextValue(cmd_adr, cmd_adr + chunk),
+                NextValue(first, 0)
+            ).Elif(issue & port.cmd.ready,
+                NextValue(count, count + 1),
+                If(count == (ratio - 1),
+                    NextValue(count, 0),
+                    NextValue(cmd_adr, cmd_next),
+                    NextValue(first, 0)
+                )
+            ),
+            If(abort,
+                NextState("DISCARD")
+            ).Elif(wishbone.stb,
+                wishbone.ack.eq(rdata_buffer.source.valid),
+                rdata_buffer.source.ready.eq(wishbone.ack),
+                If(wishbone.ack,
+                    NextValue(ack_adr, ack_next),
+                    If(~burst,
+                        NextState("DISCARD")
+                    )
+                )
+            )
+        )
+        fsm.act("DISCARD",
+            # Complete the current read (when partially issued) and discard the prefetched data.
+            issue.eq(count != 0),
+            If(issue & port.cmd.ready,
+                NextValue(count, count + 1),
+                If(count == (ratio - 1),
+                    NextValue(count, 0)
+                )
+            ),
+            rdata_buffer.source.ready.eq(1),
+            If((pending == 0) & (count == 0),
+                NextState("CMD")
+            )
+        )
+        self.comb += If(issue,
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(0),
+            port.cmd.addr.eq(cmd_adr*ratio + count - adr_offset),
+            If(chunked, port.cmd.len.eq(max_len - 1)) if max_len > 1 else []
+        )
@@ -461,12 +461,20 @@ class LiteDRAMCore(SoCSDRAM):
                 ]
             # AXI ----------------------------------------------------------------------------------
             elif port["type"] == "axi":
-                user_port = self.sdram.crossbar.get_port()
+                # Separate write/read native ports: overlap the writes and reads in the crossbar.
+                # Out of order reads: reads of the different IDs returned out of order.
+                if port.get("separate_ports", False) or port.get("out_of_order_reads", False):
+                    user_port      = self.sdram.crossbar.get_port("write")
+                    user_read_port = self.sdram.crossbar.get_port("read",
+                        reorder = "OUT_OF_ORDER" if port.get("out_of_order_reads", False) else None)
+                else:
+                    user_port      = self.sdram.crossbar.get_port()
+                    user_read_port = None
                 axi_port  = LiteDRAMAXIPort(
                     user_port.data_width,
                     user_port.address_width + log2_int(user_port.data_width//8),
                     port["id_width"])
-                axi2native = LiteDRAMAXI2Native(axi_port, user_port)
+                axi2native = LiteDRAMAXI2Native(axi_port, user_port, read_port=user_read_port)
                 self.submodules += axi2native
                 platform.add_extension(get_axi_user_port_ios(name,
                         axi_port.address_width,
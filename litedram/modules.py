@@ -20,17 +20,17 @@ from litedram.common import Settings, GeomSettings, TimingSettings
 
 # Timings ------------------------------------------------------------------------------------------
 
-_technology_timings = ["tREFI", "tWTR", "tCCD", "tRRD", "tZQCS"]
+_technology_timings = ["tREFI", "tWTR", "tCCD", "tRRD", "tZQCS", "tCCD_L", "tRRD_L", "tRTRS"]
 
 class _TechnologyTimings(Settings):
-    def __init__(self, tREFI, tWTR, tCCD, tRRD, tZQCS=None):
+    def __init__(self, tREFI, tWTR, tCCD, tRRD, tZQCS=None, tCCD_L=None, tRRD_L=None, tRTRS=None):
         self.set_attributes(locals())
 
 
-_speedgrade_timings = ["tRP", "tRCD", "tWR", "tRFC", "tFAW", "tRAS"]
+_speedgrade_timings = ["tRP", "tRCD", "tWR", "tRFC", "tFAW", "tRAS", "tRFCpb"]
 
 class _SpeedgradeTimings(Settings):
-    def __init__(self, tRP, tRCD, tWR, tRFC, tFAW, tRAS):
+    def __init__(self, tRP, tRCD, tWR, tRFC, tFAW, tRAS, tRFCpb=None):
         self.set_attributes(locals())
 
 # SDRAMModule --------------------------------------------------------------------------------------
@@ -51,27 +51,32 @@ class SDRAMModule:
         self.rate          = rate
         self.speedgrade    = speedgrade
         self.geom_settings = GeomSettings(
-            bankbits = log2_int(self.nbanks),
-            rowbits  = log2_int(self.nrows),
-            colbits  = log2_int(self.ncols),
+            bankbits  = log2_int(self.nbanks),
+            rowbits   = log2_int(self.nrows),
+            colbits   = log2_int(self.ncols),
+            groupbits = log2_int(getattr(self, "ngroups", 1)),
         )
         assert not (self.memtype != "DDR4" and fine_refresh_mode != None)
         assert fine_refresh_mode in [None, "1x", "2x", "4x"]
         if (fine_refresh_mode is None) and (self.memtype == "DDR4"):
             fine_refresh_mode = "1x"
         self.timing_settings = TimingSettings(
-            tRP   = self.ns_to_cycles(self.get("tRP")),
-            tRCD  = self.ns_to_cycles(self.get("tRCD")),
-            tWR   = self.ns_to_cycles(self.get("tWR")),
-            tREFI = self.ns_to_cycles(self.get("tREFI", fine_refresh_mode), False),
-            tRFC  = self.ck_ns_to_cycles(*self.get("tRFC", fine_refresh_mode)),
-            tWTR  = self.ck_ns_to_cycles(*self.get("tWTR")),
-            tFAW  = None if self.get("tFAW") is None else self.ck_ns_to_cycles(*self.get("tFAW")),
-            tCCD  = None if self.get("tCCD") is None else self.ck_ns_to_cycles(*self.get("tCCD")),
-            tRRD  = None if self.get("tRRD") is None else self.ck_ns_to_cycles(*self.get("tRRD")),
-            tRC   = None  if self.get("tRAS") is None else self.ns_to_cycles(self.get("tRP") + self.get("tRAS")),
-            tRAS  = None if self.get("tRAS") is None else self.ns_to_cycles(self.get("tRAS")),
-            tZQCS = None if self.get("tZQCS") is None else self.ck_ns_to_cycles(*self.get("tZQCS"))
+            tRP    = self.ns_to_cycles(self.get("tRP")),
+            tRCD   = self.ns_to_cycles(self.get("tRCD")),
+            tWR    = self.ns_to_cycles(self.get("tWR")),
+            tREFI  = self.ns_to_cycles(self.get("tREFI", fine_refresh_mode), False),
+            tRFC   = self.ck_ns_to_cycles(*self.get("tRFC", fine_refresh_mode)),
+            tWTR   = self.ck_ns_to_cycles(*self.get("tWTR")),
+            tFAW   = None if self.get("tFAW") is None else self.ck_ns_to_cycles(*self.get("tFAW")),
+            tCCD   = None if self.get("tCCD") is None else self.ck_ns_to_cycles(*self.get("tCCD")),
+            tRRD   = None if self.get("tRRD") is None else self.ck_ns_to_cycles(*self.get("tRRD")),
+            tRC    = None  if self.get("tRAS") is None else self.ns_to_cycles(self.get("tRP") + self.get("tRAS")),
+            tRAS   = None if self.get("tRAS") is None else self.ns_to_cycles(self.get("tRAS")),
+            tZQCS  = None if self.get("tZQCS") is None else self.ck_ns_to_cycles(*self.get("tZQCS")),
+            tRFCpb = None if self.get("tRFCpb") is None else self.ck_ns_to_cycles(*self.get("tRFCpb")),
+            tCCD_L = None if self.get("tCCD_L") is None else self.ck_ns_to_cycles(*self.get("tCCD_L")),
+            tRRD_L = None if self.get("tRRD_L") is None else self.ck_ns_to_cycles(*self.get("tRRD_L")),
+            tRTRS  = None if self.get("tRTRS") is None else self.ck_ns_to_cycles(*self.get("tRTRS"))
         )
         self.timing_settings.fine_refresh_mode = fine_refresh_mode
 
@@ -463,7 +468,7 @@ class MT18KSF1G72HZ(SDRAMModule):
     nrows  = 65536
     ncols  = 1024
     # timings
-    technology_timings = _TechnologyTimings(tREFI=64e6/8192, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 10), tZQCS=(64, 80))
+    technology_timings = _TechnologyTimings(tREFI=64e6/8192, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 10), tZQCS=(64, 80), tRTRS=(2, None))
     speedgrade_timings = {
         "1066": _SpeedgradeTimings(tRP=15,     tRCD=15,     tWR=15,             tRFC=(86,  None), tFAW=(None, 50), tRAS=None),
         "1333": _SpeedgradeTimings(tRP=15,     tRCD=15,     tWR=15,             tRFC=(107, None), tFAW=(None, 45), tRAS=None),
@@ -503,6 +508,22 @@ class MT16KTF1G64HZ(SDRAMModule):
     speedgrade_timings["default"] = speedgrade_timings["1600"]
 
 
+# LPDDR3 (Chips) -----------------------------------------------------------------------------------
+
+class EDF8132A1MC(SDRAMModule):
+    memtype = "LPDDR3"
+    # geometry
+    nbanks = 8
+    nrows  = 32768
+    ncols  = 1024
+    # timings (tRP: all banks precharge, tRFCpb: per-bank refresh)
+    technology_timings = _TechnologyTimings(tREFI=32e6/8192, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(2, 10))
+    speedgrade_timings = {
+        "1600": _SpeedgradeTimings(tRP=21, tRCD=18, tWR=15, tRFC=(None, 210), tFAW=(8, 50), tRAS=42, tRFCpb=(None, 90)),
+    }
+    speedgrade_timings["default"] = speedgrade_timings["1600"]
+
+
 # DDR4 (Chips) -------------------------------------------------------------------------------------
 class EDY4016A(SDRAMModule):
     memtype = "DDR4"
@@ -515,7 +536,7 @@ class EDY4016A(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 260), "2x": (None, 160),   "4x": (None, 110)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_L=(5, 5), tRRD_L=(4, 6.4))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(28, 30), tRAS=32),
     }
@@ -533,7 +554,7 @@ class MT40A1G8(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 6.4), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 6.4), tZQCS=(128, 80), tCCD_L=(5, 5), tRRD_L=(4, 6.4))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
         "2666": _SpeedgradeTimings(tRP=13.50, tRCD=13.50, tWR=15, tRFC=trfc, tFAW=(20, 21), tRAS=32),
@@ -552,7 +573,7 @@ class MT40A256M16(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192, "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 260), "2x": (None, 160), "4x": (None, 110)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_L=(5, 5), tRRD_L=(4, 6.4))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(28, 35), tRAS=32),
     }
@@ -570,7 +591,7 @@ class MT40A512M8(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_L=(5, 5), tRRD_L=(4, 4.9))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
         "2666": _SpeedgradeTimings(tRP=13.50, tRCD=13.50, tWR=15, tRFC=trfc, tFAW=(20, 21), tRAS=32),
@@ -589,7 +610,7 @@ class MT40A512M16(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_L=(5, 5), tRRD_L=(4, 6.4))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
     }
@@ -607,7 +628,7 @@ class KVR21SE15S84(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_L=(5, 5.355), tRRD_L=(4, 5.3))
     speedgrade_timings = {
         "2133": _SpeedgradeTimings(tRP=13.5, tRCD=13.5, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=33),
     }
@@ -624,7 +645,7 @@ class MTA4ATF51264HZ(SDRAMModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_L=(5, 5.355), tRRD_L=(4, 6.4))
     speedgrade_timings = {
         "2133": _SpeedgradeTimings(tRP=13.5, tRCD=13.5, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=33),
     }
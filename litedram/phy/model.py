@@ -2,13 +2,11 @@
 # This file is Copyright (c) 2020 Antmicro <www.antmicro.com>
 # License: BSD
 
-# SDRAM simulation PHY at DFI level tested with SDR/DDR/DDR2/LPDDR/DDR3
-# TODO:
-# - add multirank support.
+# SDRAM simulation PHY at DFI level tested with SDR/DDR/DDR2/LPDDR/DDR3/LPDDR3
 
 from migen import *
 
-from litedram.common import burst_lengths
+from litedram.common import burst_lengths, get_turnarounds
 from litedram.phy.dfi import *
 from litedram.modules import _speedgrade_timings, _technology_timings
 
@@ -90,6 +88,7 @@ class DFIPhaseModel(Module):
 
         self.bank         = phase.bank
         self.address      = phase.address
+        self.cs_n         = phase.cs_n
 
         self.wrdata       = phase.wrdata
         self.wrdata_mask  = phase.wrdata_mask
@@ -104,12 +103,14 @@ class DFIPhaseModel(Module):
 
         # # #
 
+        cs = Signal()
+        self.comb += cs.eq(phase.cs_n != (2**len(phase.cs_n) - 1))
         self.comb += [
-            If(~phase.cs_n & ~phase.ras_n & phase.cas_n,
+            If(cs & ~phase.ras_n & phase.cas_n,
                 self.activate.eq(phase.we_n),
                 self.precharge.eq(~phase.we_n)
             ),
-            If(~phase.cs_n & phase.ras_n & ~phase.cas_n,
+            If(cs & phase.ras_n & ~phase.cas_n,
                 self.write.eq(~phase.we_n),
                 self.read.eq(phase.we_n)
             )
@@ -184,6 +185,9 @@ class DFITimingsChecker(Module):
         for rule in self.RULES:
             self.add_rule(*rule)
 
+    def violation(self, cond, fmt, *args):
+        return If(cond, Display(fmt, *args), self.violations.eq(self.violations + 1))
+
     # Convert ns to ps
     def ns_to_ps(self, val):
         return int(val * 1000)
@@ -197,7 +201,7 @@ class DFITimingsChecker(Module):
         return self.ns_to_ps(max(c, t))
 
     def prepare_timings(self, timings, refresh_mode, memtype):
-        CK_NS = ["tRFC", "tWTR", "tFAW", "tCCD", "tRRD", "tZQCS"]
+        CK_NS = ["tRFC", "tWTR", "tFAW", "tCCD", "tRRD", "tZQCS", "tRFCpb", "tCCD_L", "tRRD_L", "tRTRS"]
         REF   = ["tREFI", "tRFC"]
         self.timings = timings
         new_timings  = {}
@@ -227,36 +231,81 @@ class DFITimingsChecker(Module):
 
         self.timings = new_timings
 
-    def __init__(self, dfi, nbanks, nphases, timings, refresh_mode, memtype, verbose=False):
+    def __init__(self, dfi, nbanks, nphases, timings, refresh_mode, memtype, per_bank_refresh=False,
+        ngroups=1, cl=None, cwl=None, nranks=1, verbose=False):
         ref_limit = {"1x": 9, "2x": 17, "4x": 36}
         self.prepare_timings(timings, refresh_mode, memtype)
+        if per_bank_refresh:
+            # Per-bank refresh: REF commands only target their bank, tRFC is replaced by tRFCpb and
+            # the banks are refreshed in turn every tREFI/nbanks.
+            self.timings["tRFC"]  = self.timings["tRFCpb"]
+            self.timings["tREFI"] = self.timings["tREFI"]//nbanks
+        if cl is not None:
+            # Read to Write and Write to Read spacings (commands to any bank), Read to Read and Write
+            # to Write spacings (commands to different ranks)
+            trtrs = None
+            if self.timings["tRTRS"]:
+                trtrs = -(-self.timings["tRTRS"]//self.timings["tCK"])
+            rtw, wtr, rtw_rank, wtr_rank, ccd_rank = get_turnarounds(memtype, cl, cwl, trtrs=trtrs)
+            twtr = self.ck_ns_to_ps(timings["tWTR"], timings["tCK"])
+            self.timings["tRTW"]   = rtw*self.timings["tCK"]
+            self.timings["tWTR_R"] = wtr*self.timings["tCK"] + twtr
+            self.timings["tRTW_RANK"] = rtw_rank*self.timings["tCK"]
+            self.timings["tWTR_RANK"] = wtr_rank*self.timings["tCK"]
+            self.timings["tCCD_RANK"] = ccd_rank*self.timings["tCK"]
         self.add_cmds()
         self.add_rules()
 
+        # Number of cycles with timing violations
+        self.violations = Signal(32)
+
         cnt = Signal(64)
         self.sync += cnt.eq(cnt+nphases)
 
         phases = [getattr(dfi, "p"+str(n)) for n in range(nphases)]
 
-        last_cmd_ps = [[Signal.like(cnt) for _ in range(len(self.cmds))] for _ in range(nbanks)]
-        last_cmd = [Signal(4) for i in range(nbanks)]
+        # Note: the banks of the ranks are monitored as nranks*nbanks banks.
+        last_cmd_ps = [[Signal.like(cnt) for _ in range(len(self.cmds))] for _ in range(nranks*nbanks)]
+        last_cmd = [Signal(4) for i in range(nranks*nbanks)]
 
-        act_ps = Array([Signal().like(cnt) for i in range(4)])
-        act_curr = Signal(max=4)
+        act_ps = [Array([Signal().like(cnt) for i in range(4)]) for r in range(nranks)]
+        act_curr = [Signal(max=4) for r in range(nranks)]
+        act_count = [Signal(max=5) for r in range(nranks)] # Valid ACT timestamps (up to 4)
 
         ref_issued = Signal(nphases)
 
+        # Last RD/WR timestamps and ranks (any bank)
+        rd_ps   = Signal().like(cnt)
+        wr_ps   = Signal().like(cnt)
+        rd_rank = Signal(max=max(nranks, 2))
+        wr_rank = Signal(max=max(nranks, 2))
+        rd_seen = Signal()
+        wr_seen = Signal()
+
+        # Bank groups: last CAS/ACT timestamps of each bank group (of each rank)
+        group_cas_ps   = Array([Signal().like(cnt) for i in range(nranks*ngroups)])
+        group_act_ps   = Array([Signal().like(cnt) for i in range(nranks*ngroups)])
+        group_cas_seen = Array([Signal() for i in range(nranks*ngroups)])
+        group_act_seen = Array([Signal() for i in range(nranks*ngroups)])
+
         for np, phase in enumerate(phases):
             ps = Signal().like(cnt)
             self.comb += ps.eq((cnt+np)*self.timings["tCK"])
             state = Signal(4)
-            self.comb += state.eq(Cat(phase.we_n, phase.cas_n, phase.ras_n, phase.cs_n))
+            cs_n  = Signal()
+            rank  = Signal(max=max(nranks, 2))
+            self.comb += cs_n.eq(phase.cs_n == (2**nranks - 1))
+            self.comb += state.eq(Cat(phase.we_n, phase.cas_n, phase.ras_n, cs_n))
+            self.comb += [If(~phase.cs_n[r], rank.eq(r)) for r in reversed(range(nranks))]
             all_banks = Signal()
 
-            self.comb += all_banks.eq(
-                (self.cmds["REF"].enc == state) |
-                ((self.cmds["PRE"].enc == state) & phase.address[10])
-            )
+            if per_bank_refresh:
+                self.comb += all_banks.eq((self.cmds["PRE"].enc == state) & phase.address[10])
+            else:
+                self.comb += all_banks.eq(
+                    (self.cmds["REF"].enc == state) |
+                    ((self.cmds["PRE"].enc == state) & phase.address[10])
+                )
 
             # tREFI
             self.comb += ref_issued[np].eq(self.cmds["REF"].enc == state)
@@ -268,38 +317,95 @@ class DFITimingsChecker(Module):
                         Display("[%016dps] P%0d "+cmd.name, ps, np)).Else(
                         Display("[%016dps] P%0d B%0d "+cmd.name, ps, np, phase.bank)))
 
+            # tRTW & tWTR (data bus turnarounds)
+            if cl is not None:
+                is_rd = Signal()
+                is_wr = Signal()
+                self.comb += [
+                    is_rd.eq(state == self.cmds["RD"].enc),
+                    is_wr.eq(state == self.cmds["WR"].enc),
+                ]
+                self.sync += [
+                    self.violation(is_wr & rd_seen & (rd_rank == rank) & (ps < (rd_ps + self.timings["tRTW"])),
+                        "[%016dps] tRTW violation", ps),
+                    self.violation(is_rd & wr_seen & (wr_rank == rank) & (ps < (wr_ps + self.timings["tWTR_R"])),
+                        "[%016dps] tWTR violation (any bank)", ps),
+                    If(is_rd, rd_ps.eq(ps), rd_rank.eq(rank), rd_seen.eq(1)),
+                    If(is_wr, wr_ps.eq(ps), wr_rank.eq(rank), wr_seen.eq(1)),
+                ]
+                if nranks > 1:
+                    last_rd = rd_seen & (rd_rank != rank)
+                    last_wr = wr_seen & (wr_rank != rank)
+                    self.sync += [
+                        self.violation(is_wr & last_rd & (ps < (rd_ps + self.timings["tRTW_RANK"])),
+                            "[%016dps] tRTW violation (rank switch)", ps),
+                        self.violation(is_rd & last_wr & (ps < (wr_ps + self.timings["tWTR_RANK"])),
+                            "[%016dps] tWTR violation (rank switch)", ps),
+                        self.violation(is_rd & last_rd & (ps < (rd_ps + self.timings["tCCD_RANK"])),
+                            "[%016dps] tRTRS violation (read)", ps),
+                        self.violation(is_wr & last_wr & (ps < (wr_ps + self.timings["tCCD_RANK"])),
+                            "[%016dps] tRTRS violation (write)", ps),
+                    ]
+
+            # tCCD_L & tRRD_L (commands to the same bank group)
+            if ngroups > 1:
+                group  = Signal(max=nranks*ngroups)
+                is_cas = Signal()
+                is_act = Signal()
+                self.comb += [
+                    group.eq(phase.bank[log2_int(nbanks//ngroups):] if nranks == 1 else
+                        Cat(phase.bank[log2_int(nbanks//ngroups):], rank)),
+                    is_cas.eq((state == self.cmds["RD"].enc) | (state == self.cmds["WR"].enc)),
+                    is_act.eq(state == self.cmds["ACT"].enc),
+                ]
+                for name, is_cmd, group_ps, group_seen in [
+                    ("tCCD_L", is_cas, group_cas_ps, group_cas_seen),
+                    ("tRRD_L", is_act, group_act_ps, group_act_seen)]:
+                    if self.timings[name]:
+                        self.sync += self.violation(is_cmd & group_seen[group] &
+                                                    (ps < (group_ps[group] + self.timings[name])),
+                            "[%016dps] {} violation on bank group %0d".format(name), ps, group)
+                    self.sync += If(is_cmd, group_ps[group].eq(ps), group_seen[group].eq(1))
+
             # Bank command monitoring
-            for i in range(nbanks):
+            for i in range(nranks*nbanks):
+                r, b = divmod(i, nbanks)
                 for _, curr in self.cmds.items():
                     cmd_recv = Signal()
-                    self.comb += cmd_recv.eq(((phase.bank == i) | all_banks) & (state == curr.enc))
+                    self.comb += cmd_recv.eq(~phase.cs_n[r] & ((phase.bank == b) | all_banks) &
+                        (state == curr.enc))
 
                     # Checking rules from self.rules
                     for _, prev in self.cmds.items():
                         for rule in self.rules:
                             if rule.prev == prev.name and rule.curr == curr.name:
-                                self.sync += If(cmd_recv & (last_cmd[i] == prev.enc) &
+                                self.sync += self.violation(cmd_recv & (last_cmd[i] == prev.enc) &
                                                 (ps < (last_cmd_ps[i][prev.idx] + rule.delay)),
-                                    Display("[%016dps] {} violation on bank %0d".format(rule.name), ps, i))
+                                    "[%016dps] {} violation on bank {}".format(rule.name, i), ps)
 
                     # Save command timestamp in an array
                     self.sync += If(cmd_recv, last_cmd_ps[i][curr.idx].eq(ps), last_cmd[i].eq(state))
 
                     # tRRD & tFAW
                     if curr.name == "ACT":
-                        act_next = Signal().like(act_curr)
-                        self.comb += act_next.eq(act_curr+1)
+                        act_next = Signal().like(act_curr[r])
+                        self.comb += act_next.eq(act_curr[r]+1)
 
                         # act_curr points to newest ACT timestamp
-                        self.sync += If(cmd_recv & (ps < (act_ps[act_curr] + self.timings["tRRD"])),
-                            Display("[%016dps] tRRD violation on bank %0d", ps, i))
+                        act_newest = act_ps[r][act_curr[r]]
+                        self.sync += self.violation(cmd_recv & (act_count[r] != 0) &
+                                                    (ps < (act_newest + self.timings["tRRD"])),
+                            "[%016dps] tRRD violation on bank {}".format(i), ps)
 
                         # act_next points to the oldest ACT timestamp
-                        self.sync += If(cmd_recv & (ps < (act_ps[act_next] + self.timings["tFAW"])),
-                            Display("[%016dps] tFAW violation on bank %0d", ps, i))
+                        act_oldest = act_ps[r][act_next]
+                        self.sync += self.violation(cmd_recv & (act_count[r] == 4) &
+                                                    (ps < (act_oldest + self.timings["tFAW"])),
+                            "[%016dps] tFAW violation on bank {}".format(i), ps)
 
                         # Save ACT timestamp in a circular buffer
-                        self.sync += If(cmd_recv, act_ps[act_next].eq(ps), act_curr.eq(act_next))
+                        self.sync += If(cmd_recv, act_ps[r][act_next].eq(ps), act_curr[r].eq(act_next),
+                            If(act_count[r] != 4, act_count[r].eq(act_count[r] + 1)))
 
         # tREFI
         ref_ps = Signal().like(cnt)
@@ -316,8 +422,8 @@ class DFITimingsChecker(Module):
         # Update timestamp and difference
         self.sync += If(ref_issued != 0, ref_ps.eq(ps), ref_ps_diff.eq(ref_ps_diff - curr_diff))
 
-        self.sync += If((ref_ps_mod == 0) & (ref_ps_diff > 0),
-            Display("[%016dps] tREFI violation (64ms period): %0d", ps, ref_ps_diff))
+        self.sync += self.violation((ref_ps_mod == 0) & (ref_ps_diff > 0),
+            "[%016dps] tREFI violation (64ms period): %0d", ps, ref_ps_diff)
 
         # Report any refresh periods longer than tREFI
         if verbose:
@@ -326,7 +432,8 @@ class DFITimingsChecker(Module):
                 If(~ref_done, Display("[%016dps] Late refresh", ps)))
 
             self.sync += If((curr_diff > 0) & ref_done & (ref_issued == 0),
-                Display("[%016dps] tREFI violation", ps), ref_done.eq(0))
+                Display("[%016dps] tREFI violation", ps), self.violations.eq(self.violations + 1),
+                ref_done.eq(0))
 
         # There is a maximum delay between refreshes on >=DDR
         if memtype != "SDR":
@@ -334,7 +441,8 @@ class DFITimingsChecker(Module):
             ref_done = Signal()
             self.sync += If(ref_issued != 0, ref_done.eq(1))
             self.sync += If((ref_issued == 0) & ref_done & (ref_ps > (ps + ref_limit[refresh_mode] * self.timings['tREFI'])),
-                Display("[%016dps] tREFI violation (too many postponed refreshes)", ps), ref_done.eq(0))
+                Display("[%016dps] tREFI violation (too many postponed refreshes)", ps),
+                self.violations.eq(self.violations + 1), ref_done.eq(0))
 
 # SDRAM PHY Model ----------------------------------------------------------------------------------
 
@@ -389,6 +497,19 @@ class SDRAMPHYModel(Module):
                 if start > len(init):
                     break
                 bank_init[bank] = init[start:end]
+        elif address_mapping == "ROW_COL_BANK":
+            for bank in range(nbanks):
+                bank_init[bank] = init[bank::nbanks]
+        elif address_mapping == "ROW_BANK_COL_XOR":
+            for row in range(nrows):
+                for bank in range(nbanks):
+                    start = (row*nbanks*model_column_size + bank*model_column_size)
+                    end   = min(start + model_column_size, len(init))
+                    if start > len(init):
+                        break
+                    bank_init[bank ^ (row % nbanks)].extend(init[start:end])
+        else:
+            raise NotImplementedError
 
         return bank_init
 
@@ -396,16 +517,18 @@ class SDRAMPHYModel(Module):
         we_granularity         = 8,
         init                   = [],
         address_mapping        = "ROW_BANK_COL",
+        per_bank_refresh       = False,
         verbosity              = SDRAM_VERBOSE_OFF):
 
         # Parameters -------------------------------------------------------------------------------
         burst_length = {
-            "SDR":   1,
-            "DDR":   2,
-            "LPDDR": 2,
-            "DDR2":  2,
-            "DDR3":  2,
-            "DDR4":  2,
+            "SDR":    1,
+            "DDR":    2,
+            "LPDDR":  2,
+            "DDR2":   2,
+            "DDR3":   2,
+            "DDR4":   2,
+            "LPDDR3": 2,
             }[settings.memtype]
 
         addressbits   = module.geom_settings.addressbits
@@ -428,6 +551,7 @@ class SDRAMPHYModel(Module):
         # # #
 
         nphases    = self.settings.nphases
+        nranks     = self.settings.nranks
         nbanks     = 2**bankbits
         nrows      = 2**rowbits
         ncols      = 2**colbits
@@ -445,22 +569,28 @@ class SDRAMPHYModel(Module):
                 timings[name] = self.module.get(name)
 
             timing_checker = DFITimingsChecker(
-                dfi          = self.dfi,
-                nbanks       = nbanks,
-                nphases      = nphases,
-                timings      = timings,
-                refresh_mode = self.module.timing_settings.fine_refresh_mode,
-                memtype      = settings.memtype,
-                verbose      = verbosity > SDRAM_VERBOSE_DBG)
-            self.submodules += timing_checker
+                dfi              = self.dfi,
+                nbanks           = nbanks,
+                nphases          = nphases,
+                timings          = timings,
+                refresh_mode     = self.module.timing_settings.fine_refresh_mode,
+                memtype          = settings.memtype,
+                per_bank_refresh = per_bank_refresh,
+                ngroups          = 2**module.geom_settings.groupbits,
+                cl               = settings.cl,
+                cwl              = settings.cwl,
+                nranks           = nranks,
+                verbose          = verbosity > SDRAM_VERBOSE_DBG)
+            self.submodules.timing_checker = timing_checker
 
         # Bank init data ---------------------------------------------------------------------------
-        bank_init  = [[] for i in range(nbanks)]
+        # Note: the rank is addressed as the MSBs of the bank address.
+        bank_init  = [[] for i in range(nranks*nbanks)]
 
         if init:
             bank_init = self.__prepare_bank_init_data(
                 init            = init,
-                nbanks          = nbanks,
+                nbanks          = nranks*nbanks,
                 nrows           = nrows,
                 ncols           = ncols,
                 data_width      = data_width,
@@ -475,18 +605,19 @@ class SDRAMPHYModel(Module):
             burst_length   = burst_length,
             nphases        = nphases,
             we_granularity = we_granularity,
-            init           = bank_init[i]) for i in range(nbanks)]
+            init           = bank_init[i]) for i in range(nranks*nbanks)]
         self.submodules += banks
 
         # Connect DFI phases to Banks (CMDs, Write datapath) ---------------------------------------
-        for nb, bank in enumerate(banks):
+        for n, bank in enumerate(banks):
+            nr, nb = divmod(n, nbanks)
             # Bank activate
             activates = Signal(len(phases))
             cases     = {}
             for np, phase in enumerate(phases):
                 self.comb += activates[np].eq(phase.activate)
                 cases[2**np] = [
-                    bank.activate.eq(phase.bank == nb),
+                    bank.activate.eq(~phase.cs_n[nr] & (phase.bank == nb)),
                     bank.activate_row.eq(phase.address)
                 ]
             self.comb += Case(activates, cases)
@@ -497,7 +628,7 @@ class SDRAMPHYModel(Module):
             for np, phase in enumerate(phases):
                 self.comb += precharges[np].eq(phase.precharge)
                 cases[2**np] = [
-                    bank.precharge.eq((phase.bank == nb) | phase.address[10])
+                    bank.precharge.eq(~phase.cs_n[nr] & ((phase.bank == nb) | phase.address[10]))
                 ]
             self.comb += Case(precharges, cases)
 
@@ -509,7 +640,7 @@ class SDRAMPHYModel(Module):
             for np, phase in enumerate(phases):
                 self.comb += writes[np].eq(phase.write)
                 cases[2**np] = [
-                    bank_write.eq(phase.bank == nb),
+                    bank_write.eq(~phase.cs_n[nr] & (phase.bank == nb)),
                     bank_write_col.eq(phase.address)
                 ]
             self.comb += Case(writes, cases)
@@ -540,7 +671,7 @@ class SDRAMPHYModel(Module):
             for np, phase in enumerate(phases):
                 self.comb += reads[np].eq(phase.read)
                 cases[2**np] = [
-                    bank.read.eq(phase.bank == nb),
+                    bank.read.eq(~phase.cs_n[nr] & (phase.bank == nb)),
                     bank.read_col.eq(phase.address)
             ]
             self.comb += Case(reads, cases)
@@ -4,9 +4,10 @@
 # License: BSD
 
 import csv
+import yaml
 import logging
 import argparse
-from operator import and_
+from operator import and_, add
 from functools import reduce
 from itertools import zip_longest
 
@@ -21,6 +22,8 @@ from litex.soc.integration.builder import *
 
 from litex.tools.litex_sim import SimSoC
 
+from litedram.core.controller import ControllerSettings
+from litedram.core.perfcounters import LatencyHistogram
 from litedram.frontend.bist import _LiteDRAMBISTGenerator, _LiteDRAMBISTChecker
 from litedram.frontend.bist import _LiteDRAMPatternGenerator, _LiteDRAMPatternChecker
 
@@ -39,10 +42,14 @@ class LiteDRAMBenchmarkSoC(SimSoC):
         num_generators   = 1,
         num_checkers     = 1,
         access_pattern   = None,
+        controller_settings = None,
         **kwargs):
         assert mode in ["bist", "pattern"]
         assert not (mode == "pattern" and access_pattern is None)
 
+        # Controller settings (used in register_sdram) ---------------------------------------------
+        self._controller_settings = controller_settings
+
         # SimSoC -----------------------------------------------------------------------------------
         SimSoC.__init__(self,
             with_sdram       = True,
@@ -54,15 +61,20 @@ class LiteDRAMBenchmarkSoC(SimSoC):
         # BIST/Pattern Generator / Checker ---------------------------------------------------------
         if mode == "pattern":
             make_generator = lambda: _LiteDRAMPatternGenerator(self.sdram.crossbar.get_port(), init=access_pattern)
-            make_checker   = lambda: _LiteDRAMPatternChecker(self.sdram.crossbar.get_port(),   init=access_pattern)
+            make_checker   = lambda port: _LiteDRAMPatternChecker(port, init=access_pattern)
         if mode == "bist":
             make_generator = lambda: _LiteDRAMBISTGenerator(self.sdram.crossbar.get_port())
-            make_checker   = lambda: _LiteDRAMBISTChecker(self.sdram.crossbar.get_port())
+            make_checker   = lambda port: _LiteDRAMBISTChecker(port)
 
-        generators = [make_generator() for _ in range(num_generators)]
-        checkers   = [make_checker()   for _ in range(num_checkers)]
+        generators    = [make_generator() for _ in range(num_generators)]
+        checker_ports = [self.sdram.crossbar.get_port() for _ in range(num_checkers)]
+        checkers      = [make_checker(port) for port in checker_ports]
         self.submodules += generators + checkers
 
+        # Read latency histograms of the checkers --------------------------------------------------
+        histograms = [LatencyHistogram(port) for port in checker_ports]
+        self.submodules += histograms
+
         if mode == "pattern":
             def bist_config(module):
                 return []
@@ -178,11 +190,33 @@ class LiteDRAMBenchmarkSoC(SimSoC):
         checker_errors  = max_signal((c.errors for c in checkers))
         checker_ticks   = max_signal((c.ticks  for c in checkers))
 
+        def min_signal(signals):
+            signals = iter(signals)
+            out     = next(signals)
+            for curr in signals:
+                prev = out
+                out = Signal(max(len(prev), len(curr)))
+                self.comb += If(prev < curr, out.eq(prev)).Else(out.eq(curr))
+            return out
+
+        latency_min   = min_signal((h.latency_min for h in histograms))
+        latency_max   = max_signal((h.latency_max for h in histograms))
+        latency_sum   = Signal(32)
+        latency_count = Signal(32)
+        self.comb += [
+            latency_sum.eq(reduce(add, (h.latency_sum for h in histograms))),
+            latency_count.eq(reduce(add, (h.latency_count for h in histograms))),
+        ]
+
         self.sync += [
             If(display,
                 Display("BIST-GENERATOR ticks:  %08d", generator_ticks),
                 Display("BIST-CHECKER errors:   %08d", checker_errors),
                 Display("BIST-CHECKER ticks:    %08d", checker_ticks),
+                Display("BIST-CHECKER latency-min:   %08d", latency_min),
+                Display("BIST-CHECKER latency-max:   %08d", latency_max),
+                Display("BIST-CHECKER latency-sum:   %08d", latency_sum),
+                Display("BIST-CHECKER latency-count: %08d", latency_count),
             )
         ]
 
@@ -192,6 +226,11 @@ class LiteDRAMBenchmarkSoC(SimSoC):
         self.comb += end_timer.wait.eq(finish)
         self.sync += If(end_timer.done, Finish())
 
+    def register_sdram(self, phy, geom_settings, timing_settings, **kwargs):
+        if self._controller_settings is not None:
+            kwargs["controller_settings"] = self._controller_settings
+        SimSoC.register_sdram(self, phy, geom_settings, timing_settings, **kwargs)
+
 # Build --------------------------------------------------------------------------------------------
 
 def load_access_pattern(filename):
@@ -200,6 +239,14 @@ def load_access_pattern(filename):
         access_pattern = [(int(addr, 0), int(data, 0)) for addr, data in reader]
     return access_pattern
 
+def get_controller_settings(settings):
+    # Settings are given as key=value pairs, values are parsed as YAML scalars (int, bool, str...)
+    kwargs = {}
+    for setting in settings:
+        key, value = setting.split("=", 1)
+        kwargs[key] = yaml.safe_load(value)
+    return ControllerSettings(**kwargs)
+
 def main():
     parser = argparse.ArgumentParser(description="LiteDRAM Benchmark SoC Simulation")
     builder_args(parser)
@@ -219,6 +266,7 @@ def main():
     parser.add_argument("--num-generators",   default=1,              help="Number of BIST generators")
     parser.add_argument("--num-checkers",     default=1,              help="Number of BIST checkers")
     parser.add_argument("--access-pattern",                           help="Load access pattern (address, data) from CSV (ignores --bist-*)")
+    parser.add_argument("--controller-settings", nargs="*", default=[], help="Controller settings as key=value pairs (ex: scheduling_policy=FR_FCFS)")
     parser.add_argument("--log-level",        default="info",         help="Set logging verbosity",
         choices=["critical", "error", "warning", "info", "debug"])
     args = parser.parse_args()
@@ -247,6 +295,9 @@ def main():
     if args.access_pattern:
         soc_kwargs["access_pattern"] = load_access_pattern(args.access_pattern)
 
+    if args.controller_settings:
+        soc_kwargs["controller_settings"] = get_controller_settings(args.controller_settings)
+
     # SoC ------------------------------------------------------------------------------------------
     soc = LiteDRAMBenchmarkSoC(mode="pattern" if args.access_pattern else "bist", **soc_kwargs)
 
@@ -73,6 +73,12 @@ class DRAMMemory:
             self._warn(address)
         return self.mem[address%self.depth]
 
+    def _cmd_len(self, dram_port):
+        # Number of data words of the command (cmd.len + 1 on ports with bursts)
+        if hasattr(dram_port.cmd, "len"):
+            return (yield dram_port.cmd.len) + 1
+        return 1
+
     @passive
     def read_handler(self, dram_port, rdata_valid_random=0):
         address = 0
@@ -89,9 +95,10 @@ class DRAMMemory:
                 yield
                 yield dram_port.rdata.valid.eq(0)
                 yield dram_port.rdata.data.eq(0)
-                pending = 0
+                address += 1
+                pending -= 1
             elif (yield dram_port.cmd.valid):
-                pending = not (yield dram_port.cmd.we)
+                pending = 0 if (yield dram_port.cmd.we) else (yield from self._cmd_len(dram_port))
                 address = (yield dram_port.cmd.addr)
                 if pending:
                     yield dram_port.cmd.ready.eq(1)
@@ -117,10 +124,11 @@ class DRAMMemory:
                 self._write(address, (yield dram_port.wdata.data), (yield dram_port.wdata.we))
                 yield dram_port.wdata.ready.eq(0)
                 yield
-                pending = 0
+                address += 1
+                pending -= 1
                 yield
             elif (yield dram_port.cmd.valid):
-                pending = (yield dram_port.cmd.we)
+                pending = (yield from self._cmd_len(dram_port)) if (yield dram_port.cmd.we) else 0
                 address = (yield dram_port.cmd.addr)
                 if pending:
                     yield dram_port.cmd.ready.eq(1)
@@ -7,13 +7,16 @@ def main():
     description = """
     Generate random access pattern for LiteDRAM Pattern Generator/Checker.
 
-    Each address in range [base, base+length) will be accessed only once, but in random order.
-    This ensures that no data will be overwritten.
+    Each address in range [base, base+length*stride) with the given stride will be accessed only
+    once, in random order (unless --sequential is used). This ensures that no data will be
+    overwritten.
     """
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("base",       help="Base address")
     parser.add_argument("length",     help="Number of (address, data) pairs")
     parser.add_argument("data_width", help="Width of data (used to determine max value)")
+    parser.add_argument("--stride",     default="1",         help="Address stride (default=1)")
+    parser.add_argument("--sequential", action="store_true", help="Access the addresses in sequential order")
     parser.add_argument("--seed",     help="Use given random seed (int)")
     args = parser.parse_args()
 
@@ -23,9 +26,11 @@ def main():
     base       = int(args.base, 0)
     length     = int(args.length, 0)
     data_width = int(args.data_width, 0)
+    stride     = int(args.stride, 0)
 
-    address = list(range(length))
-    random.shuffle(address)
+    address = [base + i*stride for i in range(length)]
+    if not args.sequential:
+        random.shuffle(address)
     data = [random.randrange(0, 2**data_width) for _ in range(length)]
 
     for a, d in zip(address, data):
@@ -87,7 +87,9 @@ class CustomAccess(Settings):
 
 class BenchmarkConfiguration(Settings):
     def __init__(self, name, sdram_module, sdram_data_width, bist_alternating,
-                 num_generators, num_checkers, access_pattern):
+                 num_generators, num_checkers, access_pattern, controller_settings=None):
+        if controller_settings is None:
+            controller_settings = {}
         self.set_attributes(locals())
 
     def as_args(self):
@@ -100,6 +102,9 @@ class BenchmarkConfiguration(Settings):
         if self.bist_alternating:
             args.append('--bist-alternating')
         args += self.access_pattern.as_args()
+        if self.controller_settings:
+            args.append('--controller-settings')
+            args += ['%s=%s' % (k, v) for k, v in sorted(self.controller_settings.items())]
         return args
 
     def __eq__(self, other):
@@ -170,6 +175,10 @@ class BenchmarkResult:
         'generator_ticks': _compiled_pattern('BIST-GENERATOR', 'ticks'),
         'checker_errors': _compiled_pattern('BIST-CHECKER', 'errors'),
         'checker_ticks': _compiled_pattern('BIST-CHECKER', 'ticks'),
+        'checker_latency_min': _compiled_pattern('BIST-CHECKER', 'latency-min'),
+        'checker_latency_max': _compiled_pattern('BIST-CHECKER', 'latency-max'),
+        'checker_latency_sum': _compiled_pattern('BIST-CHECKER', 'latency-sum'),
+        'checker_latency_count': _compiled_pattern('BIST-CHECKER', 'latency-count'),
     }
 
     @staticmethod
@@ -252,9 +261,14 @@ class ResultsSummary:
             'generator_ticks':  lambda d: getattr(d.result, 'generator_ticks', None),  # None means benchmark failure
             'checker_errors':   lambda d: getattr(d.result, 'checker_errors', None),
             'checker_ticks':    lambda d: getattr(d.result, 'checker_ticks', None),
+            'checker_latency_min':   lambda d: getattr(d.result, 'checker_latency_min', None),
+            'checker_latency_max':   lambda d: getattr(d.result, 'checker_latency_max', None),
+            'checker_latency_sum':   lambda d: getattr(d.result, 'checker_latency_sum', None),
+            'checker_latency_count': lambda d: getattr(d.result, 'checker_latency_count', None),
             'ctrl_data_width':  lambda d: except_none(lambda: d.config.sdram_controller_data_width),
             'sdram_memtype':    lambda d: except_none(lambda: d.config.sdram_memtype),
             'clk_freq':         lambda d: d.config.sdram_clk_freq,
+            'controller_settings': lambda d: ' '.join('%s=%s' % (k, v) for k, v in sorted(d.config.controller_settings.items())),
         }
         columns = {name: [mapping(data) for data in run_data] for name, mapping, in column_mappings.items()}
         self._df = df = pd.DataFrame(columns)
@@ -278,6 +292,10 @@ class ResultsSummary:
         df['write_latency'] = df[df['bist_length'] == 1]['generator_ticks']
         df['read_latency'] = df[df['bist_length'] == 1]['checker_ticks']
 
+        # read latency measured per command by the latency histograms of the checkers
+        df['read_latency_mean'] = df['checker_latency_sum'] / df['checker_latency_count']
+        df['read_latency_max']  = df['checker_latency_max']
+
         # boolean distinction between latency benchmarks and sequence benchmarks,
         # as thier results differ significanly
         df['is_latency'] = ~pd.isna(df['write_latency'])
@@ -292,6 +310,8 @@ class ResultsSummary:
             'read_efficiency':  efficiency_fmt,
             'write_latency':    clocks_fmt,
             'read_latency':     clocks_fmt,
+            'read_latency_mean': clocks_fmt,
+            'read_latency_max':  clocks_fmt,
         }
 
         # data formatting for plot summary
@@ -302,6 +322,8 @@ class ResultsSummary:
             'read_efficiency':  PercentFormatter(1.0),
             'write_latency':    ScalarFormatter(),
             'read_latency':     ScalarFormatter(),
+            'read_latency_mean': ScalarFormatter(),
+            'read_latency_max':  ScalarFormatter(),
         }
 
     def df(self, ok=True, failures=False):
@@ -381,11 +403,12 @@ class ResultsSummary:
 
         common_columns = [
             'name', 'sdram_module', 'sdram_memtype', 'sdram_data_width',
-            'bist_alternating', 'num_generators', 'num_checkers'
+            'bist_alternating', 'num_generators', 'num_checkers', 'controller_settings'
         ]
         latency_columns = ['write_latency', 'read_latency']
         performance_columns = [
-            'write_bandwidth', 'read_bandwidth', 'write_efficiency', 'read_efficiency'
+            'write_bandwidth', 'read_bandwidth', 'write_efficiency', 'read_efficiency',
+            'read_latency_mean', 'read_latency_max'
         ]
         failure_columns = [
             'bist_length', 'bist_random', 'pattern_file', 'length',
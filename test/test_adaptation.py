@@ -7,8 +7,9 @@ from migen import *
 
 from litex.soc.interconnect.stream import *
 
-from litedram.common import LiteDRAMNativeWritePort, LiteDRAMNativeReadPort
+from litedram.common import LiteDRAMNativePort, LiteDRAMNativeWritePort, LiteDRAMNativeReadPort
 from litedram.frontend.adaptation import LiteDRAMNativePortConverter, LiteDRAMNativePortCDC
+from litedram.frontend.adaptation import LiteDRAMNativeWriteCombiner
 
 from test.common import *
 
@@ -114,6 +115,72 @@ class CDCDUT(ConverterDUT):
             port_from=self.read_user_port, port_to=self.read_crossbar_port)
 
 
+class WriteCombinerDUT(Module):
+    def __init__(self, data_width=32, timeout=16):
+        self.user_port     = LiteDRAMNativePort("both", address_width=32, data_width=data_width)
+        self.crossbar_port = LiteDRAMNativePort("both", address_width=32, data_width=data_width)
+        self.submodules.combiner = LiteDRAMNativeWriteCombiner(
+            self.user_port, self.crossbar_port, timeout=timeout, with_perf_counters=True)
+        self.mem    = {}
+        self.writes = 0
+
+    @passive
+    def mem_handler(self):
+        port = self.crossbar_port
+        yield port.cmd.ready.eq(1)
+        yield port.wdata.ready.eq(1)
+        while True:
+            yield
+            if (yield port.cmd.valid) and (yield port.cmd.ready):
+                address = (yield port.cmd.addr)
+                if (yield port.cmd.we):
+                    while not (yield port.wdata.valid):
+                        yield
+                    data, we = (yield port.wdata.data), (yield port.wdata.we)
+                    mask = sum(0xff << 8*i for i in range(len(port.wdata.we)) if (we >> i) & 1)
+                    self.mem[address] = (self.mem.get(address, 0) & ~mask) | (data & mask)
+                    self.writes += 1
+                else:
+                    yield port.rdata.valid.eq(1)
+                    yield port.rdata.data.eq(self.mem.get(address, 0))
+                    yield
+                    yield port.rdata.valid.eq(0)
+
+    def write(self, address, data, we):
+        port = self.user_port
+        yield port.cmd.valid.eq(1)
+        yield port.cmd.we.eq(1)
+        yield port.cmd.addr.eq(address)
+        yield
+        while (yield port.cmd.ready) == 0:
+            yield
+        yield port.cmd.valid.eq(0)
+        yield port.wdata.valid.eq(1)
+        yield port.wdata.data.eq(data)
+        yield port.wdata.we.eq(we)
+        yield
+        while (yield port.wdata.ready) == 0:
+            yield
+        yield port.wdata.valid.eq(0)
+
+    def read(self, address):
+        port = self.user_port
+        yield port.cmd.valid.eq(1)
+        yield port.cmd.we.eq(0)
+        yield port.cmd.addr.eq(address)
+        yield
+        while (yield port.cmd.ready) == 0:
+            yield
+        yield port.cmd.valid.eq(0)
+        yield port.rdata.ready.eq(1)
+        while (yield port.rdata.valid) == 0:
+            yield
+        data = (yield port.rdata.data)
+        yield
+        yield port.rdata.ready.eq(0)
+        return data
+
+
 class TestAdaptation(MemoryTestDataMixin, unittest.TestCase):
     def test_converter_down_ratio_must_be_integer(self):
         with self.assertRaises(ValueError) as cm:
@@ -267,3 +334,72 @@ class TestAdaptation(MemoryTestDataMixin, unittest.TestCase):
             "native": (7, 3),
         }
         self.cdc_readback_test(dut, data["pattern"], data["expected"], clocks=clocks)
+
+    def test_write_combiner(self):
+        dut   = WriteCombinerDUT(timeout=16)
+        datas = {}
+
+        def main_generator():
+            # Byte writes to 4 words are merged in 4 writes.
+            for adr in range(4):
+                for i in range(4):
+                    yield from dut.write(adr, (0x10*adr + i) << 8*i, 1 << i)
+            for i in range(32):
+                yield
+            datas["writes"] = dut.writes
+            datas["words"]  = []
+            for adr in range(4):
+                datas["words"].append((yield from dut.read(adr)))
+            # Reads to the address of the buffer are forwarded (partial and full buffer).
+            yield from dut.write(4, 0x5a00, 0b0010)
+            yield from dut.write(4, 0xa5, 0b0001)
+            datas["partial_hit"] = (yield from dut.read(4))
+            yield from dut.write(5, 0x12345678, 0b1111)
+            datas["full_hit"] = (yield from dut.read(5))
+            # The buffer is flushed after timeout cycles.
+            yield from dut.write(6, 0xcc000000, 0b1000)
+            for i in range(32):
+                yield
+            datas["timeout"] = dut.mem.get(6)
+            yield dut.combiner.perf_counters.update.re.eq(1)
+            yield
+            yield dut.combiner.perf_counters.update.re.eq(0)
+            yield
+            for name in ["read_hits", "merges", "flushes"]:
+                datas[name] = (yield getattr(dut.combiner.perf_counters, name).status)
+
+        run_simulation(dut, [main_generator(), dut.mem_handler(), timeout_generator(5000)])
+        self.assertEqual(datas["writes"], 4)
+        self.assertEqual(datas["words"], [0x03020100 + 0x10101010*adr for adr in range(4)])
+        self.assertEqual(datas["partial_hit"], 0x5aa5)
+        self.assertEqual(datas["full_hit"], 0x12345678)
+        self.assertEqual(datas["timeout"], 0xcc000000)
+        self.assertEqual(datas["read_hits"], 2)
+        self.assertEqual(datas["merges"], 4*3 + 1)
+        self.assertEqual(datas["flushes"], 4 + 3)
+
+    def test_write_combiner_flush_priority(self):
+        # A partial write followed by back-to-back reads to another address is flushed after timeout
+        # cycles, or on a port.flush pulse (with a long timeout).
+        for timeout, flush in [(16, False), (1024, True)]:
+            with self.subTest(timeout=timeout, flush=flush):
+                dut    = WriteCombinerDUT(timeout=timeout)
+                cycles = []
+
+                def main_generator():
+                    port = dut.user_port
+                    yield from dut.write(8, 0xa5, 0b0001)
+                    yield port.rdata.ready.eq(1)
+                    yield port.cmd.valid.eq(1)
+                    yield port.cmd.we.eq(0)
+                    yield port.cmd.addr.eq(0)
+                    for i in range(64):
+                        yield port.flush.eq(flush and i == 4)
+                        yield
+                        if 8 in dut.mem and not cycles:
+                            cycles.append(i)
+                    yield port.cmd.valid.eq(0)
+
+                run_simulation(dut, [main_generator(), dut.mem_handler(), timeout_generator(5000)])
+                self.assertEqual(dut.mem.get(8), 0xa5)
+                self.assertLessEqual(cycles[0], 4 + 8 if flush else timeout + 8)
@@ -71,7 +71,11 @@ class TestAXI(unittest.TestCase):
         # flow ready randomness
         w_ready_random  = 0,
         b_ready_random  = 0,
-        r_ready_random  = 0
+        r_ready_random  = 0,
+        # native bursts
+        len_width = 0,
+        # separate write/read native ports
+        separate_ports = False
         ):
 
         def writes_cmd_generator(axi_port, writes):
@@ -177,8 +181,13 @@ class TestAXI(unittest.TestCase):
 
         # dut
         axi_port = LiteDRAMAXIPort(32, 32, 8)
-        dram_port = LiteDRAMNativePort("both", 32, 32)
-        dut = LiteDRAMAXI2Native(axi_port, dram_port)
+        if separate_ports:
+            dram_write_port = LiteDRAMNativePort("write", 32, 32, len_width=len_width)
+            dram_read_port  = LiteDRAMNativePort("read",  32, 32, len_width=len_width)
+            dut = LiteDRAMAXI2Native(axi_port, dram_write_port, read_port=dram_read_port)
+        else:
+            dram_write_port = dram_read_port = LiteDRAMNativePort("both", 32, 32, len_width=len_width)
+            dut = LiteDRAMAXI2Native(axi_port, dram_write_port)
         mem = DRAMMemory(32, 1024)
 
         # generate writes/reads
@@ -200,14 +209,24 @@ class TestAXI(unittest.TestCase):
             axi_port.reads_enable = True
         else:
             axi_port.reads_enable = False # will be set by writes_data_generator
+        @passive
+        def cmds_counter(dram_ports):
+            self.cmds = 0
+            while True:
+                for dram_port in dram_ports:
+                    if (yield dram_port.cmd.valid) and (yield dram_port.cmd.ready):
+                        self.cmds += 1
+                yield
+
         generators = [
+            cmds_counter(set([dram_write_port, dram_read_port])),
             writes_cmd_generator(axi_port, writes),
             writes_data_generator(axi_port, writes),
             writes_response_generator(axi_port, writes),
             reads_cmd_generator(axi_port, reads),
             reads_response_data_generator(axi_port, reads),
-            mem.read_handler(dram_port, rdata_valid_random=r_valid_random),
-            mem.write_handler(dram_port, wdata_ready_random=w_ready_random)
+            mem.read_handler(dram_read_port, rdata_valid_random=r_valid_random),
+            mem.write_handler(dram_write_port, wdata_ready_random=w_ready_random)
         ]
         run_simulation(dut, generators)
         #mem.show_content()
@@ -215,6 +234,95 @@ class TestAXI(unittest.TestCase):
         self.assertEqual(self.reads_data_errors, 0)
         self.assertEqual(self.reads_id_errors, 0)
         self.assertEqual(self.reads_last_errors, 0)
+        return writes, reads
+
+    def test_burst2cmd(self):
+        max_len = 4
+        bursts  = [
+            # addr, type,        len, size
+            (0x04,  BURST_INCR,  9,   2),
+            (0x38,  BURST_WRAP,  7,   2),
+            (0x14,  BURST_WRAP,  3,   2),
+            (0x20,  BURST_FIXED, 3,   2),
+            (0x42,  BURST_INCR,  3,   1),
+        ]
+
+        def beats(addr, type, len, size):
+            r = []
+            for i in range(len + 1):
+                if type == BURST_INCR:
+                    r.append(addr + (i << size))
+                elif type == BURST_WRAP:
+                    wrap = (len + 1) << size
+                    r.append((addr & ~(wrap - 1)) | ((addr + (i << size)) & (wrap - 1)))
+                else:
+                    r.append(addr)
+            return r
+
+        def generator(dut):
+            for addr, type, len, size in bursts:
+                yield dut.ax.valid.eq(1)
+                yield dut.ax.addr.eq(addr)
+                yield dut.ax.burst.eq(type)
+                yield dut.ax.len.eq(len)
+                yield dut.ax.size.eq(size)
+                yield
+                while (yield dut.ax.ready) == 0:
+                    yield
+            yield dut.ax.valid.eq(0)
+
+        def checker(dut):
+            yield dut.burst2cmd.source.ready.eq(1)
+            for addr, type, len, size in bursts:
+                addrs = []
+                while True:
+                    yield
+                    if (yield dut.burst2cmd.source.valid):
+                        cmd_addr = (yield dut.burst2cmd.source.addr)
+                        cmd_len  = (yield dut.burst2cmd.source.len)
+                        self.assertLessEqual(cmd_len + 1, max_len)
+                        # Commands never cross a max_len words boundary.
+                        self.assertEqual((cmd_addr >> 2)//max_len, ((cmd_addr >> 2) + cmd_len)//max_len)
+                        if size == 2:
+                            addrs += [cmd_addr + 4*i for i in range(cmd_len + 1)]
+                        else:
+                            addrs.append(cmd_addr)
+                        if (yield dut.burst2cmd.source.last):
+                            break
+                self.assertEqual(addrs, beats(addr, type, len, size))
+
+        class DUT(Module):
+            def __init__(self):
+                self.ax = stream.Endpoint(ax_description(32, 8))
+                self.submodules.burst2cmd = LiteDRAMAXIBurst2Cmd(self.ax, 32, max_len)
+
+        dut = DUT()
+        run_simulation(dut, [generator(dut), checker(dut)])
+
+    def test_axi2native_native_bursts(self):
+        writes, reads = self._test_axi2native(
+            simultaneous_writes_reads=True,
+            id_rand_enable=True,
+            len_rand_enable=True,
+            data_rand_enable=True,
+            len_width=3)
+        # Bursts are issued as commands of up to 8 words.
+        self.assertLess(self.cmds, sum(len(access.data) for access in writes + reads)//2)
+
+    def test_axi2native_native_bursts_random_all(self):
+        self._test_axi2native(
+            simultaneous_writes_reads=True,
+            id_rand_enable=True,
+            len_rand_enable=True,
+            aw_valid_random=50,
+            w_ready_random=50,
+            b_ready_random=50,
+            w_valid_random=50,
+            ar_valid_random=90,
+            r_valid_random=90,
+            r_ready_random=90,
+            len_width=3
+        )
 
     # test with no randomness
     def test_axi2native_writes_then_reads_no_random(self):
@@ -273,3 +381,100 @@ class TestAXI(unittest.TestCase):
             r_valid_random=90,
             r_ready_random=90
         )
+
+    def test_axi2native_separate_ports(self):
+        self._test_axi2native(
+            simultaneous_writes_reads=False,
+            id_rand_enable=True,
+            len_rand_enable=True,
+            data_rand_enable=True,
+            separate_ports=True)
+
+    def test_axi2native_separate_ports_random_all(self):
+        self._test_axi2native(
+            simultaneous_writes_reads=False,
+            id_rand_enable=True,
+            len_rand_enable=True,
+            aw_valid_random=50,
+            w_ready_random=50,
+            b_ready_random=50,
+            w_valid_random=50,
+            ar_valid_random=90,
+            r_valid_random=90,
+            r_ready_random=90,
+            len_width=3,
+            separate_ports=True
+        )
+
+    def test_axi2native_out_of_order_reads(self):
+        ids   = [0, 1, 2, 3]
+        depth = 8
+        prng  = random.Random(42)
+        mem   = DRAMMemory(32, 1024, init=[prng.randrange(2**32) for _ in range(1024)])
+        reads = []
+        for i in range(32):
+            _len  = prng.randrange(4)
+            _addr = prng.randrange(1024 - 4)
+            reads.append(Read(_addr, mem.mem[_addr:_addr + _len + 1], prng.choice(ids),
+                type=BURST_INCR, len=_len, size=log2_int(32//8)))
+
+        def reads_cmd_generator(axi_port):
+            for read in reads:
+                yield axi_port.ar.valid.eq(1)
+                yield axi_port.ar.addr.eq(read.addr<<2)
+                yield axi_port.ar.burst.eq(read.type)
+                yield axi_port.ar.len.eq(read.len)
+                yield axi_port.ar.size.eq(read.size)
+                yield axi_port.ar.id.eq(read.id)
+                yield
+                while (yield axi_port.ar.ready) == 0:
+                    yield
+            yield axi_port.ar.valid.eq(0)
+
+        def reads_response_data_generator(axi_port):
+            self.responses = []
+            yield axi_port.r.ready.eq(1)
+            while len(self.responses) < sum(len(read.data) for read in reads):
+                yield
+                if (yield axi_port.r.valid):
+                    self.responses.append(((yield axi_port.r.id),
+                        (yield axi_port.r.data), (yield axi_port.r.last)))
+
+        @passive
+        def out_of_order_read_handler(dram_port):
+            # Return the read data of the pending commands in a random order.
+            tag     = 0
+            pending = []
+            while True:
+                yield dram_port.cmd.ready.eq(len(pending) < depth)
+                yield dram_port.rdata.valid.eq(0)
+                if pending and prng.randrange(100) < 50:
+                    _tag, _addr = pending.pop(prng.randrange(len(pending)))
+                    yield dram_port.rdata.valid.eq(1)
+                    yield dram_port.rdata.id.eq(_tag)
+                    yield dram_port.rdata.data.eq(mem.mem[_addr])
+                yield
+                if (yield dram_port.cmd.valid) and (yield dram_port.cmd.ready):
+                    pending.append((tag, (yield dram_port.cmd.addr)))
+                    tag = (tag + 1)%depth
+
+        axi_port        = LiteDRAMAXIPort(32, 32, 8)
+        dram_write_port = LiteDRAMNativePort("write", 32, 32)
+        dram_read_port  = LiteDRAMNativePort("read",  32, 32, rdata_id_width=log2_int(depth))
+        dut = LiteDRAMAXI2Native(axi_port, dram_write_port, read_port=dram_read_port)
+        generators = [
+            reads_cmd_generator(axi_port),
+            reads_response_data_generator(axi_port),
+            out_of_order_read_handler(dram_read_port),
+        ]
+        run_simulation(dut, generators)
+
+        # Data of each ID are returned in order, the IDs are reordered.
+        for _id in ids:
+            expected = []
+            for read in reads:
+                if read.id == _id:
+                    expected += [(_id, data, int(i == read.len)) for i, data in enumerate(read.data)]
+            self.assertEqual([r for r in self.responses if r[0] == _id], expected)
+        in_order = [(read.id, data) for read in reads for data in read.data]
+        self.assertNotEqual([(r[0], r[1]) for r in self.responses], in_order)
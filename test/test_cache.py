@@ -0,0 +1,162 @@
+# This file is Copyright (c) 2026 agent <agent@local>
+# License: BSD
+
+import unittest
+import random
+
+from migen import *
+
+from litedram.common import LiteDRAMNativePort
+from litedram.frontend.cache import LiteDRAMNativeCache
+
+from test.common import *
+
+from litex.gen.sim import *
+
+
+class CacheDUT(Module):
+    def __init__(self, len_width=0, mem_depth=1024, **kwargs):
+        self.user_port     = LiteDRAMNativePort("both", address_width=24, data_width=32)
+        self.crossbar_port = LiteDRAMNativePort("both", address_width=24, data_width=32,
+            len_width=len_width)
+        self.submodules.cache = LiteDRAMNativeCache(self.user_port, self.crossbar_port,
+            with_perf_counters=True, **kwargs)
+        self.mem = DRAMMemory(32, mem_depth, init=list(range(mem_depth)))
+
+    def write(self, address, data, we=0xf):
+        port = self.user_port
+        yield port.cmd.valid.eq(1)
+        yield port.cmd.we.eq(1)
+        yield port.cmd.addr.eq(address)
+        yield
+        while (yield port.cmd.ready) == 0:
+            yield
+        yield port.cmd.valid.eq(0)
+        yield port.wdata.valid.eq(1)
+        yield port.wdata.data.eq(data)
+        yield port.wdata.we.eq(we)
+        yield
+        while (yield port.wdata.ready) == 0:
+            yield
+        yield port.wdata.valid.eq(0)
+
+    def read(self, address):
+        port = self.user_port
+        yield port.cmd.valid.eq(1)
+        yield port.cmd.we.eq(0)
+        yield port.cmd.addr.eq(address)
+        yield
+        while (yield port.cmd.ready) == 0:
+            yield
+        yield port.cmd.valid.eq(0)
+        yield port.rdata.ready.eq(1)
+        while (yield port.rdata.valid) == 0:
+            yield
+        data = (yield port.rdata.data)
+        yield
+        yield port.rdata.ready.eq(0)
+        return data
+
+    def csr_pulse(self, csr):
+        yield csr.re.eq(1)
+        yield
+        yield csr.re.eq(0)
+        yield
+        while (yield self.cache.busy.status):
+            yield
+
+    def perf_counters(self):
+        counters = self.cache.perf_counters
+        yield counters.update.re.eq(1)
+        yield
+        yield counters.update.re.eq(0)
+        yield
+        values = {}
+        for name in ["hits", "misses", "evictions", "writebacks"]:
+            values[name] = (yield getattr(counters, name).status)
+        return values
+
+
+class TestCache(unittest.TestCase):
+    def cache_random_test(self, naccesses=256, naddresses=128, **kwargs):
+        dut = CacheDUT(**kwargs)
+        ref = list(dut.mem.mem)
+
+        def main_generator(dut):
+            prng = random.Random(42)
+            for i in range(naccesses):
+                address = prng.randrange(naddresses)
+                if prng.randrange(2):
+                    data = prng.randrange(2**32)
+                    we   = prng.randrange(1, 16)
+                    mask = sum(0xff << 8*b for b in range(4) if (we >> b) & 1)
+                    ref[address] = (ref[address] & ~mask) | (data & mask)
+                    yield from dut.write(address, data, we)
+                else:
+                    self.assertEqual((yield from dut.read(address)), ref[address])
+            # Flush: the dirty lines are written back to the memory.
+            yield from dut.csr_pulse(dut.cache.flush)
+            self.counters = (yield from dut.perf_counters())
+
+        generators = [
+            main_generator(dut),
+            dut.mem.read_handler(dut.crossbar_port),
+            dut.mem.write_handler(dut.crossbar_port),
+        ]
+        run_simulation(dut, generators)
+        self.assertEqual(dut.mem.mem, ref)
+        self.assertEqual(self.counters["hits"] + self.counters["misses"], naccesses)
+        self.assertNotEqual(self.counters["evictions"], 0)
+        self.assertNotEqual(self.counters["writebacks"], 0)
+
+    def test_cache_lru(self):
+        self.cache_random_test(size=256, nways=2, replacement="LRU")
+
+    def test_cache_plru(self):
+        self.cache_random_test(size=256, nways=4, replacement="PLRU")
+
+    def test_cache_direct_mapped(self):
+        self.cache_random_test(size=128, nways=1)
+
+    def test_cache_burst_lines(self):
+        self.cache_random_test(size=256, nways=2, len_width=2)
+
+    def test_cache_lru_replacement(self):
+        # 2 ways of 2 sets (even addresses in set 0): accessing a line protects it from the next replacement.
+        dut = CacheDUT(size=16, nways=2, line_words=1)
+
+        def main_generator(dut):
+            for address in [0, 2, 0, 4, 0, 2]:
+                yield from dut.read(address)
+            self.counters = (yield from dut.perf_counters())
+
+        generators = [
+            main_generator(dut),
+            dut.mem.read_handler(dut.crossbar_port),
+            dut.mem.write_handler(dut.crossbar_port),
+        ]
+        run_simulation(dut, generators)
+        # 0, 2: misses, 0: hit, 4: miss (replaces 2), 0: hit, 2: miss.
+        self.assertEqual(self.counters["hits"],      2)
+        self.assertEqual(self.counters["misses"],    4)
+        self.assertEqual(self.counters["evictions"], 2)
+
+    def test_cache_invalidate(self):
+        dut = CacheDUT(size=256, nways=2)
+
+        def main_generator(dut):
+            yield from dut.write(0x10, 0x12345678)
+            self.assertEqual((yield from dut.read(0x10)), 0x12345678)
+            # Invalidate: the dirty line is discarded, the data is read back from the memory.
+            yield from dut.csr_pulse(dut.cache.invalidate)
+            self.assertEqual((yield from dut.read(0x10)), 0x10)
+            self.counters = (yield from dut.perf_counters())
+
+        generators = [
+            main_generator(dut),
+            dut.mem.read_handler(dut.crossbar_port),
+            dut.mem.write_handler(dut.crossbar_port),
+        ]
+        run_simulation(dut, generators)
+        self.assertEqual(self.counters["misses"],     2)
+        self.assertEqual(self.counters["writebacks"], 0)
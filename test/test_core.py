@@ -0,0 +1,745 @@
+# This file is Copyright (c) 2026 agent <agent@local>
+# License: BSD
+
+import os
+import unittest
+import random
+from copy import copy
+
+from migen import *
+
+from litex.soc.interconnect.csr import CSRStatus
+
+from litedram.common import *
+from litedram import modules
+from litedram.phy.model import SDRAMPHYModel, SDRAM_VERBOSE_OFF, SDRAM_VERBOSE_STD
+from litedram.core import LiteDRAMMultiChannelCore
+from litedram.core.controller import ControllerSettings, LiteDRAMController
+from litedram.core.crossbar import LiteDRAMCrossbar, LiteDRAMMultiChannelCrossbar, _HierarchicalRoundRobin
+from litedram.core.perfcounters import LatencyHistogram
+from litedram.frontend.adaptation import LiteDRAMNativeWriteCombiner
+
+from test.common import timeout_generator
+
+# Throughput comparisons (long simulations), only run when LITEDRAM_SLOW_TESTS is set.
+slow_test = unittest.skipUnless(os.environ.get("LITEDRAM_SLOW_TESTS"),
+    "slow test (set LITEDRAM_SLOW_TESTS=1 to run it)")
+
+def get_phy_settings(memtype, data_width=16, clk_freq=100e6, nranks=1):
+    if memtype == "SDR":
+        return PhySettings(
+            memtype       = memtype,
+            databits      = data_width,
+            dfi_databits  = data_width,
+            nranks        = nranks,
+            nphases       = 1,
+            rdphase       = 0,
+            wrphase       = 0,
+            rdcmdphase    = 0,
+            wrcmdphase    = 0,
+            cl            = 2,
+            read_latency  = 4,
+            write_latency = 0)
+    elif memtype in ["DDR3", "DDR4", "LPDDR3"]:
+        nphases         = 4
+        cl, cwl         = get_cl_cw(memtype, 1/(nphases*clk_freq))
+        cl_sys_latency  = get_sys_latency(nphases, cl)
+        cwl_sys_latency = get_sys_latency(nphases, cwl)
+        rdcmdphase, rdphase = get_sys_phases(nphases, cl_sys_latency,  cl)
+        wrcmdphase, wrphase = get_sys_phases(nphases, cwl_sys_latency, cwl)
+        return PhySettings(
+            memtype       = memtype,
+            databits      = data_width,
+            dfi_databits  = 2*data_width,
+            nranks        = nranks,
+            nphases       = nphases,
+            rdphase       = rdphase,
+            wrphase       = wrphase,
+            rdcmdphase    = rdcmdphase,
+            wrcmdphase    = wrcmdphase,
+            cl            = cl,
+            cwl           = cwl,
+            read_latency  = 2 + cl_sys_latency + 2 + 3,
+            write_latency = cwl_sys_latency)
+    else:
+        raise NotImplementedError
+
+
+class CoreDUT(Module):
+    def __init__(self, module, nports=1, nrows=128, ncols=64, nranks=1, qos=None, nchannels=1,
+        granularity=64, check_timings=False, **kwargs):
+        # Use a reduced geometry to speed up the simulation.
+        module_cls = type(module, (getattr(modules, module),), dict(nrows=nrows, ncols=ncols))
+        phy_settings = get_phy_settings(module_cls.memtype, nranks=nranks)
+        rate = "1:{}".format(phy_settings.nphases)
+        self.module = module_cls(100e6, rate)
+        self.module.geom_settings.addressbits = max(self.module.geom_settings.addressbits, 13)
+        controller_settings = ControllerSettings(**kwargs)
+        qos = [{}]*nports if qos is None else qos
+
+        # PHY Model (with the DFI timings checker when check_timings) ------------------------------
+        self.submodules.phy = SDRAMPHYModel(self.module, phy_settings,
+            address_mapping  = controller_settings.address_mapping,
+            per_bank_refresh = controller_settings.refresh_per_bank,
+            verbosity        = SDRAM_VERBOSE_STD if check_timings else SDRAM_VERBOSE_OFF)
+
+        # Controller -------------------------------------------------------------------------------
+        self.submodules.controller = LiteDRAMController(
+            phy_settings        = phy_settings,
+            geom_settings       = self.module.geom_settings,
+            timing_settings     = self.module.timing_settings,
+            clk_freq            = 100e6,
+            controller_settings = controller_settings)
+        self.comb += self.controller.dfi.connect(self.phy.dfi)
+
+        # Crossbar ---------------------------------------------------------------------------------
+        self.submodules.crossbar = LiteDRAMCrossbar(self.controller.interface)
+        if nchannels == 1:
+            self.ports = [self.crossbar.get_port(**qos[n]) for n in range(nports)]
+            return
+
+        # Other channels / Multi-Channel Crossbar --------------------------------------------------
+        crossbars = [self.crossbar]
+        for n in range(1, nchannels):
+            phy = SDRAMPHYModel(self.module, phy_settings,
+                address_mapping  = controller_settings.address_mapping,
+                per_bank_refresh = controller_settings.refresh_per_bank)
+            controller = LiteDRAMController(
+                phy_settings        = phy_settings,
+                geom_settings       = self.module.geom_settings,
+                timing_settings     = self.module.timing_settings,
+                clk_freq            = 100e6,
+                controller_settings = copy(controller_settings))
+            crossbar = LiteDRAMCrossbar(controller.interface)
+            self.submodules += phy, controller, crossbar
+            self.comb += controller.dfi.connect(phy.dfi)
+            crossbars.append(crossbar)
+        self.submodules.multichannel_crossbar = LiteDRAMMultiChannelCrossbar(crossbars, granularity)
+        self.ports = [self.multichannel_crossbar.get_port(**qos[n]) for n in range(nports)]
+
+
+class PortDriver:
+    """Write a list of (address, data) to a port, then read it back.
+
+    With burst_len, the accesses are grouped in bursts of burst_len consecutive addresses (the data
+    are read back in bursts of read_burst_len, burst_len by default). With cmd_idle, the port stays
+    idle cmd_idle cycles after each command.
+    """
+    def __init__(self, port, writes, burst_len=1, read_burst_len=None, cmd_idle=0):
+        self.port           = port
+        self.writes         = writes
+        self.burst_len      = burst_len
+        self.read_burst_len = burst_len if read_burst_len is None else read_burst_len
+        self.cmd_idle       = cmd_idle
+        self.rdatas         = []
+        self.writes_done    = False
+
+    def write_cmd_generator(self):
+        for addr, data in self.writes[::self.burst_len]:
+            yield self.port.cmd.valid.eq(1)
+            yield self.port.cmd.we.eq(1)
+            yield self.port.cmd.addr.eq(addr)
+            if self.burst_len > 1:
+                yield self.port.cmd.len.eq(self.burst_len - 1)
+            yield from self.cmd_wait()
+        yield self.port.cmd.valid.eq(0)
+
+    def cmd_wait(self):
+        yield
+        while (yield self.port.cmd.ready) == 0:
+            yield
+        if self.cmd_idle:
+            yield self.port.cmd.valid.eq(0)
+            for i in range(self.cmd_idle):
+                yield
+
+    def wdata_generator(self):
+        for addr, data in self.writes:
+            yield self.port.wdata.valid.eq(1)
+            yield self.port.wdata.data.eq(data)
+            yield self.port.wdata.we.eq(2**len(self.port.wdata.we) - 1)
+            yield
+            while (yield self.port.wdata.ready) == 0:
+                yield
+        yield self.port.wdata.valid.eq(0)
+        self.writes_done = True
+
+    def read_cmd_generator(self):
+        while not self.writes_done:
+            yield
+        for addr, data in self.writes[::self.read_burst_len]:
+            yield self.port.cmd.valid.eq(1)
+            yield self.port.cmd.we.eq(0)
+            yield self.port.cmd.addr.eq(addr)
+            if hasattr(self.port.cmd, "len"):
+                yield self.port.cmd.len.eq(self.read_burst_len - 1)
+            yield from self.cmd_wait()
+        yield self.port.cmd.valid.eq(0)
+
+    def rdata_generator(self):
+        yield self.port.rdata.ready.eq(1)
+        if hasattr(self.port.rdata, "id"):
+            # Out of order reads: the k-th data of id i is the data of the (i + k*depth)-th read.
+            depth  = self.port.reorder_depth
+            rdatas = {}
+            counts = [0]*depth
+            while len(rdatas) < len(self.writes):
+                if (yield self.port.rdata.valid):
+                    i = (yield self.port.rdata.id)
+                    rdatas[i + counts[i]*depth] = (yield self.port.rdata.data)
+                    counts[i] += 1
+                yield
+            self.rdatas = [rdatas[n] for n in range(len(self.writes))]
+            return
+        while len(self.rdatas) < len(self.writes):
+            if (yield self.port.rdata.valid):
+                self.rdatas.append((yield self.port.rdata.data))
+            yield
+
+    def generators(self):
+        def cmd_generator():
+            yield from self.write_cmd_generator()
+            yield from self.read_cmd_generator()
+        return [cmd_generator(), self.wdata_generator(), self.rdata_generator()]
+
+
+def counters_generator(dut, drivers, counters):
+    """Count the DFI commands until the drivers are done, then read the counters.
+
+    The activates, the precharges, the refreshes, the auto-precharges (CAS commands with A10), the
+    accesses (CAS commands) of each bank, the lengths of the batches of consecutive writes, the
+    switches of rank of the CAS commands and the cycles with the ODT of a rank deasserted are
+    measured on the DFI interface. The violations of the DFI timings checker and the performance
+    counters (with_perf_counters) are read at the end.
+    """
+    counters["activates"]       = 0
+    counters["precharges"]      = 0
+    counters["refreshes"]       = 0
+    counters["auto_precharges"] = 0
+    counters["bank_accesses"]   = [0]*2**len(dut.phy.dfi.phases[0].bank)
+    counters["write_batches"]   = []
+    counters["rank_switches"]   = 0
+    counters["odt_off_cycles"]  = 0
+    last_write = False
+    last_cs_n  = None
+    nranks     = len(dut.phy.dfi.phases[0].cs_n)
+    while any(len(driver.rdatas) < len(driver.writes) for driver in drivers):
+        for phase in dut.phy.dfi.phases:
+            cs_n  = (yield phase.cs_n)
+            cas_n = (yield phase.cas_n)
+            ras_n = (yield phase.ras_n)
+            we_n  = (yield phase.we_n)
+            if cs_n != 2**nranks - 1:
+                counters["activates"]  += not ras_n and cas_n and we_n
+                counters["precharges"] += not ras_n and cas_n and not we_n
+                counters["refreshes"]  += not ras_n and not cas_n and we_n
+                if not cas_n and ras_n:
+                    counters["auto_precharges"] += ((yield phase.address) >> 10) & 1
+                    counters["bank_accesses"][(yield phase.bank)] += 1
+                    write = not we_n
+                    if write and not last_write:
+                        counters["write_batches"].append(0)
+                    if write:
+                        counters["write_batches"][-1] += 1
+                    last_write = write
+                    counters["rank_switches"] += last_cs_n is not None and cs_n != last_cs_n
+                    last_cs_n = cs_n
+        if nranks > 1 and hasattr(dut.phy.dfi.phases[0], "odt"):
+            counters["odt_off_cycles"] += (yield dut.phy.dfi.phases[0].odt) != 2**nranks - 1
+        yield
+    if hasattr(dut.phy, "timing_checker"):
+        counters["violations"] = (yield dut.phy.timing_checker.violations)
+    if hasattr(dut.controller.multiplexer, "perf_counters"):
+        perf = dut.controller.multiplexer.perf_counters
+        yield perf.update.re.eq(1)
+        yield
+        yield perf.update.re.eq(0)
+        yield
+        for csr in perf.get_csrs():
+            if isinstance(csr, CSRStatus):
+                counters[csr.name] = (yield csr.status)
+
+
+class TestCore(unittest.TestCase):
+    def core_test(self, module, nports=1, naccesses=16, seed=42, burst_len=1, read_burst_len=None,
+        addrs=None, cmd_idle=0, **kwargs):
+        """Write then read back naccesses random (or addrs) addresses per port.
+
+        The counters of counters_generator are returned in dut.counters.
+        """
+        prng = random.Random(seed)
+        dut  = CoreDUT(module, nports=nports, **kwargs)
+
+        address_width = len(dut.ports[0].cmd.addr)
+        data_width    = len(dut.ports[0].wdata.data)
+        if addrs is None:
+            bursts = prng.sample(range(2**address_width//burst_len), nports*naccesses//burst_len)
+            addrs  = [burst*burst_len + i for burst in bursts for i in range(burst_len)]
+        drivers = []
+        for n, port in enumerate(dut.ports):
+            port_addrs = [addr for i, addr in enumerate(addrs) if (i//burst_len)%nports == n]
+            writes     = [(addr, prng.randrange(2**data_width)) for addr in port_addrs]
+            if not hasattr(port.cmd, "len"):
+                drivers.append(PortDriver(port, writes, cmd_idle=cmd_idle))
+            else:
+                drivers.append(PortDriver(port, writes, burst_len, read_burst_len, cmd_idle))
+
+        dut.counters = {}
+        generators   = [timeout_generator(len(addrs)*(200 + 2*cmd_idle))]
+        generators  += [counters_generator(dut, drivers, dut.counters)]
+        for driver in drivers:
+            generators += driver.generators()
+        run_simulation(dut, generators)
+
+        for driver in drivers:
+            self.assertEqual([data for addr, data in driver.writes], driver.rdatas)
+        # Timings violations reported by the DFI timings checker.
+        if hasattr(dut.phy, "timing_checker"):
+            self.assertEqual(dut.counters["violations"], 0)
+        return dut
+
+    def test_sdr(self):
+        self.core_test("MT48LC16M16")
+
+    def test_ddr3(self):
+        self.core_test("MT41K128M16")
+
+    def test_page_policies(self):
+        # OPEN is the default page policy (covered by test_sdr/test_ddr3).
+        for page_policy, module in [("CLOSED", "MT41K128M16"), ("ADAPTIVE", "MT48LC16M16")]:
+            with self.subTest(page_policy=page_policy, module=module):
+                self.core_test(module, nports=2, page_policy=page_policy, page_timeout=8)
+        # Accesses to a single row separated by idle cycles (longer than page_timeout): OPEN keeps
+        # the row opened, CLOSED closes it with auto-precharges (A10) and ADAPTIVE precharges it
+        # after page_timeout.
+        counters = {}
+        for page_policy in ["OPEN", "CLOSED", "ADAPTIVE"]:
+            with self.subTest(page_policy=page_policy):
+                dut = self.core_test("MT41K128M16", addrs=list(range(8)), cmd_idle=16,
+                    page_policy=page_policy, page_timeout=8, with_refresh=False,
+                    check_timings=True)
+                counters[page_policy] = dut.counters
+        self.assertEqual(counters["OPEN"]["activates"],           1)
+        self.assertEqual(counters["OPEN"]["precharges"],          0)
+        self.assertEqual(counters["OPEN"]["auto_precharges"],     0)
+        self.assertEqual(counters["CLOSED"]["activates"],        16)
+        self.assertEqual(counters["CLOSED"]["auto_precharges"],  16)
+        self.assertGreaterEqual(counters["ADAPTIVE"]["activates"], 15)
+        self.assertGreaterEqual(counters["ADAPTIVE"]["precharges"] +
+            counters["ADAPTIVE"]["auto_precharges"], counters["ADAPTIVE"]["activates"] - 1)
+
+    def test_address_mappings(self):
+        for address_mapping in ["ROW_BANK_COL", "ROW_BANK_COL_XOR", "BANK_ROW_COL", "ROW_COL_BANK"]:
+            with self.subTest(address_mapping=address_mapping):
+                self.core_test("MT48LC16M16", address_mapping=address_mapping)
+
+        # Accesses of the banks (CAS commands of each bank).
+        def bank_accesses(addrs, address_mapping):
+            dut = self.core_test("MT48LC16M16", addrs=addrs, address_mapping=address_mapping)
+            return dut.counters["bank_accesses"]
+
+        # Strided accesses (one row of each bank): in the same bank with ROW_BANK_COL, spread over
+        # the banks by the XOR bank hashing.
+        strided = [i << 8 for i in range(16)]
+        self.assertEqual(bank_accesses(strided, "ROW_BANK_COL"),     [32, 0, 0, 0])
+        self.assertEqual(bank_accesses(strided, "ROW_BANK_COL_XOR"), [8, 8, 8, 8])
+        # Sequential accesses: in the same bank with ROW_BANK_COL, interleaved over the banks with
+        # ROW_COL_BANK.
+        sequential = list(range(16))
+        self.assertEqual(bank_accesses(sequential, "ROW_BANK_COL"), [32, 0, 0, 0])
+        self.assertEqual(bank_accesses(sequential, "ROW_COL_BANK"), [8, 8, 8, 8])
+
+    def test_elastic_refresh(self):
+        # Refreshes issued during mostly idle accesses (shorter than tREFI): the regular refreshes
+        # are only issued when due, the elastic refreshes are pulled in (up to 8). The postponing
+        # while busy is covered by test_refresh.
+        def refreshes(**kwargs):
+            dut = self.core_test("MT48LC16M16", addrs=list(range(8)), cmd_idle=50, **kwargs)
+            return dut.counters["refreshes"]
+        self.assertEqual(refreshes(), 0)
+        self.assertGreaterEqual(refreshes(refresh_elastic=True, refresh_postponing=8), 8)
+
+    def write_drain_test(self, naccesses=32, **kwargs):
+        # Slow writes from port 0 while ports 1 and 2 read, return the lengths of the write batches.
+        dut     = CoreDUT("MT48LC16M16", nports=3, read_time=1024, **kwargs)
+        writer  = PortDriver(dut.ports[0], [(addr, addr) for addr in range(naccesses)], cmd_idle=4)
+        drivers = [writer]
+        for n in [1, 2]:
+            reader = PortDriver(dut.ports[n], [(64*n + i, 0) for i in range(2*naccesses)])
+            reader.writes_done = True
+            drivers.append(reader)
+        counters   = {}
+        generators = [timeout_generator(naccesses*400), counters_generator(dut, drivers, counters)]
+        generators += writer.generators()
+        for reader in drivers[1:]:
+            generators += [reader.read_cmd_generator(), reader.rdata_generator()]
+        run_simulation(dut, generators)
+        for driver in drivers:
+            self.assertEqual([data for addr, data in driver.writes], driver.rdatas)
+        return counters["write_batches"]
+
+    def test_write_drain(self):
+        for module in ["MT48LC16M16", "MT41K128M16"]:
+            with self.subTest(module=module):
+                self.core_test(module, nports=2, write_drain_high=8, write_drain_low=2)
+        # Without watermarks, the reads keep the priority and the writes wait for the end of the
+        # reads. With watermarks, the writes are drained in batches of at least high - low writes
+        # while the reads are pending (the first and last batches are issued without reads).
+        self.assertLessEqual(len(self.write_drain_test()), 2)
+        batches = self.write_drain_test(write_drain_high=8, write_drain_low=2)
+        self.assertGreater(len(batches), 3)
+        for batch in batches[1:-1]:
+            self.assertGreaterEqual(batch, 8 - 2)
+
+    def test_multirank(self):
+        for module, rank_batch in [("MT48LC16M16", None), ("MT41K128M16", 4)]:
+            with self.subTest(module=module, rank_batch=rank_batch):
+                dut = self.core_test(module, nports=2, naccesses=8, nranks=2, rank_batch=rank_batch,
+                    check_timings=True)
+                # ODT is dynamically driven per command (not statically asserted on all ranks).
+                if module == "MT41K128M16":
+                    self.assertGreater(dut.counters["odt_off_cycles"], 0)
+        # 2 ports per rank streaming to their bank: the ranks are switched after batches of
+        # rank_batch reads/writes (tRTRS checked by the DFI timings checker), without rank_batch
+        # the rank streaming first keeps the bus.
+        addrs = [base + i for i in range(8) for base in [0, 256, 64, 256 + 64]]
+        rank_switches = {}
+        for rank_batch in [None, 4]:
+            dut = self.core_test("MT48LC16M16", nports=4, nranks=2, addrs=addrs,
+                rank_batch=rank_batch, check_timings=True)
+            rank_switches[rank_batch] = dut.counters["rank_switches"]
+        self.assertGreaterEqual(rank_switches[4], rank_switches[None] + 4)
+
+    def qos_test(self, qos, naccesses=32):
+        # All the ports read the same bank, return the cycles at which the ports are done.
+        dut    = CoreDUT("MT48LC16M16", nports=len(qos), qos=qos, with_grant_counters=True)
+        geom   = dut.module.geom_settings
+        done   = [None]*len(qos)
+        grants = [None]*len(qos)
+
+        def port_generator(n, port):
+            yield port.rdata.ready.eq(1)
+            for i in range(naccesses):
+                yield port.cmd.valid.eq(1)
+                yield port.cmd.we.eq(0)
+                yield port.cmd.addr.eq((n*naccesses + i) << (geom.colbits + geom.bankbits))
+                yield
+                while (yield port.cmd.ready) == 0:
+                    yield
+            yield port.cmd.valid.eq(0)
+            done[n] = cycles[0]
+            yield
+            grants[n] = (yield getattr(dut.crossbar, "port{}_grants".format(n)).status)
+
+        cycles = [0]
+        def cycle_generator():
+            while None in grants:
+                cycles[0] += 1
+                yield
+
+        generators = [timeout_generator(len(qos)*naccesses*200), cycle_generator()]
+        generators += [port_generator(n, port) for n, port in enumerate(dut.ports)]
+        run_simulation(dut, generators)
+        self.assertEqual(grants, [naccesses]*len(qos))
+        return done
+
+    def test_crossbar_qos(self):
+        # Priority: port 1 is done first.
+        done_priority = self.qos_test([{}, {"priority": 1}])
+        self.assertLess(done_priority[1], done_priority[0])
+        # Weights: port 1 is done first.
+        done = self.qos_test([{}, {"weight": 4}])
+        self.assertLess(done[1], done[0])
+        # Guaranteed bandwidth/max latency: port 0 is not starved by port 1, port 1 is done later.
+        for budget in [{"bandwidth": 0.05}, {"max_latency": 16}]:
+            with self.subTest(budget=budget):
+                done = self.qos_test([budget, {"priority": 1}])
+                self.assertGreater(done[1], done_priority[1] + 32)
+        # Data integrity with mixed QoS settings.
+        self.core_test("MT48LC16M16", nports=3,
+            qos=[{"priority": 1}, {"weight": 3}, {"max_latency": 8, "bandwidth": 0.1}])
+
+    def reorder_test(self, qos, naccesses=16):
+        # A port reads all the banks in turn, return the number of cycles to complete the reads.
+        dut     = CoreDUT("MT41K128M16", qos=[qos])
+        geom    = dut.module.geom_settings
+        colbits = geom.colbits - dut.controller.interface.address_align
+        port    = dut.ports[0]
+        rdatas  = [0]
+        cycles  = [0]
+
+        def cmd_generator():
+            for i in range(naccesses):
+                yield port.cmd.valid.eq(1)
+                yield port.cmd.we.eq(0)
+                yield port.cmd.addr.eq(((i//2**geom.bankbits) << colbits + geom.bankbits) |
+                    ((i%2**geom.bankbits) << colbits))
+                yield
+                while (yield port.cmd.ready) == 0:
+                    yield
+            yield port.cmd.valid.eq(0)
+
+        def rdata_generator():
+            yield port.rdata.ready.eq(1)
+            while rdatas[0] < naccesses:
+                rdatas[0] += (yield port.rdata.valid)
+                cycles[0] += 1
+                yield
+
+        generators = [timeout_generator(naccesses*200), cmd_generator(), rdata_generator()]
+        run_simulation(dut, generators)
+        return cycles[0]
+
+    def test_reorder(self):
+        # Data integrity, alone and with other ports.
+        for reorder, reorder_depth in [("IN_ORDER", 2), ("OUT_OF_ORDER", 8)]:
+            qos = {"reorder": reorder, "reorder_depth": reorder_depth}
+            with self.subTest(reorder=reorder, reorder_depth=reorder_depth):
+                self.core_test("MT41K128M16", qos=[qos])
+                self.core_test("MT48LC16M16", nports=3, qos=[qos, {}, qos])
+        # Reads to several banks are kept in flight.
+        cycles = self.reorder_test({})
+        self.assertLess(self.reorder_test({"reorder": "IN_ORDER"}), cycles)
+        self.assertLess(self.reorder_test({"reorder": "OUT_OF_ORDER"}), cycles)
+
+    def test_burst(self):
+        for module, page_policy in [("MT48LC16M16", "CLOSED"), ("MT41K128M16", "OPEN")]:
+            with self.subTest(module=module, page_policy=page_policy):
+                self.core_test(module, nports=2, burst_len=4, cmd_max_len=4,
+                    page_policy=page_policy)
+        # Ports not using bursts and reordering ports (without cmd.len).
+        self.core_test("MT48LC16M16", nports=2, cmd_max_len=4)
+        self.core_test("MT48LC16M16", nports=2, burst_len=4, cmd_max_len=4,
+            qos=[{"reorder": "IN_ORDER"}, {}])
+        # Bursts written then read back with single beats under the other address mappings (no
+        # bursts with ROW_COL_BANK: consecutive addresses are in different banks).
+        for address_mapping in ["ROW_BANK_COL_XOR", "BANK_ROW_COL"]:
+            with self.subTest(address_mapping=address_mapping):
+                self.core_test("MT48LC16M16", burst_len=4, read_burst_len=1, cmd_max_len=4,
+                    address_mapping=address_mapping)
+        with self.assertRaises(AssertionError):
+            CoreDUT("MT48LC16M16", cmd_max_len=4, address_mapping="ROW_COL_BANK")
+        # cmd_max_len must be a power of 2 not larger than a row.
+        for cmd_max_len in [3, 128]:
+            with self.assertRaises(AssertionError):
+                CoreDUT("MT48LC16M16", cmd_max_len=cmd_max_len)
+
+    def test_crossbar_pipeline(self):
+        for module in ["MT48LC16M16", "MT41K128M16"]:
+            with self.subTest(module=module):
+                self.core_test(module, nports=4, crossbar_pipeline=True)
+        # Reordering and bursting ports.
+        self.core_test("MT48LC16M16", nports=3, burst_len=4, cmd_max_len=4, crossbar_pipeline=True,
+            qos=[{"reorder": "IN_ORDER"}, {}, {"reorder": "OUT_OF_ORDER"}])
+        # More than 8 ports: hierarchical arbiters.
+        self.core_test("MT48LC16M16", nports=10, naccesses=4, crossbar_pipeline=True)
+
+    def test_hierarchical_round_robin(self):
+        # Only and all the requesting masters are granted (masters arbitrated in groups of 4).
+        dut = _HierarchicalRoundRobin(10)
+
+        def generator(dut):
+            for request in [2**10 - 1, 0b1000100110, 0b0100000000]:
+                yield dut.request.eq(request)
+                yield dut.ce.eq(1)
+                yield
+                grants = []
+                for i in range(30):
+                    yield
+                    grants.append((yield dut.grant))
+                self.assertEqual(set(grants), {n for n in range(10) if (request >> n) & 1})
+
+        run_simulation(dut, generator(dut))
+
+    def test_multichannel(self):
+        # 4 channels (2 channels are covered by test_multichannel_core).
+        dut = self.core_test("MT48LC16M16", nports=2, nchannels=4)
+        self.assertEqual(len(dut.ports[0].cmd.addr), len(dut.crossbar.masters[0].cmd.addr) + 2)
+
+    def test_multichannel_core(self):
+        # LiteDRAMMultiChannelCore on SDRAMPHYModels (without the DFIInjectors, no initialization).
+        prng   = random.Random(42)
+        dut    = Module()
+        module = type("MT48LC16M16", (modules.MT48LC16M16,), dict(nrows=128, ncols=64))(100e6, "1:1")
+        module.geom_settings.addressbits = 13
+        phy_settings = get_phy_settings("SDR")
+        phys   = [SDRAMPHYModel(module, phy_settings) for n in range(2)]
+        dut.submodules += phys
+        dut.submodules.core = core = LiteDRAMMultiChannelCore(phys,
+            geom_settings   = module.geom_settings,
+            timing_settings = module.timing_settings,
+            clk_freq        = 100e6,
+            granularity     = 64,
+            with_dfii       = False)
+        ports = [core.crossbar.get_port() for n in range(2)]
+        self.assertEqual(len(ports[0].cmd.addr), len(core.channels[0].crossbar.masters[0].cmd.addr) + 1)
+
+        # Both ports access both channels.
+        addrs   = prng.sample(range(2**len(ports[0].cmd.addr)), 32)
+        drivers = [PortDriver(port, [(addr, prng.randrange(2**16)) for addr in addrs[n::2]])
+            for n, port in enumerate(ports)]
+        generators = [timeout_generator(32*200)]
+        for driver in drivers:
+            generators += driver.generators()
+        run_simulation(dut, generators)
+        for driver in drivers:
+            self.assertEqual([data for addr, data in driver.writes], driver.rdatas)
+
+    def test_perf_counters(self):
+        # Write then read back 8 columns of 2 rows of the same bank: 4 row misses/conflicts.
+        dut    = CoreDUT("MT48LC16M16", with_perf_counters=True)
+        geom   = dut.module.geom_settings
+        perf   = dut.controller.multiplexer.perf_counters
+        writes = [((row << (geom.colbits + geom.bankbits)) | col, col)
+            for row in range(2) for col in range(8)]
+        driver   = PortDriver(dut.ports[0], writes)
+        counters = {}
+
+        def perf_generator():
+            while len(driver.rdatas) < len(writes):
+                yield
+            yield perf.update.re.eq(1)
+            yield
+            yield perf.update.re.eq(0)
+            yield
+            for name in ["bank0_row_hits", "bank0_row_misses", "bank0_row_conflicts",
+                         "activates", "reads", "writes"]:
+                counters[name] = (yield getattr(perf, name).status)
+            counters["grants"] = (yield dut.crossbar.port0_grants.status)
+
+        generators = [timeout_generator(len(writes)*200), perf_generator()] + driver.generators()
+        run_simulation(dut, generators)
+        self.assertEqual(driver.rdatas, [data for addr, data in writes])
+        self.assertEqual(counters["reads"],  16)
+        self.assertEqual(counters["writes"], 16)
+        self.assertEqual(counters["grants"], 32)
+        accesses = [counters["bank0_row_" + name] for name in ["hits", "misses", "conflicts"]]
+        self.assertEqual(sum(accesses), 32)
+        self.assertGreaterEqual(accesses[0], 24)
+        self.assertGreaterEqual(counters["activates"], 4)
+
+    def test_write_combiner_read_hits(self):
+        # The reads forwarded by a write combiner are counted by the controller performance counters.
+        dut  = CoreDUT("MT48LC16M16", with_perf_counters=True)
+        port = dut.ports[0]
+        user_port = LiteDRAMNativePort("both", port.address_width, port.data_width)
+        dut.submodules.combiner = LiteDRAMNativeWriteCombiner(user_port, port,
+            perf_counters=dut.controller.multiplexer.perf_counters)
+        # Partial write, then read hitting the buffer (its written byte is merged in the read data).
+        driver   = PortDriver(user_port, [(0x10, 0x34)])
+        counters = {}
+
+        def wdata_generator():
+            yield user_port.wdata.valid.eq(1)
+            yield user_port.wdata.data.eq(0x34)
+            yield user_port.wdata.we.eq(0b01)
+            yield
+            while (yield user_port.wdata.ready) == 0:
+                yield
+            yield user_port.wdata.valid.eq(0)
+            driver.writes_done = True
+
+        generators = [timeout_generator(200), counters_generator(dut, [driver], counters)]
+        generators += [driver.generators()[0], wdata_generator(), driver.rdata_generator()]
+        run_simulation(dut, generators)
+        self.assertEqual(driver.rdatas[0] & 0xff, 0x34)
+        self.assertEqual(counters["port0_read_hits"], 1)
+        self.assertEqual(counters["port0_merges"],    0)
+        self.assertEqual(counters["reads"],           1)
+
+    def test_latency_histogram(self):
+        for burst_len in [1, 4]:
+            with self.subTest(burst_len=burst_len):
+                dut    = CoreDUT("MT48LC16M16", cmd_max_len=burst_len)
+                writes = [(addr, addr) for addr in range(32)]
+                driver = PortDriver(dut.ports[0], writes, burst_len)
+                dut.submodules.histogram = histogram = LatencyHistogram(dut.ports[0])
+                stats  = {}
+
+                def histogram_generator():
+                    while len(driver.rdatas) < len(writes):
+                        yield
+                    yield histogram.update.re.eq(1)
+                    yield
+                    yield histogram.update.re.eq(0)
+                    yield
+                    for name in ["min", "max", "sum", "count"]:
+                        stats[name] = (yield getattr(histogram, name).status)
+                    stats["buckets"] = []
+                    for n in range(16):
+                        stats["buckets"].append((yield getattr(histogram, "bucket{}".format(n)).status))
+
+                generators = [timeout_generator(len(writes)*200), histogram_generator()]
+                run_simulation(dut, generators + driver.generators())
+                self.assertEqual(stats["count"], len(writes)//burst_len)
+                self.assertEqual(sum(stats["buckets"]), stats["count"])
+                self.assertGreater(stats["min"], dut.crossbar.read_latency)
+                self.assertLessEqual(stats["min"]*stats["count"], stats["sum"])
+                self.assertLessEqual(stats["sum"], stats["max"]*stats["count"])
+                # The latencies are binned in log2 buckets.
+                self.assertEqual(max(n for n, b in enumerate(stats["buckets"]) if b),
+                    bits_for(stats["max"]))
+
+    def test_bank_machine_pool(self):
+        for module, nbank_machines in [("MT48LC16M16", 1), ("MT41K128M16", 3)]:
+            with self.subTest(module=module, nbank_machines=nbank_machines):
+                dut = self.core_test(module, nports=2, nbank_machines=nbank_machines)
+                self.assertTrue(hasattr(dut.controller, "bank_machine_pool"))
+        self.core_test("MT48LC16M16", nports=2, nbank_machines=2, page_policy="CLOSED")
+
+    @slow_test
+    def test_bank_machine_pool_throughput(self):
+        # A sequential stream (accessing one bank at a time) is served by a pool of 2 BankMachines
+        # within 10% of the cycles of the 4 BankMachines.
+        cycles = self.sequential_test()
+        self.assertLess(self.sequential_test(nbank_machines=2), 1.1*cycles)
+
+    def sequential_test(self, naccesses=256, **kwargs):
+        # Write then read back a sequential stream, return the number of cycles to complete it.
+        dut    = CoreDUT("MT48LC16M16", **kwargs)
+        writes = [(addr, addr) for addr in range(naccesses)]
+        driver = PortDriver(dut.ports[0], writes)
+        cycles = [0]
+
+        def cycle_generator():
+            while len(driver.rdatas) < len(writes):
+                cycles[0] += 1
+                yield
+
+        generators = [timeout_generator(naccesses*200), cycle_generator()]
+        run_simulation(dut, generators + driver.generators())
+        self.assertEqual(driver.rdatas, [data for addr, data in writes])
+        return cycles[0]
+
+    def test_spec_activate(self):
+        for module, page_policy in [("MT48LC16M16", "OPEN"), ("MT41K128M16", "ADAPTIVE")]:
+            with self.subTest(module=module, page_policy=page_policy):
+                self.core_test(module, nports=2, with_spec_activate=True, page_policy=page_policy)
+
+    @slow_test
+    def test_spec_activate_throughput(self):
+        # The next rows of the sequential streams are opened early.
+        for address_mapping in ["ROW_BANK_COL", "BANK_ROW_COL"]:
+            with self.subTest(address_mapping=address_mapping):
+                cycles = self.sequential_test(naccesses=512, address_mapping=address_mapping)
+                self.assertLess(self.sequential_test(naccesses=512, address_mapping=address_mapping,
+                    with_spec_activate=True), cycles)
+
+    def test_per_bank_refresh(self):
+        # The banks are refreshed in turn (every tREFI/8) while the other banks serve the accesses.
+        self.core_test("EDF8132A1MC", nports=2, refresh_per_bank=True, check_timings=True)
+        # Auto Refresh commands always refresh all the banks on the other memories.
+        with self.assertRaises(AssertionError):
+            CoreDUT("MT41K128M16", refresh_per_bank=True)
+
+    def test_ddr4_bank_groups(self):
+        # The DFI timings checker verifies the tCCD_L/tRRD_L of the commands to the same bank group
+        # (the bursts issue consecutive CAS commands to the same bank).
+        dut = self.core_test("MT40A256M16", nports=2, burst_len=4, cmd_max_len=4, check_timings=True)
+        self.assertEqual(dut.module.geom_settings.groupbits, 1)
+
+    def test_turnarounds(self):
+        # Port 1 has the priority: it reads back while port 0 is still writing.
+        for module in ["MT48LC16M16", "MT41K128M16"]:
+            with self.subTest(module=module):
+                self.core_test(module, nports=2, qos=[{}, {"priority": 1}], check_timings=True)
@@ -0,0 +1,79 @@
+# This file is Copyright (c) 2026 agent <agent@local>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect import stream
+
+from litedram.common import cmd_request_rw_layout
+from litedram.core.multiplexer import _CommandChooser
+
+
+class TestMultiplexer(unittest.TestCase):
+    def command_chooser_test(self, policy, age_cap, ncycles, allowed=0b11, preferred=0b00):
+        # Request 0 is an ACTIVATE, request 1 is a READ (row hit), both always valid.
+        class DUT(Module):
+            def __init__(self):
+                self.requests = [stream.Endpoint(cmd_request_rw_layout(a=16, ba=3)) for _ in range(2)]
+                self.submodules.chooser = _CommandChooser(self.requests, policy=policy, age_cap=age_cap)
+
+        def generator(dut):
+            act, read = dut.requests
+            yield act.valid.eq(1)
+            yield act.is_cmd.eq(1)
+            yield act.ras.eq(1)
+            yield read.valid.eq(1)
+            yield read.is_read.eq(1)
+            yield read.cas.eq(1)
+            yield dut.chooser.want_cmds.eq(1)
+            yield dut.chooser.want_activates.eq(1)
+            yield dut.chooser.want_reads.eq(1)
+            yield dut.chooser.cmd.ready.eq(1)
+            yield dut.chooser.allowed.eq(allowed)
+            yield dut.chooser.preferred.eq(preferred)
+            for i in range(ncycles):
+                yield
+                if (yield act.ready):
+                    dut.grants.append("act")
+                if (yield read.ready):
+                    dut.grants.append("read")
+
+        dut = DUT()
+        dut.grants = []
+        run_simulation(dut, generator(dut))
+        return dut.grants
+
+    def test_command_chooser_round_robin(self):
+        grants = self.command_chooser_test("ROUND_ROBIN", age_cap=4, ncycles=16)
+        self.assertEqual(grants.count("act"), grants.count("read"))
+
+    def test_command_chooser_fr_fcfs(self):
+        grants = self.command_chooser_test("FR_FCFS", age_cap=4, ncycles=32)
+        # Row hits are preferred...
+        self.assertGreater(grants.count("read"), 2*grants.count("act"))
+        # ...but the activate is not starved.
+        self.assertNotEqual(grants.count("act"), 0)
+        act_indexes = [i for i, g in enumerate(grants) if g == "act"]
+        for i, j in zip(act_indexes, act_indexes[1:]):
+            self.assertLessEqual(j - i, 4 + 2)
+
+    def test_command_chooser_allowed(self):
+        # Requests that are not allowed are not arbitrated.
+        for policy in ["ROUND_ROBIN", "FR_FCFS"]:
+            grants = self.command_chooser_test(policy, age_cap=4, ncycles=16, allowed=0b01)
+            self.assertEqual(grants, ["act"]*len(grants))
+            grants = self.command_chooser_test(policy, age_cap=4, ncycles=16, allowed=0b10)
+            self.assertEqual(grants, ["read"]*len(grants))
+
+    def test_command_chooser_preferred(self):
+        # Preferred requests are arbitrated first (from the 1st arbitration, the initial grant is the
+        # request 0)...
+        grants = self.command_chooser_test("ROUND_ROBIN", age_cap=4, ncycles=16, preferred=0b01)
+        self.assertEqual(grants, ["act"]*len(grants))
+        grants = self.command_chooser_test("ROUND_ROBIN", age_cap=4, ncycles=16, preferred=0b10)
+        self.assertEqual(grants[1:], ["read"]*(len(grants) - 1))
+        # ...within the priority levels of FR_FCFS: row hits are still preferred.
+        grants = self.command_chooser_test("FR_FCFS", age_cap=4, ncycles=32, preferred=0b01)
+        self.assertGreater(grants.count("read"), 2*grants.count("act"))
@@ -66,7 +66,7 @@ class TestRefresh(unittest.TestCase):
         for i in range(1, 32):
             self.refresh_timer_test(i)
 
-    def refresher_test(self, postponing):
+    def get_refresher_settings(self):
         class Obj: pass
         settings = Obj()
         settings.with_refresh = True
@@ -81,6 +81,10 @@ class TestRefresh(unittest.TestCase):
         settings.geom.bankbits    = 3
         settings.phy = Obj()
         settings.phy.nranks = 1
+        return settings
+
+    def refresher_test(self, postponing):
+        settings = self.get_refresher_settings()
 
         def generator(dut):
             dut.errors = 0
@@ -106,3 +110,88 @@ class TestRefresh(unittest.TestCase):
     def test_refresher(self):
         for i in [1, 2, 4, 8]:
             self.refresher_test(postponing=i)
+
+    def elastic_refresher_test(self, postponing, idle, **kwargs):
+        settings = self.get_refresher_settings()
+        trefi    = settings.timing.tREFI
+
+        def generator(dut):
+            dut.refreshs = []
+            yield dut.idle.eq(idle)
+            yield dut.cmd.ready.eq(1)
+            cmd_valid = 0
+            for i in range(16*trefi + trefi//2):
+                if (yield dut.cmd.valid) and not cmd_valid:
+                    dut.refreshs.append(i)
+                cmd_valid = (yield dut.cmd.valid)
+                yield
+
+        dut = Refresher(settings, clk_freq=100e6, postponing=postponing, elastic=True, **kwargs)
+        run_simulation(dut, [generator(dut)])
+        return dut.refreshs
+
+    def test_elastic_refresher_busy(self):
+        # Refreshs are postponed up to N, then forced on each tREFI period.
+        for postponing in [1, 2, 4, 8]:
+            refreshs = self.elastic_refresher_test(postponing, idle=0)
+            trefi    = self.get_refresher_settings().timing.tREFI
+            self.assertEqual(len(refreshs), 16 - postponing + 1)
+            self.assertEqual(refreshs[0], postponing*trefi + 1)
+            for a, b in zip(refreshs, refreshs[1:]):
+                self.assertEqual(b - a, trefi)
+
+    def test_elastic_refresher_idle(self):
+        # 8 refreshs are pulled in (in addition to the 1st one), then refreshs are issued on each
+        # tREFI period.
+        for postponing in [1, 2, 4, 8]:
+            refreshs = self.elastic_refresher_test(postponing, idle=1)
+            trefi    = self.get_refresher_settings().timing.tREFI
+            self.assertEqual(len(refreshs), 16 + 8)
+            self.assertLess(refreshs[8], trefi + 8)
+            for a, b in zip(refreshs[9:], refreshs[10:]):
+                self.assertEqual(b - a, trefi)
+
+    def test_elastic_refresher_max_pull_in(self):
+        # max_pull_in refreshs are pulled in (in addition to the 1st one).
+        for max_pull_in in [1, 2, 4]:
+            refreshs = self.elastic_refresher_test(1, idle=1, max_pull_in=max_pull_in)
+            trefi    = self.get_refresher_settings().timing.tREFI
+            self.assertEqual(len(refreshs), 16 + max_pull_in)
+            self.assertLess(refreshs[max_pull_in], trefi + 8)
+
+    def test_elastic_refresher_idle_cycles(self):
+        # The 1st refresh is pulled in once the controller has been idle for idle_cycles.
+        for idle_cycles in [16, 64]:
+            refreshs = self.elastic_refresher_test(1, idle=1, idle_cycles=idle_cycles)
+            self.assertGreaterEqual(refreshs[0], idle_cycles)
+            self.assertLess(refreshs[0], idle_cycles + 8)
+
+    def test_per_bank_refresher(self):
+        settings = self.get_refresher_settings()
+        settings.phy.memtype   = "LPDDR3"
+        settings.timing.tRFCpb = 2
+        settings.timing.tZQCS  = None
+
+        def generator(dut):
+            dut.errors = 0
+            yield dut.cmd.ready.eq(1)
+            for i in range(16):
+                while (yield dut.cmd.valid) == 0:
+                    yield
+                # Only the BankMachine of the refreshed bank is concerned, banks are refreshed in turn.
+                if (yield dut.banks) != 2**(i%8):
+                    dut.errors += 1
+                # Per-Bank Auto Refresh to the refreshed bank (no Precharge All).
+                refreshs = 0
+                while (yield dut.cmd.valid) == 1:
+                    if (yield dut.cmd.ras):
+                        if not (yield dut.cmd.cas) or (yield dut.cmd.ba) != i%8:
+                            dut.errors += 1
+                        refreshs += 1
+                    yield
+                if refreshs != 1:
+                    dut.errors += 1
+
+        dut = Refresher(settings, clk_freq=100e6, per_bank=True)
+        run_simulation(dut, [generator(dut)])
+        self.assertEqual(dut.errors, 0)
@@ -6,7 +6,7 @@ import random
 
 from migen import *
 
-from litedram.common import tXXDController, tFAWController
+from litedram.common import tXXDController, tFAWController, get_turnarounds
 
 
 def c2bool(c):
@@ -112,3 +112,10 @@ class TestTiming(unittest.TestCase):
         valids = "_-_-____-_-______"
         readys = "-----------------"
         self.tfaw_controller_test(tfaw, valids, readys)
+
+    def test_turnarounds(self):
+        # SDR: write data presented with the command, 1 cycle of bus turnaround.
+        self.assertEqual(get_turnarounds("SDR", cl=2, cwl=2, twtr=2), (4, 3, 4, 1, 2))
+        # DDR3: BL8 (4 memory clk cycles), 2 cycles of bus turnaround.
+        self.assertEqual(get_turnarounds("DDR3", cl=6, cwl=5, twtr=4), (7, 13, 7, 5, 6))
+        self.assertEqual(get_turnarounds("DDR3", cl=6, cwl=5, twtr=4, trtrs=3), (7, 13, 8, 6, 7))